@@ -12,6 +12,23 @@ class Settings(BaseSettings):
     # Base de datos MongoDB
     DB_URI: str
     DB_NAME: str = "kandastory"
+    # Pool de conexiones: dimensionar frente a la concurrencia de cada proceso (API o worker)
+    DB_MAX_POOL_SIZE: int = 100
+    DB_MIN_POOL_SIZE: int = 0
+    DB_MAX_CONNECTING: int = 2
+    DB_WAIT_QUEUE_TIMEOUT_MS: int = 0        # 0 = esperar sin límite por una conexión libre
+    DB_MAX_IDLE_TIME_MS: int = 0             # 0 = no cerrar conexiones ociosas
+    DB_SERVER_SELECTION_TIMEOUT_MS: int = 30000
+    DB_COMPRESSORS: str = ""                 # p.ej. "zstd,snappy,zlib" (zstd/snappy requieren su paquete)
+    DB_WRITE_CONCERN: str = ""               # "" (el de la URI/servidor), "majority", "1"...
+    DB_WRITE_TIMEOUT_MS: int = 0
+    DB_READ_CONCERN: str = ""                # "", "local", "majority"...
+    DB_APP_NAME: str = ""                    # aparece en los logs de Mongo; por defecto APP_NAME
+    HEALTH_DB_TIMEOUT_SECONDS: float = 2.0   # /health responde 503 si el ping a Mongo tarda más
+    # Lecturas en secundarios para catálogos y exportaciones (ver READ_POLICIES en core/database.py)
+    DB_SECONDARY_READS_ENABLED: bool = True
+    DB_READ_MAX_STALENESS_SECONDS: int = 90  # mínimo admitido por Mongo: 90; 0 = sin límite
+    DB_READ_ROUTING: str = ""                # overrides "endpoint=primary|secondary|causal,..."
 
     # JWT para autenticación
     JWT_SECRET: str
@@ -31,7 +48,87 @@ class Settings(BaseSettings):
     # Optional tuning for GPT-5 style models (no aplicará con gpt-4o-mini)
     OPENAI_REASONING_EFFORT: str = "medium"  # minimal | low | medium | high
     OPENAI_TEXT_VERBOSITY: str = "medium"    # low | medium | high
+    # Caché persistente de evaluaciones de personajes (días antes de expirar)
+    CHAR_EVAL_CACHE_TTL_DAYS: int = 30
+    CHAR_EVAL_BATCH_MAX_ITEMS: int = 6
+    # Planificador global de llamadas al LLM (límites de la cuenta OpenAI; <= 0 desactiva)
+    LLM_RPM_LIMIT: int = 500
+    LLM_TPM_LIMIT: int = 200000
+    LLM_DEFAULT_COMPLETION_TOKENS: int = 1000  # salida estimada cuando no se fija max_tokens
+    # Reintentos (solo 429 / conexión / 502-504) y circuit breaker del proveedor
+    LLM_REQUEST_TIMEOUT_SECONDS: float = 120.0
+    LLM_MAX_RETRIES: int = 2
+    LLM_BACKOFF_BASE_SECONDS: float = 0.5
+    LLM_BACKOFF_MAX_SECONDS: float = 8.0
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = 5   # fallos seguidos para abrir el circuito (<= 0 desactiva)
+    LLM_CIRCUIT_COOLDOWN_SECONDS: float = 30.0
+    # Hedging de capítulos: segunda petición si la primera no da tokens antes del percentil
+    LLM_HEDGING_ENABLED: bool = False
+    LLM_HEDGE_MODEL: str = ""                     # vacío = mismo modelo (p.ej. "gpt-4o-mini" como respaldo barato)
+    LLM_HEDGE_PERCENTILE: float = 0.95
+    LLM_HEDGE_DEFAULT_DEADLINE_SECONDS: float = 15.0  # hasta tener LLM_HEDGE_MIN_SAMPLES muestras
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+    LLM_HEDGE_LATENCY_SAMPLES: int = 200
+    # Pre-generar la continuación "sin acciones" mientras la fase de acciones está abierta
+    SPECULATIVE_CHAPTERS_ENABLED: bool = False
+    SPECULATIVE_CHAPTER_TTL_SECONDS: int = 3600
+    # Pre-generar el primer capítulo en la sala cuando mundo y personajes están elegidos
+    FIRST_CHAPTER_PREWARM_ENABLED: bool = False
+    # Presupuesto de tokens de entrada por capítulo (ver services/prompt_budget.py)
+    PROMPT_TOKEN_BUDGET: int = 6000
+    PROMPT_BUDGET_WORLD: int = 400
+    PROMPT_BUDGET_CHARACTERS: int = 2400
+    PROMPT_BUDGET_ACTIONS: int = 1000
+    PROMPT_HISTORY_RECENT_TOKENS: int = 300  # por capítulo, los dos últimos
+    PROMPT_HISTORY_OLDER_TOKENS: int = 100   # por capítulo, el resto
+    PROMPT_HISTORY_MIN_TOKENS: int = 400     # el historial nunca baja de aquí
+    PROMPT_BUDGET_RETRIEVAL: int = 600       # pasajes recuperados con BM25 de capítulos antiguos (0 desactiva)
+    CHAPTER_RETRIEVAL_MAX_PASSAGES: int = 6
+    CHAPTER_INDEX_MAX_GAMES: int = 200       # partidas con índice en memoria (LRU)
+
+    # Proveedor del LLM: "openai" o "fake" (local y determinista, para pruebas de carga; ver services/llm_provider.py)
+    LLM_PROVIDER: str = "openai"
+    FAKE_LLM_LATENCY_P50_MS: int = 1500
+    FAKE_LLM_LATENCY_P95_MS: int = 4000
+    FAKE_LLM_TTFT_RATIO: float = 0.2          # fracción de la latencia hasta el primer token (streaming)
+    FAKE_LLM_COMPLETION_TOKENS: int = 900     # longitud del texto generado (limitado por max_tokens)
+    FAKE_LLM_ERROR_RATE: float = 0.0          # probabilidad de error por llamada
+    FAKE_LLM_ERROR_KINDS: str = "rate_limit,connection,overloaded,timeout"
+    FAKE_LLM_SEED: int = 0
+
+    # Generación de capítulos: "inline" (en el proceso de la API) o "queue" (cola en Mongo
+    # consumida por `python -m app.worker`, ver services/generation_queue.py)
+    GENERATION_MODE: str = "inline"
+    GENERATION_WORKER_CONCURRENCY: int = 4   # trabajos simultáneos por proceso worker
+    GENERATION_WORKER_POLL_SECONDS: float = 0.5
+    GENERATION_JOB_LEASE_SECONDS: int = 60   # sin renovar en este tiempo, otro worker retoma el trabajo
+    GENERATION_JOB_MAX_ATTEMPTS: int = 3
+
+    # Precios por millón de tokens para el coste estimado, p.ej. {"gpt-4o-mini": [0.15, 0.075, 0.6]}
+    # (entrada, entrada cacheada, salida); vacío = tabla por defecto de services/llm_usage.py
+    LLM_PRICING_JSON: str = ""
+
+    # Vigilancia del event loop: captura la pila cuando el loop se bloquea más de LOOP_LAG_THRESHOLD_MS
+    LOOP_WATCHDOG_ENABLED: bool = True
+    LOOP_WATCHDOG_INTERVAL_MS: int = 50
+    LOOP_LAG_THRESHOLD_MS: int = 100
+    LOOP_WATCHDOG_MAX_SITES: int = 50        # puntos de llamada distintos que se guardan
+
+    # Perfilador por muestreo bajo demanda (/api/admin/profile): duración máxima de cada perfil
+    PROFILER_MAX_SECONDS: int = 30
+
+    # Exportación de historias: PDFs dibujándose a la vez por proceso (cada uno en un hilo)
+    EXPORT_PDF_MAX_CONCURRENT: int = 2
+
+    # Administración: IDs de usuario (separados por comas) con acceso a /api/admin
+    ADMIN_USER_IDS: str = ""
     
+    # WebSockets: heartbeat y limpieza de conexiones muertas
+    WS_HEARTBEAT_INTERVAL_SECONDS: int = 20  # cada cuánto se envía {"type": "ping"} y se barren conexiones
+    WS_IDLE_TIMEOUT_SECONDS: int = 60        # sin frames del cliente durante este tiempo -> se cierra
+    WS_REPLAY_BUFFER_SIZE: int = 200         # eventos recientes por canal para reanudar sesiones (resume_from)
+    WS_REPLAY_RETENTION_SECONDS: int = 900   # buffers de canales sin conexiones se descartan tras este tiempo
+
     # Frontend URL used to build links in emails (include scheme, e.g. https://...)
     FRONTEND_URL: str = "http://localhost:5174"
 
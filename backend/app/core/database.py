@@ -1,13 +1,215 @@
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+import importlib.util
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorClientSession, AsyncIOMotorDatabase
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+from pymongo.read_preferences import SecondaryPreferred
 from app.core.config import settings
 
 _client: AsyncIOMotorClient | None = None
 _db: AsyncIOMotorDatabase | None = None
 
+# Compresor de red -> módulo de Python que necesita el driver
+_COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+# Política de lectura por endpoint (solo lecturas; las escrituras del juego van siempre al primario):
+# - "primary": como hasta ahora.
+# - "secondary": secondaryPreferred con retraso acotado (DB_READ_MAX_STALENESS_SECONDS).
+# - "causal": secondaryPreferred dentro de una sesión causal; una primera lectura puntual en el
+#   primario fija el punto y las siguientes esperan en el secundario a que esté al día
+#   (read-your-writes: el capítulo recién generado siempre aparece).
+READ_POLICIES = {
+    "worlds.public": "secondary",
+    "rooms.public": "secondary",
+    "games.chapters": "causal",
+    "games.export": "causal",
+}
+_READ_POLICY_NAMES = {"primary", "secondary", "causal"}
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Uso del pool de conexiones a Mongo (eventos CMAP del driver), para /health."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = {}
+        self.pools_cleared = 0
+        self.waits = deque(maxlen=1000)
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pools_cleared += 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open = max(0, self.open - 1)
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.waits.append(getattr(event, "duration", 0.0) or 0.0)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            reason = str(getattr(event, "reason", "unknown"))
+            self.checkout_failures[reason] = self.checkout_failures.get(reason, 0) + 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            waits = sorted(self.waits)
+
+            def pct(p: float) -> float:
+                return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 2) if waits else 0.0
+
+            return {
+                "max_pool_size": settings.DB_MAX_POOL_SIZE,
+                "open_connections": self.open,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "utilization": round(self.checked_out / settings.DB_MAX_POOL_SIZE, 3) if settings.DB_MAX_POOL_SIZE else None,
+                "checkouts": self.checkouts,
+                "checkout_failures": dict(self.checkout_failures),
+                "checkout_wait_ms": {"p50": pct(0.50), "p95": pct(0.95), "max": round(waits[-1] * 1000, 2) if waits else 0.0},
+                "pool_cleared": self.pools_cleared,
+            }
+
+
+pool_stats = PoolStats()
+
+
+def _compressors() -> list:
+    """Compresores pedidos en DB_COMPRESSORS que el driver puede usar (con su módulo instalado)."""
+    available = []
+    for name in [c.strip().lower() for c in settings.DB_COMPRESSORS.split(",") if c.strip()]:
+        module = _COMPRESSOR_MODULES.get(name)
+        if module and importlib.util.find_spec(module) is not None:
+            available.append(name)
+        else:
+            print(f"[database] compresor '{name}' no disponible (falta el paquete '{module}'), se omite")
+    return available
+
+
+def client_options() -> dict:
+    """Opciones del cliente a partir de Settings (las vacías se dejan al valor del driver)."""
+    options = {
+        "maxPoolSize": settings.DB_MAX_POOL_SIZE,
+        "minPoolSize": settings.DB_MIN_POOL_SIZE,
+        "maxConnecting": settings.DB_MAX_CONNECTING,
+        "serverSelectionTimeoutMS": settings.DB_SERVER_SELECTION_TIMEOUT_MS,
+        "appname": settings.DB_APP_NAME or settings.APP_NAME,
+        "event_listeners": [pool_stats],
+    }
+    if settings.DB_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = settings.DB_WAIT_QUEUE_TIMEOUT_MS
+    if settings.DB_MAX_IDLE_TIME_MS:
+        options["maxIdleTimeMS"] = settings.DB_MAX_IDLE_TIME_MS
+    compressors = _compressors()
+    if compressors:
+        options["compressors"] = compressors
+    if settings.DB_WRITE_CONCERN:
+        w = settings.DB_WRITE_CONCERN
+        options["w"] = int(w) if w.isdigit() else w
+    if settings.DB_WRITE_TIMEOUT_MS:
+        options["wTimeoutMS"] = settings.DB_WRITE_TIMEOUT_MS
+    if settings.DB_READ_CONCERN:
+        options["readConcernLevel"] = settings.DB_READ_CONCERN
+    return options
+
+
+@lru_cache(maxsize=4)
+def _read_overrides(routing: str) -> dict:
+    overrides = {}
+    for item in routing.split(","):
+        endpoint, _, policy = item.partition("=")
+        endpoint, policy = endpoint.strip(), policy.strip().lower()
+        if endpoint and policy in _READ_POLICY_NAMES:
+            overrides[endpoint] = policy
+        elif endpoint:
+            print(f"[database] DB_READ_ROUTING: política inválida '{item.strip()}', se ignora")
+    return overrides
+
+
+def read_policy(endpoint: str) -> str:
+    if not settings.DB_SECONDARY_READS_ENABLED:
+        return "primary"
+    return _read_overrides(settings.DB_READ_ROUTING).get(endpoint) or READ_POLICIES.get(endpoint, "primary")
+
+
+def read_routing() -> dict:
+    """Política efectiva de cada endpoint (para /health)."""
+    return {endpoint: read_policy(endpoint) for endpoint in READ_POLICIES}
+
+
+def _secondary_preference() -> SecondaryPreferred:
+    staleness = settings.DB_READ_MAX_STALENESS_SECONDS
+    return SecondaryPreferred(max_staleness=max(90, staleness) if staleness > 0 else -1)
+
+
+class RoutedReads:
+    """Bases para las lecturas de un endpoint.
+
+    `anchor`: lecturas puntuales que fijan el punto causal (primario en modo causal).
+    `db`: lecturas pesadas (listados, capítulos) según la política.
+    `session`: sesión causal, o None; pasarla a todas las lecturas.
+    """
+
+    def __init__(self, anchor: AsyncIOMotorDatabase, db: AsyncIOMotorDatabase,
+                 session: Optional[AsyncIOMotorClientSession] = None):
+        self.anchor = anchor
+        self.db = db
+        self.session = session
+
+
+@asynccontextmanager
+async def routed_reads(db: AsyncIOMotorDatabase, endpoint: str) -> AsyncIterator[RoutedReads]:
+    policy = read_policy(endpoint)
+    if policy == "primary":
+        yield RoutedReads(db, db)
+        return
+    reader = db.with_options(read_preference=_secondary_preference())
+    if policy == "secondary":
+        yield RoutedReads(reader, reader)
+        return
+    try:
+        session = await db.client.start_session(causal_consistency=True)
+    except PyMongoError as e:
+        # Despliegue sin sesiones: mejor leer del primario que arriesgar datos viejos
+        print(f"[database] sin sesión causal para {endpoint} ({e}), se lee del primario")
+        yield RoutedReads(db, db)
+        return
+    async with session:
+        yield RoutedReads(db, reader, session)
+
+
 async def get_client() -> AsyncIOMotorClient:
     global _client
     if _client is None:
-        _client = AsyncIOMotorClient(settings.DB_URI)
+        _client = AsyncIOMotorClient(settings.DB_URI, **client_options())
     return _client
 
 async def get_db() -> AsyncIOMotorDatabase:
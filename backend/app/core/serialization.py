@@ -0,0 +1,107 @@
+"""Serialización compartida para respuestas HTTP y frames WebSocket.
+
+Usa orjson cuando está instalado y cae a la librería estándar si no lo está.
+Los tipos de Mongo que no son JSON nativo (ObjectId, datetime) se resuelven con
+un hook `default`, de modo que no hace falta recorrer y copiar cada documento
+antes de serializarlo.
+
+Los WebSockets pueden negociar además frames MessagePack (binarios) si la
+dependencia opcional `msgpack` está instalada.
+"""
+import json
+from datetime import date, datetime
+from typing import Any
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependencia opcional
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - dependencia opcional
+    msgpack = None
+
+# Codificaciones de frame WebSocket
+ENCODING_JSON = "json"
+ENCODING_MSGPACK = "msgpack"
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+
+def _default(obj: Any) -> Any:
+    """Hook para tipos no nativos: ObjectId -> str, fechas -> ISO 8601."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(obj: Any) -> str:
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def dumps(obj: Any) -> bytes:
+    """Serializa `obj` a JSON (bytes UTF-8)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+        except (TypeError, orjson.JSONEncodeError):
+            # p.ej. enteros fuera de 64 bits: la librería estándar sí los acepta
+            pass
+    return _stdlib_dumps(obj).encode("utf-8")
+
+
+def dumps_text(obj: Any) -> str:
+    """Serializa `obj` a JSON como `str` (para `websocket.send_text`)."""
+    if orjson is not None:
+        return dumps(obj).decode("utf-8")
+    return _stdlib_dumps(obj)
+
+
+def loads(data: str | bytes) -> Any:
+    """Parsea JSON (str o bytes)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def negotiate_encoding(requested: str | None) -> str:
+    """Codificación efectiva para un cliente; cae a JSON si no se soporta."""
+    if (requested or "").lower() == ENCODING_MSGPACK and msgpack is not None:
+        return ENCODING_MSGPACK
+    return ENCODING_JSON
+
+
+def encode_frame(message: Any, encoding: str) -> str | bytes:
+    """Codifica un mensaje WebSocket: `str` para JSON, `bytes` para MessagePack."""
+    if encoding == ENCODING_MSGPACK:
+        # datetime=False -> las fechas pasan por el hook y viajan como ISO, igual que en JSON
+        return msgpack.packb(message, default=_default, use_bin_type=True, datetime=False)
+    return dumps_text(message)
+
+
+def decode_frame(data: str | bytes) -> Any:
+    """Decodifica un frame entrante: texto JSON o binario MessagePack."""
+    if isinstance(data, (bytes, bytearray)):
+        if msgpack is None:
+            return loads(data)
+        return msgpack.unpackb(data, raw=False)
+    return loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse que serializa con `dumps` (ObjectId/datetime incluidos).
+
+    Devolverla directamente desde un endpoint evita el `jsonable_encoder` de
+    FastAPI y cualquier recorrido previo del documento.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
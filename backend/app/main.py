@@ -1,13 +1,21 @@
+import asyncio
+import time
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
-from app.core.database import close_db
-from app.routers import auth, characters, rooms, worlds, websockets, games, connectivity
+from app.core.database import close_db, get_db, pool_stats, read_routing
+from app.core.serialization import FastJSONResponse
+from app.routers import auth, characters, rooms, worlds, websockets, games, connectivity, admin
+from app.services import prompt_budget
+from app.services.llm_scheduler import llm_scheduler
+from app.services.loop_watchdog import loop_watchdog
 
 app = FastAPI(
     title=settings.APP_NAME,
     description="Backend API para KandaStory - Plataforma de narrativa colaborativa con IA",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse,
 )
 
 # CORS Configuration - IMPORTANTE: Debe ir ANTES de los routers
@@ -42,6 +50,7 @@ app.include_router(worlds.router, prefix=settings.API_PREFIX, tags=["worlds"])
 app.include_router(websockets.router, prefix=settings.API_PREFIX, tags=["websockets"])
 app.include_router(games.router)
 app.include_router(connectivity.router, prefix=settings.API_PREFIX, tags=["connectivity"])
+app.include_router(admin.router, prefix=settings.API_PREFIX, tags=["admin"])
 
 @app.get("/")
 async def root():
@@ -56,14 +65,23 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Detailed health check"""
-    return {
-        "status": "healthy",
+    """Detailed health check: ping real a Mongo y uso del pool de conexiones (503 si la base no responde)"""
+    database = {"status": "connected", "pool": pool_stats.snapshot(), "read_routing": read_routing()}
+    started = time.monotonic()
+    try:
+        db = await get_db()
+        await asyncio.wait_for(db.command("ping"), timeout=settings.HEALTH_DB_TIMEOUT_SECONDS)
+        database["ping_ms"] = round((time.monotonic() - started) * 1000, 1)
+    except Exception as e:
+        database.update({"status": "unreachable", "error": f"{type(e).__name__}: {e}"})
+    healthy = database["status"] == "connected"
+    return FastJSONResponse({
+        "status": "healthy" if healthy else "unhealthy",
         "service": settings.APP_NAME,
-        "database": "connected",  # TODO: Add actual DB health check
+        "database": database,
         "cors_origins": origins,
         "api_prefix": settings.API_PREFIX
-    }
+    }, status_code=200 if healthy else 503)
 
 @app.on_event("startup")
 async def startup_event():
@@ -72,10 +90,21 @@ async def startup_event():
     print(f"📖 Documentación disponible en: /docs")
     print(f"🔧 API Prefix: {settings.API_PREFIX}")
     print(f"🌐 CORS Origins: {origins}")
+
+    # Heartbeat y barrido de WebSockets inactivos
+    websockets.manager.start_heartbeat()
+
+    # Planificador de llamadas al LLM (despachador en este event loop)
+    llm_scheduler.start()
+
+    # Detección de llamadas síncronas que bloquean el event loop
+    loop_watchdog.start()
+
+    # Tokenizador para el presupuesto de prompts (la primera carga puede descargar ficheros)
+    print(f"🔢 Tokenizador de prompts: {await asyncio.to_thread(prompt_budget.warm_up)}")
     
     # Insertar mundos por defecto al iniciar la aplicación
     try:
-        from app.core.database import get_db
         from app.routers.worlds import insert_default_worlds
         db = await get_db()
         await insert_default_worlds(db)
@@ -90,12 +119,40 @@ async def startup_event():
             print("✅ Índices creados para colecciones de juegos (game_id)")
         except Exception as ie:
             print(f"⚠️  Error creando índices: {ie}\n")
+
+        # TTL para la caché de evaluaciones de personajes
+        try:
+            from app.services.character_eval_cache import ensure_indexes as ensure_eval_cache_indexes
+            await ensure_eval_cache_indexes(db)
+        except Exception as ie:
+            print(f"⚠️  Error creando índice de caché de evaluaciones: {ie}")
+
+        # Cola de generación: índices, colección de eventos y reenvío de los eventos de los workers
+        try:
+            from app.services.generation_queue import ensure_collections as ensure_generation_queue
+            await ensure_generation_queue(db)
+            if settings.GENERATION_MODE == "queue":
+                websockets.manager.start_event_relay(db)
+                print("✅ Generación en workers: reenviando eventos de generation_events")
+        except Exception as ie:
+            print(f"⚠️  Error preparando la cola de generación: {ie}")
+
+        # Agregados de consumo del LLM (top por coste)
+        try:
+            from app.services.llm_usage import ensure_indexes as ensure_llm_usage_indexes
+            await ensure_llm_usage_indexes(db)
+        except Exception as ie:
+            print(f"⚠️  Error creando índice de consumo del LLM: {ie}")
     except Exception as e:
         print(f"⚠️  Error inicializando mundos por defecto: {e}")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Eventos de cierre de la aplicación"""
+    websockets.manager.stop_heartbeat()
+    websockets.manager.stop_event_relay()
+    llm_scheduler.stop()
+    loop_watchdog.stop()
     print("🛑 Cerrando conexiones de base de datos...")
     await close_db()
     print("✅ Aplicación cerrada correctamente")
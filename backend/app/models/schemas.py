@@ -76,6 +76,9 @@ class CharacterEvaluation(BaseModel):
     suggested_corrections: 'CharacterCreate'
     needs_improvement: bool = True
 
+class CharacterBatchEvaluationRequest(BaseModel):
+    characters: List[CharacterCreate] = Field(..., min_length=1)
+
 class CharacterCorrectionRequest(BaseModel):
     original_character: CharacterCreate
     accept_suggestions: bool = False
@@ -0,0 +1,168 @@
+import asyncio
+import threading
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+
+from app.core.config import settings
+from app.core.database import get_db
+from app.routers.auth import get_current_user
+from app.services import llm_resilience
+from app.services.generation_queue import queue_stats
+from app.services.chapter_index import passage_index
+from app.services.llm_hedging import hedge_stats
+from app.services.llm_scheduler import llm_scheduler
+from app.services.loop_watchdog import loop_watchdog
+from app.services.llm_usage import SCOPES, prompt_cache_ratio, top_consumers
+from app.services.prompt_budget import budget_stats
+from app.services.sampling_profiler import ProfilerBusyError, sampling_profiler
+from app.services.speculation import first_chapter_prewarmer, speculator
+
+router = APIRouter(prefix="/admin")
+
+
+def _admin_ids() -> set:
+    return {uid.strip() for uid in settings.ADMIN_USER_IDS.split(",") if uid.strip()}
+
+
+async def get_current_admin(user=Depends(get_current_user)):
+    """Usuario autenticado cuyo ID está en ADMIN_USER_IDS."""
+    if str(user["_id"]) not in _admin_ids():
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Solo administradores")
+    return user
+
+
+@router.get("/llm/scheduler")
+async def llm_scheduler_status(admin=Depends(get_current_admin)):
+    """Límites, cupo disponible, colas y tiempos de espera del planificador de LLM"""
+    return llm_scheduler.snapshot()
+
+
+@router.get("/llm/resilience")
+async def llm_resilience_status(admin=Depends(get_current_admin)):
+    """Estado del circuit breaker, reintentos y errores clasificados de las llamadas al LLM"""
+    return llm_resilience.snapshot()
+
+
+@router.get("/llm/hedging")
+async def llm_hedging_status(admin=Depends(get_current_admin)):
+    """Plazo actual, peticiones de respaldo lanzadas/ganadas y tokens extra gastados"""
+    return hedge_stats.snapshot()
+
+
+@router.get("/llm/prompt-budget")
+async def llm_prompt_budget_status(admin=Depends(get_current_admin)):
+    """Tokens de prompt por sección, recortes por presupuesto y tokens facturados frente a estimados"""
+    return budget_stats.snapshot()
+
+
+@router.get("/llm/chapter-index")
+async def llm_chapter_index_status(admin=Depends(get_current_admin)):
+    """Partidas y pasajes en el índice BM25 de capítulos, búsquedas y reconstrucciones"""
+    return passage_index.snapshot()
+
+
+@router.get("/llm/speculation")
+async def llm_speculation_status(admin=Depends(get_current_admin)):
+    """Capítulos especulativos lanzados, usados, descartados y tokens desperdiciados"""
+    return speculator.snapshot()
+
+
+@router.get("/llm/prewarm")
+async def llm_prewarm_status(admin=Depends(get_current_admin)):
+    """Primeros capítulos pre-generados en salas: lanzados, usados, invalidados y tokens desperdiciados"""
+    return first_chapter_prewarmer.snapshot()
+
+
+@router.get("/llm/prompt-cache")
+async def llm_prompt_cache_status(
+    limit: int = Query(50, ge=1, le=500),
+    db=Depends(get_db),
+    admin=Depends(get_current_admin),
+):
+    """Ratio de tokens de prompt servidos desde la caché del proveedor, por partida (más recientes primero)"""
+    games = []
+    totals = {"prompt_tokens": 0, "cached_tokens": 0}
+    cursor = db["games"].find(
+        {"prompt_cache": {"$exists": True}},
+        {"name": 1, "game_state": 1, "prompt_cache": 1},
+    ).sort("_id", -1).limit(limit)
+    async for g in cursor:
+        stats = g.get("prompt_cache") or {}
+        totals["prompt_tokens"] += stats.get("prompt_tokens", 0)
+        totals["cached_tokens"] += stats.get("cached_tokens", 0)
+        games.append({
+            "game_id": str(g["_id"]),
+            "name": g.get("name"),
+            "game_state": g.get("game_state"),
+            "calls": stats.get("calls", 0),
+            "prompt_tokens": stats.get("prompt_tokens", 0),
+            "cached_tokens": stats.get("cached_tokens", 0),
+            "cached_ratio": prompt_cache_ratio(stats),
+        })
+    return {"games": games, "totals": {**totals, "cached_ratio": prompt_cache_ratio(totals)}}
+
+
+_USAGE_METRICS = ("cost_usd", "prompt_tokens", "completion_tokens", "calls", "latency_ms", "retries", "fallbacks")
+
+
+@router.get("/llm/usage/top")
+async def llm_usage_top(
+    scope: str = Query("game"),
+    metric: str = Query("cost_usd"),
+    limit: int = Query(20, ge=1, le=200),
+    db=Depends(get_db),
+    admin=Depends(get_current_admin),
+):
+    """Mayores consumidores del LLM por partida, mundo o usuario (coste, tokens, latencia...)"""
+    if scope not in SCOPES:
+        raise HTTPException(status_code=400, detail=f"scope debe ser uno de: {', '.join(SCOPES)}")
+    if metric not in _USAGE_METRICS:
+        raise HTTPException(status_code=400, detail=f"metric debe ser uno de: {', '.join(_USAGE_METRICS)}")
+    return {"scope": scope, "metric": metric, "items": await top_consumers(db, scope, metric, limit)}
+
+
+@router.get("/generation/queue")
+async def generation_queue_status(db=Depends(get_db), admin=Depends(get_current_admin)):
+    """Trabajos de generación por estado, antigüedad de la cola, workers ocupados y duración (p50/p95)"""
+    return await queue_stats(db)
+
+
+@router.get("/loop/lag")
+async def loop_lag_status(
+    limit: int = Query(20, ge=1, le=200),
+    reset: bool = Query(False),
+    admin=Depends(get_current_admin),
+):
+    """Retraso del event loop y llamadas síncronas que lo bloquearon, por punto de llamada"""
+    snapshot = loop_watchdog.snapshot(limit)
+    if reset:
+        loop_watchdog.reset()
+    return snapshot
+
+
+@router.get("/profile")
+async def profile_process(
+    seconds: float = Query(10, gt=0),
+    hz: int = Query(100, ge=1, le=1000),
+    mode: str = Query("wall"),
+    idle: bool = Query(True),
+    format: str = Query("json"),
+    admin=Depends(get_current_admin),
+):
+    """Perfil por muestreo (wall o CPU) de este proceso, con atribución por tarea asyncio y router.
+    `format=folded` devuelve texto para flamegraph.pl / speedscope."""
+    if mode not in ("wall", "cpu"):
+        raise HTTPException(status_code=400, detail="mode debe ser wall o cpu")
+    if format not in ("json", "folded"):
+        raise HTTPException(status_code=400, detail="format debe ser json o folded")
+    try:
+        # El muestreo corre en un hilo: el event loop sigue atendiendo (y se perfila)
+        result = await asyncio.to_thread(
+            sampling_profiler.run, seconds, hz, mode, idle, threading.get_ident(), asyncio.get_running_loop()
+        )
+    except ProfilerBusyError:
+        raise HTTPException(status_code=409, detail="Ya hay un perfil en curso en este proceso")
+    if format == "folded":
+        return PlainTextResponse(result["folded"] + "\n")
+    return result
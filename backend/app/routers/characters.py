@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from app.models.schemas import CharacterCreate, CharacterPublic, CharacterEvaluation
+from app.models.schemas import CharacterCreate, CharacterPublic, CharacterEvaluation, CharacterBatchEvaluationRequest
+from app.core.config import settings
 from app.core.database import get_db
-from app.services.ai_service import evaluate_character
+from app.services.character_eval_cache import evaluate_character_cached, evaluate_characters_cached
 from bson import ObjectId
 
 router = APIRouter()
@@ -31,18 +32,39 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db=Depends(get_d
         raise HTTPException(status_code=401, detail="Token inválido")
 
 
-@router.post("/characters/evaluate", response_model=CharacterEvaluation)
-async def evaluate_character_endpoint(data: CharacterCreate, user=Depends(get_current_user)):
-    """Evalúa un personaje y devuelve sugerencias de mejora"""
-    character_dict = data.model_dump()
-    ai_result = evaluate_character(character_dict)
-    
+def _evaluation_response(ai_result: dict, character_dict: dict) -> CharacterEvaluation:
+    try:
+        corrected = CharacterCreate(**ai_result.get("corrected_character", character_dict))
+    except Exception:
+        # Corrección mal formada: devolver el personaje original sin cambios
+        corrected = CharacterCreate(**character_dict)
     return CharacterEvaluation(
         evaluation_text=ai_result.get("evaluation_summary", "Evaluación completada"),
-        suggested_corrections=CharacterCreate(**ai_result.get("corrected_character", character_dict)),
+        suggested_corrections=corrected,
         needs_improvement=ai_result.get("needs_improvement", False)
     )
 
+
+@router.post("/characters/evaluate", response_model=CharacterEvaluation)
+async def evaluate_character_endpoint(data: CharacterCreate, db=Depends(get_db), user=Depends(get_current_user)):
+    """Evalúa un personaje y devuelve sugerencias de mejora (cacheado por contenido)"""
+    character_dict = data.model_dump()
+    ai_result = await evaluate_character_cached(db, character_dict)
+    return _evaluation_response(ai_result, character_dict)
+
+
+@router.post("/characters/evaluate/batch", response_model=list[CharacterEvaluation])
+async def evaluate_characters_batch_endpoint(data: CharacterBatchEvaluationRequest, db=Depends(get_db), user=Depends(get_current_user)):
+    """Evalúa varios personajes en una sola llamada a la IA; respuestas en el mismo orden"""
+    if len(data.characters) > settings.CHAR_EVAL_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo {settings.CHAR_EVAL_BATCH_MAX_ITEMS} personajes por evaluación"
+        )
+    character_dicts = [ch.model_dump() for ch in data.characters]
+    ai_results = await evaluate_characters_cached(db, character_dicts)
+    return [_evaluation_response(r, ch) for r, ch in zip(ai_results, character_dicts)]
+
 @router.post("/characters", response_model=CharacterPublic)
 async def create_character(data: CharacterCreate, db=Depends(get_db), user=Depends(get_current_user)):
     """Crea un personaje directamente sin evaluación"""
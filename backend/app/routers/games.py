@@ -1,16 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from bson import ObjectId
 from datetime import datetime, timedelta
 from typing import List
 import asyncio
+import hashlib
+import importlib.util
 import io
 
-from app.core.database import get_db
+from app.core.database import get_db, routed_reads
 from app.models.schemas import (
     GameMeta, GameSettings, GameMemberDoc, GameChapterDoc,
     GameMessageDoc, GameActionDoc
 )
 from app.routers.auth import get_current_user
+from app.services.chapter_index import passage_index
+from app.services.generation_queue import in_worker, queue_enabled, register as register_generation, run_generation
+from app.services.llm_usage import record_generation
+from app.services import story_export
+from app.services.speculation import first_chapter_prewarmer, speculator
 
 router = APIRouter(prefix="/api/games", tags=["games"])
 
@@ -89,6 +97,10 @@ async def open_action_phase(db, game: dict):
     except Exception as e:
         print(f"Error starting action phase timer: {e}")
 
+    _start_speculative_chapter(
+        db, str(game["_id"]), int(game.get("current_chapter", 0) or 0), int(game.get("max_chapters", 5) or 5)
+    )
+
 async def _open_action_phase_idempotent(db, game_id: ObjectId, expected_chapter: int) -> bool:
     """Helper idempotente para abrir action_phase desde estado playing."""
     try:
@@ -145,6 +157,8 @@ async def _open_action_phase_idempotent(db, game_id: ObjectId, expected_chapter:
             print(f"[_open_action_phase_idempotent] Timer scheduled for action phase")
         except Exception as timer_err:
             print(f"[_open_action_phase_idempotent] Error scheduling timer: {timer_err}")
+
+        _start_speculative_chapter(db, str(game_id), expected_chapter, int(game.get("max_chapters", 5) or 5))
         
         return True
         
@@ -205,11 +219,11 @@ async def _finalize_actions_and_generate_next(db, game_id: ObjectId, expected_ch
             "data": {"phase": "closing", "message": "Escribiendo el capítulo..."}
         })
         
-        try:
-            await advance_to_next_chapter(db, str(game_id))
-        finally:
-            await _games(db).update_one({"_id": game_id}, {"$unset": {"advancing": ""}})
-            print(f"[finalize] Lock released for game {game_id}")
+        # Inline o en un worker de generación (GENERATION_MODE); el lock se libera al terminar
+        await run_generation(
+            db, "advance_chapter", {"game_id": str(game_id), "expected_chapter": expected_chapter},
+            dedupe_key=f"game:{game_id}:{expected_chapter + 1}",
+        )
         
     except Exception as e:
         print(f"Error in _finalize_actions_and_generate_next: {e}")
@@ -223,13 +237,159 @@ async def _finalize_actions_and_generate_next(db, game_id: ObjectId, expected_ch
             pass
 
 
+async def _advance_chapter_and_release(db, game_id: str, expected_chapter: int | None = None):
+    try:
+        await advance_to_next_chapter(db, game_id, expected_chapter)
+    finally:
+        await _games(db).update_one({"_id": ObjectId(game_id)}, {"$unset": {"advancing": ""}})
+        print(f"[finalize] Lock released for game {game_id}")
+
+
 async def maybe_open_actions_or_continue(db, game: dict):
     """DEPRECATED: Ahora la transición playing -> action_phase se maneja via POST /games/{id}/continue"""
     print(f"[maybe_open_actions_or_continue] DEPRECATED: Use POST /games/{{id}}/continue for phase transitions")
     pass
 
-async def advance_to_next_chapter(db, game_id: str):
-    """Genera el siguiente capítulo usando IA"""
+async def _game_prompt_prefix(db, game: dict, world: dict, characters: list) -> str:
+    """Prefijo de prompt estable de la partida: se calcula una vez y se guarda en el juego."""
+    from app.services.ai_service import PROMPT_PREFIX_VERSION, build_prompt_prefix
+    stored = game.get("prompt_prefix") or {}
+    if stored.get("version") == PROMPT_PREFIX_VERSION and stored.get("content"):
+        return stored["content"]
+    content = build_prompt_prefix(world, characters)
+    try:
+        await _games(db).update_one(
+            {"_id": ObjectId(game["_id"])},
+            {"$set": {"prompt_prefix": {"version": PROMPT_PREFIX_VERSION, "content": content}}},
+        )
+    except Exception as e:
+        print(f"[prompt_prefix] error storing prefix for game {game.get('_id')}: {e}")
+    return content
+
+
+async def _load_generation_context(db, game: dict):
+    """Capítulos previos, mundo, personajes y prefijo de prompt para generar el siguiente capítulo."""
+    game_id = str(game["_id"])
+    prev = []
+    async for ch in _game_chapters(db).find({"game_id": game_id}).sort("chapter_number", 1):
+        prev.append(ch.get("content", ""))
+
+    # Cargar mundo y personajes
+    world = {}
+    characters = []
+    try:
+        room_id = game.get("room_id")
+        if room_id:
+            room = await _rooms(db).find_one({"_id": ObjectId(room_id)})
+            if room:
+                if room.get("world_id"):
+                    w = await db["worlds"].find_one({"_id": ObjectId(room["world_id"])})
+                    world = w or {}
+                # Se pasan las selecciones completas: llevan la ficha precalculada (`card`)
+                selected_chars = room.get("selected_characters", []) or []
+                characters = [sc for sc in selected_chars if sc.get("character")]
+                print(f"[advance] Extracted {len(characters)} characters from {len(selected_chars)} selections")
+    except Exception:
+        pass
+
+    prompt_prefix = await _game_prompt_prefix(db, game, world, characters)
+    return prev, world, characters, prompt_prefix
+
+
+def _start_speculative_chapter(db, game_id: str, current_chapter: int, max_chapters: int):
+    """Empezar a generar en segundo plano el capítulo siguiente "sin acciones" (si está activado)."""
+    if not speculator.enabled or current_chapter >= max_chapters:
+        return
+
+    async def _generate():
+        from app.services.ai_service import AIService
+        game = await _games(db).find_one({"_id": ObjectId(game_id)})
+        if not game:
+            raise ValueError("Game no encontrado")
+        prev, world, characters, prompt_prefix = await _load_generation_context(db, game)
+        ai = AIService()
+        text = await ai.generate_chapter_automatic(
+            world=world or {},
+            previous_chapters=prev,
+            characters=characters,
+            total_chapters=max_chapters,
+            chapter_index=current_chapter + 1,
+            game_id=str(game_id),
+            prompt_prefix=prompt_prefix,
+            speculative=True,
+        )
+        return text, ai.last_call
+
+    speculator.start(str(game_id), (current_chapter + 1, max_chapters), _generate)
+
+
+def _first_chapter_fingerprint(prompt_prefix: str) -> str:
+    """Huella del primer capítulo: depende solo del prefijo (mundo + fichas de personajes)."""
+    return hashlib.sha256(prompt_prefix.encode("utf-8")).hexdigest()
+
+
+async def _room_story_context(db, room: dict):
+    """Mundo y personajes seleccionados de una sala, tal como los recibe el primer capítulo."""
+    world = {}
+    characters = []
+    try:
+        world_id = room.get("world_id")
+        if world_id:
+            world = await db["worlds"].find_one({"_id": ObjectId(world_id)}) or {}
+        characters = room.get("selected_characters", []) or []
+    except Exception:
+        pass
+    return world, characters
+
+
+async def prewarm_first_chapter(db, room_id: str) -> None:
+    """Pre-generar el primer capítulo si la sala tiene mundo y todos los miembros eligieron personaje.
+
+    Se llama tras cada cambio de selección o de miembros: si la sala deja de estar
+    completa (o la partida ya empezó) se descarta la pre-generación; si la huella
+    cambió, se lanza una nueva.
+    """
+    # En modo cola el capítulo 1 lo genera un worker, que no ve la memoria de este proceso
+    if not first_chapter_prewarmer.enabled or queue_enabled():
+        return
+    try:
+        room = await _rooms(db).find_one({"_id": ObjectId(room_id)})
+        state = (room or {}).get("game_state") or (room or {}).get("status") or "waiting"
+        member_ids = (room or {}).get("member_ids", []) or []
+        chosen = {str(sc.get("user_id")) for sc in (room or {}).get("selected_characters", []) or []}
+        if not room or state != "waiting" or not room.get("world_id") or not member_ids \
+                or any(str(mid) not in chosen for mid in member_ids):
+            first_chapter_prewarmer.discard(room_id)
+            return
+
+        from app.services.ai_service import build_prompt_prefix
+        world, characters = await _room_story_context(db, room)
+        prompt_prefix = build_prompt_prefix(world, characters)
+    except Exception as e:
+        print(f"[prewarm] error checking room {room_id}: {e}")
+        return
+
+    async def _generate():
+        from app.services.ai_service import AIService
+        ai = AIService()
+        text = await ai.generate_first_chapter(
+            world=world,
+            characters=characters,
+            game_id=room_id,
+            prompt_prefix=prompt_prefix,
+            speculative=True,
+        )
+        return text, ai.last_call
+
+    first_chapter_prewarmer.start(room_id, _first_chapter_fingerprint(prompt_prefix), _generate)
+
+
+async def advance_to_next_chapter(db, game_id: str, expected_chapter: int | None = None):
+    """Genera el siguiente capítulo usando IA.
+
+    Idempotente para los reintentos de la cola: con `expected_chapter` no hace nada si la
+    partida ya avanzó, y reutiliza el capítulo si se guardó antes de fallar.
+    """
     try:
         print(f"[advance] Starting chapter generation for game {game_id}")
         game = await _games(db).find_one({"_id": ObjectId(game_id)})
@@ -243,32 +403,12 @@ async def advance_to_next_chapter(db, game_id: str):
         if game.get("game_state") == "finished" or current_chapter >= max_chapters:
             print(f"[advance] Already finished or at max chapters (cur={current_chapter}, max={max_chapters}), skipping")
             return
+        if expected_chapter is not None and current_chapter != expected_chapter:
+            print(f"[advance] Game already advanced (cur={current_chapter}, expected={expected_chapter}), skipping")
+            return
         
         print(f"[advance] Current chapter: {current_chapter}")
         
-        # Recolectar contexto
-        prev = []
-        async for ch in _game_chapters(db).find({"game_id": game_id}).sort("chapter_number", 1):
-            prev.append(ch.get("content", ""))
-        
-        # Cargar mundo y personajes
-        world = {}
-        characters = []
-        try:
-            room_id = game.get("room_id")
-            if room_id:
-                room = await _rooms(db).find_one({"_id": ObjectId(room_id)})
-                if room:
-                    if room.get("world_id"):
-                        w = await db["worlds"].find_one({"_id": ObjectId(room["world_id"])})
-                        world = w or {}
-                    # Extraer solo los datos de personajes de selected_characters
-                    selected_chars = room.get("selected_characters", []) or []
-                    characters = [sc.get("character", {}) for sc in selected_chars if sc.get("character")]
-                    print(f"[advance] Extracted {len(characters)} characters from {len(selected_chars)} selections")
-        except Exception:
-            pass
-        
         # Acciones pendientes del capítulo actual
         pending = [a async for a in _game_actions(db).find({
             "game_id": game_id,
@@ -282,32 +422,60 @@ async def advance_to_next_chapter(db, game_id: str):
         from app.services.ai_service import AIService
         ai = AIService()
         new_num = current_chapter + 1
-        if pending:
-            text = await ai.generate_chapter_with_actions(
-                world=world or {}, 
-                previous_chapters=prev, 
-                player_actions=pending, 
-                characters=characters,
-                total_chapters=max_chapters,
-                chapter_index=new_num
-            )
+        existing = await _game_chapters(db).find_one({"game_id": game_id, "chapter_number": new_num})
+        if existing:
+            # Reintento: el capítulo se guardó pero el intento anterior falló después
+            text = existing.get("content") or ""
+            print(f"[advance] Chapter {new_num} already stored, reusing it")
         else:
-            text = await ai.generate_chapter_automatic(
-                world=world or {}, 
-                previous_chapters=prev, 
-                characters=characters,
-                total_chapters=max_chapters,
-                chapter_index=new_num
-            )
+            speculative = None
+            if pending:
+                speculator.discard(game_id)
+            else:
+                # Continuación "sin acciones" generada durante la fase de acciones
+                speculative = await speculator.take(game_id, (new_num, max_chapters))
+
+            if speculative:
+                text, call = speculative
+                call = {**call, "source": "speculative"}
+            elif pending:
+                prev, world, characters, prompt_prefix = await _load_generation_context(db, game)
+                text = await ai.generate_chapter_with_actions(
+                    world=world or {}, 
+                    previous_chapters=prev, 
+                    player_actions=pending, 
+                    characters=characters,
+                    total_chapters=max_chapters,
+                    chapter_index=new_num,
+                    game_id=game_id,
+                    prompt_prefix=prompt_prefix,
+                )
+            else:
+                prev, world, characters, prompt_prefix = await _load_generation_context(db, game)
+                text = await ai.generate_chapter_automatic(
+                    world=world or {}, 
+                    previous_chapters=prev, 
+                    characters=characters,
+                    total_chapters=max_chapters,
+                    chapter_index=new_num,
+                    game_id=game_id,
+                    prompt_prefix=prompt_prefix,
+                )
+            if not speculative:
+                call = ai.last_call
         
-        print(f"[advance] Generated chapter text ({len(text)} chars)")
+            print(f"[advance] Generated chapter text ({len(text)} chars)")
+            await record_generation(db, game, call)
         
-        await _game_chapters(db).insert_one({
-            "game_id": game_id,
-            "chapter_number": new_num,
-            "content": text,
-            "created_at": datetime.utcnow().isoformat(),
-        })
+            await _game_chapters(db).insert_one({
+                "game_id": game_id,
+                "chapter_number": new_num,
+                "content": text,
+                "created_at": datetime.utcnow().isoformat(),
+                # Modelo, tokens, latencia, reintentos, fallback y coste de la llamada que lo generó
+                "generation": call,
+            })
+            passage_index.add_chapter(game_id, new_num, text)
         
         print(f"[advance] Inserted chapter {new_num}, updating game state")
         
@@ -415,6 +583,8 @@ async def advance_to_next_chapter(db, game_id: str):
                 print(f"[advance] Timer scheduled for action phase")
             except Exception as timer_err:
                 print(f"[advance] Error scheduling timer: {timer_err}")
+
+            _start_speculative_chapter(db, game_id, new_num, int(max_chapters or 5))
         
         print(f"[advance] Game state updated successfully")
         
@@ -430,6 +600,152 @@ async def advance_to_next_chapter(db, game_id: str):
             
     except Exception as e:
         print(f"Error in advance_to_next_chapter: {e}")
+        if in_worker():
+            raise  # la cola reintenta el trabajo
+
+
+async def _initialize_game(db, game_id: str, room: dict):
+    """Generar el primer capítulo de una partida recién creada y abrir su primera fase de acciones.
+
+    `room` es una copia de la sala: se borra en cuanto se crea la partida. Idempotente para
+    los reintentos de la cola (ver advance_to_next_chapter).
+    """
+    game_id = ObjectId(game_id)
+    room_id = str(room["_id"])
+    game_doc = await _games(db).find_one({"_id": game_id})
+    if not game_doc:
+        print(f"[init_game] Game {game_id} not found, skipping")
+        return
+    if int(game_doc.get("current_chapter", 0) or 0) >= 1:
+        print(f"[init_game] Game {game_id} already initialized, skipping")
+        return
+    try:
+        print(f"[init_game] Starting background initialization for game {game_id}")
+
+        # Cargar mundo y personajes para el contexto de IA
+        world, characters = await _room_story_context(db, room)
+
+        existing = await _game_chapters(db).find_one({"game_id": str(game_id), "chapter_number": 1})
+        if existing:
+            # Reintento: el capítulo se guardó pero el intento anterior falló después
+            first_chapter_text = existing.get("content") or ""
+            print(f"[init_game] First chapter already stored for game {game_id}, reusing it")
+        else:
+            # Generar primer capítulo (el prefijo estable se guarda para los siguientes turnos)
+            from app.services.ai_service import AIService
+            ai_service = AIService()
+            prompt_prefix = await _game_prompt_prefix(db, {"_id": game_id}, world, characters)
+            # Pre-generado en la sala con exactamente el mismo mundo y personajes
+            prewarmed = await first_chapter_prewarmer.take(room_id, _first_chapter_fingerprint(prompt_prefix))
+            if prewarmed:
+                first_chapter_text, call = prewarmed
+                call = {**call, "source": "prewarmed"}
+            else:
+                first_chapter_text = await ai_service.generate_first_chapter(
+                    world=world,
+                    characters=characters,
+                    game_id=str(game_id),
+                    prompt_prefix=prompt_prefix,
+                )
+                call = ai_service.last_call
+            await record_generation(db, game_doc, call)
+
+            # Guardar el capítulo en game_chapters
+            await _game_chapters(db).insert_one({
+                "game_id": str(game_id),
+                "chapter_number": 1,
+                "content": first_chapter_text,
+                "created_at": datetime.utcnow().isoformat(),
+                "created_by": room.get("admin_id"),
+                "generation": call,
+            })
+            passage_index.add_chapter(str(game_id), 1, first_chapter_text)
+
+        # Actualizar game a action_phase con capítulo 1
+        settings = room.get("settings", {}) or {}
+        discussion_seconds = int(settings.get("discussion_time", 300) or 300)
+        ends_at = datetime.utcnow() + timedelta(seconds=discussion_seconds)
+
+        await _games(db).update_one(
+            {"_id": game_id},
+            {"$set": {
+                "current_chapter": 1,
+                "game_state": "action_phase",  # ← abrir directamente en action_phase
+                "action_phase": {
+                    "open": True,
+                    "started_at": datetime.utcnow().isoformat(),
+                    "ends_at": ends_at.isoformat(),
+                    "seconds_total": discussion_seconds,
+                },
+                "continue_ready": [],
+                "updated_at": datetime.utcnow().isoformat(),
+            }}
+        )
+
+        print(f"[init_game] First chapter generated for game {game_id}")
+
+        # Broadcast que el juego ha iniciado
+        from .websockets import manager
+        await manager.broadcast_to_room({
+            "type": "game_started",
+            "data": {"game_id": str(game_id)}
+        }, f"room:{room_id}")
+
+        # Broadcast del primer capítulo y apertura de action_phase
+        await _broadcast_game(db, str(game_id), {
+            "type": "game:chapter_created",
+            "data": {
+                "chapter_number": 1,
+                "discussion_seconds": discussion_seconds
+            }
+        })
+
+        await _broadcast_game(db, str(game_id), {
+            "type": "game:action_phase_started",
+            "data": {
+                "ends_at": ends_at.isoformat(),
+                "seconds_total": discussion_seconds,
+                "auto_continue": bool(settings.get("auto_continue", False))
+            }
+        })
+
+        await _broadcast_game(db, str(game_id), {
+            "type": "game:phase_changed",
+            "data": {"phase": "action_phase"}
+        })
+
+        # ✅ Programar timer para la primera fase de acciones
+        try:
+            await manager.schedule_action_phase_timer(str(game_id), ends_at.isoformat(), db)
+            print(f"[init_game] Timer scheduled for first action phase")
+        except Exception as timer_err:
+            print(f"[init_game] Error scheduling timer: {timer_err}")
+
+        _start_speculative_chapter(db, str(game_id), 1, int(game_doc.get("max_chapters", 5) or 5))
+
+        print(f"[init_game] Game {game_id} ready with first action phase open.")
+
+    except Exception as e:
+        print(f"[init_game] Error during background initialization: {e}")
+        if in_worker():
+            raise  # la cola reintenta; al agotar los intentos se marca como fallido
+        # Si falla la generación, marcar el juego como fallido
+        await _mark_game_failed(db, str(game_id), str(e))
+
+
+async def _mark_game_failed(db, game_id: str, error: str):
+    await _games(db).update_one(
+        {"_id": ObjectId(game_id)}, 
+        {"$set": {"game_state": "failed", "error": error}}
+    )
+
+
+async def _initialize_game_failed(db, error: str, game_id: str, **_):
+    await _mark_game_failed(db, game_id, error)
+
+
+register_generation("advance_chapter", _advance_chapter_and_release)
+register_generation("initialize_game", _initialize_game, on_failure=_initialize_game_failed)
 
 
 async def _create_complete_game_from_room(db, room_id: str) -> str:
@@ -498,112 +814,10 @@ async def _create_complete_game_from_room(db, room_id: str) -> str:
         {"$set": {"game_state": "closing", "game_id": str(game_id), "status": "closing"}}
     )
 
-    # 🚀 GENERAR PRIMER CAPÍTULO EN BACKGROUND (no bloquear respuesta)
-    async def _initialize_game():
-        try:
-            print(f"[init_game] Starting background initialization for game {game_id}")
-            
-            # Cargar mundo y personajes para el contexto de IA
-            world = {}
-            characters = []
-            try:
-                world_id = room.get("world_id")
-                if world_id:
-                    world = await db["worlds"].find_one({"_id": ObjectId(world_id)}) or {}
-                characters = room.get("selected_characters", []) or []
-            except Exception:
-                pass
-
-            # Generar primer capítulo
-            from app.services.ai_service import AIService
-            ai_service = AIService()
-            first_chapter_text = await ai_service.generate_first_chapter(
-                world=world,
-                characters=characters
-            )
-
-            # Guardar el capítulo en game_chapters
-            await _game_chapters(db).insert_one({
-                "game_id": str(game_id),
-                "chapter_number": 1,
-                "content": first_chapter_text,
-                "created_at": datetime.utcnow().isoformat(),
-                "created_by": room.get("admin_id"),
-            })
-
-            # Actualizar game a action_phase con capítulo 1
-            settings = room.get("settings", {}) or {}
-            discussion_seconds = int(settings.get("discussion_time", 300) or 300)
-            ends_at = datetime.utcnow() + timedelta(seconds=discussion_seconds)
-            
-            await _games(db).update_one(
-                {"_id": game_id},
-                {"$set": {
-                    "current_chapter": 1,
-                    "game_state": "action_phase",  # ← abrir directamente en action_phase
-                    "action_phase": {
-                        "open": True,
-                        "started_at": datetime.utcnow().isoformat(),
-                        "ends_at": ends_at.isoformat(),
-                        "seconds_total": discussion_seconds,
-                    },
-                    "continue_ready": [],
-                    "updated_at": datetime.utcnow().isoformat(),
-                }}
-            )
-
-            print(f"[init_game] First chapter generated for game {game_id}")
-
-            # Broadcast que el juego ha iniciado
-            from .websockets import manager
-            await manager.broadcast_to_room({
-                "type": "game_started",
-                "data": {"game_id": str(game_id)}
-            }, f"room:{room_id}")
-
-            # Broadcast del primer capítulo y apertura de action_phase
-            await _broadcast_game(db, str(game_id), {
-                "type": "game:chapter_created",
-                "data": {
-                    "chapter_number": 1,
-                    "discussion_seconds": discussion_seconds
-                }
-            })
-            
-            await _broadcast_game(db, str(game_id), {
-                "type": "game:action_phase_started",
-                "data": {
-                    "ends_at": ends_at.isoformat(),
-                    "seconds_total": discussion_seconds,
-                    "auto_continue": bool(settings.get("auto_continue", False))
-                }
-            })
-            
-            await _broadcast_game(db, str(game_id), {
-                "type": "game:phase_changed",
-                "data": {"phase": "action_phase"}
-            })
-
-            # ✅ Programar timer para la primera fase de acciones
-            try:
-                await manager.schedule_action_phase_timer(str(game_id), ends_at.isoformat(), db)
-                print(f"[init_game] Timer scheduled for first action phase")
-            except Exception as timer_err:
-                print(f"[init_game] Error scheduling timer: {timer_err}")
-            
-            print(f"[init_game] Game {game_id} ready with first action phase open.")
-
-        except Exception as e:
-            print(f"[init_game] Error during background initialization: {e}")
-            # Si falla la generación, marcar el juego como fallido
-            await _games(db).update_one(
-                {"_id": game_id}, 
-                {"$set": {"game_state": "failed", "error": str(e)}}
-            )
-
-    # Ejecutar en background
-    import asyncio
-    asyncio.create_task(_initialize_game())
+    # 🚀 GENERAR PRIMER CAPÍTULO EN BACKGROUND (no bloquear respuesta): inline o en un worker (GENERATION_MODE)
+    asyncio.create_task(run_generation(
+        db, "initialize_game", {"game_id": str(game_id), "room": room}, dedupe_key=f"game:{game_id}:1"
+    ))
 
     return str(game_id)
 
@@ -673,7 +887,8 @@ async def my_games(db=Depends(get_db), user=Depends(get_current_user)):
     game_ids = [gm["game_id"] async for gm in _game_members(db).find({"user_id": uid}, {"game_id": 1, "_id": 0})]
     oids = [ObjectId(g) for g in game_ids if ObjectId.is_valid(g)]
     games = []
-    async for g in _games(db).find({"_id": {"$in": oids}}):
+    # El prefijo de prompt es interno (y grande): no enviarlo al cliente
+    async for g in _games(db).find({"_id": {"$in": oids}}, {"prompt_prefix": 0}):
         g["_id"] = str(g["_id"])
         games.append(g)
     return games
@@ -867,6 +1082,8 @@ async def propose_action(game_id: str, payload: dict | None = None, db=Depends(g
         "chapter_number": chap,
     }
     res = await _game_actions(db).insert_one(doc)
+    # Ya hay acciones: la continuación especulativa "sin acciones" no sirve
+    speculator.discard(game_id)
     created = await _game_actions(db).find_one({"_id": res.inserted_id})
     created["_id"] = str(created["_id"]) 
     
@@ -955,6 +1172,7 @@ async def add_chapter(game_id: str, payload: GameChapterDoc, db=Depends(get_db),
         "created_by": str(current_user["_id"]),
     })
     res = await _game_chapters(db).insert_one(doc)
+    passage_index.add_chapter(game_id, doc["chapter_number"], doc["content"])
     created = await _game_chapters(db).find_one({"_id": res.inserted_id})
     created["_id"] = str(created["_id"]) 
     # actualizar meta
@@ -968,9 +1186,14 @@ async def add_chapter(game_id: str, payload: GameChapterDoc, db=Depends(get_db),
 @router.get("/{game_id}/chapters", response_model=List[GameChapterDoc])
 async def list_chapters(game_id: str, db=Depends(get_db), current_user=Depends(get_current_user)):
     items: List[dict] = []
-    async for it in _game_chapters(db).find({"game_id": game_id}).sort("chapter_number", 1):
-        it["_id"] = str(it.get("_id"))
-        items.append(it)
+    async with routed_reads(db, "games.chapters") as reads:
+        if reads.session is not None and ObjectId.is_valid(game_id):
+            # Lectura puntual en el primario: fija el punto causal para leer los capítulos del secundario
+            await _games(reads.anchor).find_one({"_id": ObjectId(game_id)}, {"_id": 1}, session=reads.session)
+        cursor = _game_chapters(reads.db).find({"game_id": game_id}, {"generation": 0}, session=reads.session)
+        async for it in cursor.sort("chapter_number", 1):
+            it["_id"] = str(it.get("_id"))
+            items.append(it)
     return items
 
 
@@ -1016,101 +1239,51 @@ async def update_settings(game_id: str, payload: dict, db=Depends(get_db), curre
     return {"ok": True, "message": "Configuraciones actualizadas"}
 
 
-@router.get("/{game_id}/export.txt")
-async def export_game_txt(game_id: str, db=Depends(get_db), current_user=Depends(get_current_user)):
-    """Exportar juego como archivo .txt"""
+async def _export_game(db, game_id: str) -> dict:
     try:
         gid = ObjectId(game_id)
     except Exception:
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
-        
-    game = await _games(db).find_one({"_id": gid})
+
+    async with routed_reads(db, "games.export") as reads:
+        game = await _games(reads.anchor).find_one({"_id": gid}, {"name": 1}, session=reads.session)
     if not game:
         raise HTTPException(status_code=404, detail="Game no encontrado")
+    return game
 
-    # Traer capítulos ordenados
-    chapters = [c async for c in _game_chapters(db).find({"game_id": game_id}).sort("chapter_number", 1)]
-    
-    # Construir texto
-    parts = []
-    title = (game.get("name") or f"Historia {game_id}").strip()
-    parts.append(f"{title}\n\n")
-    
-    for ch in chapters:
-        n = ch.get("chapter_number")
-        parts.append(f"Capítulo {n}\n")
-        parts.append("=" * 20 + "\n\n")
-        parts.append((ch.get("content") or "").strip())
-        parts.append("\n\n")
-    
-    content = "".join(parts)
 
-    headers = {
-        "Content-Disposition": f'attachment; filename="{title.replace(" ", "_")}.txt"'
-    }
-    return Response(content, media_type="text/plain; charset=utf-8", headers=headers)
+@router.get("/{game_id}/export.txt")
+async def export_game_txt(game_id: str, db=Depends(get_db), current_user=Depends(get_current_user)):
+    """Exportar juego como archivo .txt (en streaming, capítulo a capítulo)"""
+    title = story_export.export_title(await _export_game(db, game_id), game_id)
+    return StreamingResponse(
+        story_export.iter_text(db, game_id, title),
+        media_type="text/plain; charset=utf-8",
+        headers=story_export.attachment_headers(title, "txt"),
+    )
+
+
+@router.get("/{game_id}/export.md")
+async def export_game_md(game_id: str, db=Depends(get_db), current_user=Depends(get_current_user)):
+    """Exportar juego como archivo Markdown (en streaming, capítulo a capítulo)"""
+    title = story_export.export_title(await _export_game(db, game_id), game_id)
+    return StreamingResponse(
+        story_export.iter_text(db, game_id, title, markdown=True),
+        media_type="text/markdown; charset=utf-8",
+        headers=story_export.attachment_headers(title, "md"),
+    )
 
 
 @router.get("/{game_id}/export.pdf")
 async def export_game_pdf(game_id: str, db=Depends(get_db), current_user=Depends(get_current_user)):
-    """Exportar juego como archivo .pdf"""
-    try:
-        from reportlab.lib.pagesizes import LETTER
-        from reportlab.pdfgen import canvas
-        from reportlab.lib.units import inch
-        import textwrap
-    except ImportError:
+    """Exportar juego como archivo .pdf (dibujado en un hilo, enviado por trozos)"""
+    if importlib.util.find_spec("reportlab") is None:
         raise HTTPException(status_code=500, detail="PDF no disponible: falta dependencia reportlab")
 
-    try:
-        gid = ObjectId(game_id)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Formato de ID inválido")
-        
-    game = await _games(db).find_one({"_id": gid})
-    if not game:
-        raise HTTPException(status_code=404, detail="Game no encontrado")
-
-    chapters = [c async for c in _game_chapters(db).find({"game_id": game_id}).sort("chapter_number", 1)]
-    title = (game.get("name") or f"Historia {game_id}").strip()
-
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=LETTER)
-    width, height = LETTER
-
-    # Portada simple
-    c.setFont("Times-Bold", 18)
-    c.drawString(1*inch, height-1.5*inch, title)
-    c.setFont("Times-Roman", 12)
-    c.drawString(1*inch, height-1.8*inch, f"Capítulos: {len(chapters)}")
-    c.drawString(1*inch, height-2.1*inch, f"Generado: {datetime.utcnow().strftime('%Y-%m-%d')}")
-    c.showPage()
-
-    # Cuerpo
-    for ch in chapters:
-        text = c.beginText(1*inch, height-1*inch)
-        text.setFont("Times-Bold", 14)
-        text.textLine(f"Capítulo {ch.get('chapter_number')}")
-        text.textLine("")
-        text.setFont("Times-Roman", 11)
-        
-        # Wrap simple por líneas ~95 caracteres
-        content = ch.get("content") or ""
-        for line in content.splitlines():
-            if line.strip():
-                for wrapped in textwrap.wrap(line, width=95):
-                    text.textLine(wrapped)
-            else:
-                text.textLine("")  # línea vacía
-        
-        c.drawText(text)
-        c.showPage()
-
-    c.save()
-    pdf = buffer.getvalue()
-    buffer.close()
-
-    headers = {
-        "Content-Disposition": f'attachment; filename="{title.replace(" ", "_")}.pdf"'
-    }
-    return Response(pdf, media_type="application/pdf", headers=headers)
+    title = story_export.export_title(await _export_game(db, game_id), game_id)
+    pdf = await story_export.render_pdf(db, game_id, title)
+    headers = story_export.attachment_headers(title, "pdf")
+    pdf.seek(0, io.SEEK_END)
+    headers["Content-Length"] = str(pdf.tell())
+    pdf.seek(0)
+    return StreamingResponse(story_export.iter_file(pdf), media_type="application/pdf", headers=headers)
@@ -5,11 +5,18 @@ from app.models.schemas import (
     RoomCreate, RoomPublic, ActionSuggestion, CharacterSelection, 
     ChatMessage, PlayerAction, RoomMessage
 )
-from app.core.database import get_db
+from app.core.database import get_db, routed_reads
+from app.core.serialization import FastJSONResponse
 from app.routers.auth import get_current_user
 from app.services.ai_service import generate_story_chapter, generate_story_chapter_async, AIService
+from app.services.character_cards import build_character_card
 from app.services.games_factory import create_game_from_room
+from app.routers.games import prewarm_first_chapter
+from app.services.chapter_index import passage_index
+from app.services.generation_queue import queue_enabled, run_generation
+from app.services.llm_usage import record_generation
 from bson import ObjectId
+import asyncio
 from datetime import datetime
 from typing import List
 
@@ -42,18 +49,10 @@ def _worlds(db):
 
 
 # ---------- Utils ----------
-def _to_serializable(obj):
-    """Recursively convert Mongo ObjectIds and other non-serializable types to strings."""
-    if isinstance(obj, ObjectId):
-        return str(obj)
-    if isinstance(obj, list):
-        return [_to_serializable(it) for it in obj]
-    if isinstance(obj, dict):
-        return {k: _to_serializable(v) for k, v in obj.items()}
-    return obj
-
 def _public_room_view(room: dict) -> dict:
-    """Return a minimized, JSON-safe public representation of a room."""
+    """Return a minimized public representation of a room.
+    Nested ObjectIds are left as-is; serialize it with FastJSONResponse.
+    """
     if not room:
         return {}
     safe = {
@@ -76,7 +75,7 @@ def _public_room_view(room: dict) -> dict:
         safe["is_joinable"] = False
     # Include world if present and already enriched by caller
     if room.get("world"):
-        safe["world"] = _to_serializable(room["world"])  # ensure JSON-safe
+        safe["world"] = room["world"]
     return safe
 
 
@@ -141,10 +140,10 @@ async def get_rooms(status: str = "open", db=Depends(get_db), user=Depends(get_c
         except Exception:
             room["is_joinable"] = False
 
-        # Serializar completamente para evitar ObjectId no serializable en anidados
-        rooms.append(_to_serializable(room))
-    
-    return rooms
+        rooms.append(room)
+
+    # ObjectId anidados se serializan en el encoder, sin recorrer el documento
+    return FastJSONResponse(rooms)
 
 
 @router.get("/rooms/public")
@@ -160,40 +159,42 @@ async def get_public_rooms(db=Depends(get_db)):
         query = {"$or": [{"deleted": {"$exists": False}}, {"deleted": False}]}
 
         rooms = []
-        async for room in _rooms(db).find(query):
-            try:
-                # IDs como string
-                room["_id"] = str(room["_id"])
-                room["id"] = room["_id"]
-
-                # Incluir informaciÃ³n del mundo si es posible
-                wid = room.get("world_id")
-                world_oid = None
-                if wid:
-                    # Soportar tanto ObjectId como string; ignorar si invÃ¡lido
-                    try:
-                        wid_str = str(wid)
-                        if ObjectId.is_valid(wid_str):
-                            world_oid = ObjectId(wid_str)
-                    except Exception:
-                        world_oid = None
-
-                if world_oid:
-                    world = await _worlds(db).find_one({"_id": world_oid})
-                    if world:
-                        world["_id"] = str(world["_id"])
-                        world["id"] = world["_id"]
-                        room["world"] = world
-
-                # Construir vista pÃºblica JSON-safe
-                public_view = _public_room_view(room)
-                rooms.append(public_view)
-            except Exception as inner_e:
-                # No abortar todo el listado por un registro defectuoso
-                print(f"[rooms.public] Error procesando sala {room.get('_id')}: {inner_e}")
-                continue
-
-        return rooms
+        # Lecturas del listado con la politica de core/database.py (la limpieza de arriba escribe: primario)
+        async with routed_reads(db, "rooms.public") as reads:
+            async for room in _rooms(reads.db).find(query, session=reads.session):
+                try:
+                    # IDs como string
+                    room["_id"] = str(room["_id"])
+                    room["id"] = room["_id"]
+
+                    # Incluir informaciÃ³n del mundo si es posible
+                    wid = room.get("world_id")
+                    world_oid = None
+                    if wid:
+                        # Soportar tanto ObjectId como string; ignorar si invÃ¡lido
+                        try:
+                            wid_str = str(wid)
+                            if ObjectId.is_valid(wid_str):
+                                world_oid = ObjectId(wid_str)
+                        except Exception:
+                            world_oid = None
+
+                    if world_oid:
+                        world = await _worlds(reads.db).find_one({"_id": world_oid}, session=reads.session)
+                        if world:
+                            world["_id"] = str(world["_id"])
+                            world["id"] = world["_id"]
+                            room["world"] = world
+
+                    # Construir vista pÃºblica JSON-safe
+                    public_view = _public_room_view(room)
+                    rooms.append(public_view)
+                except Exception as inner_e:
+                    # No abortar todo el listado por un registro defectuoso
+                    print(f"[rooms.public] Error procesando sala {room.get('_id')}: {inner_e}")
+                    continue
+
+        return FastJSONResponse(rooms)
     except Exception as e:
         print(f"Error en get_public_rooms: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
@@ -257,7 +258,7 @@ async def get_room_by_id(room_id: str, db=Depends(get_db), user=Depends(get_curr
     except Exception:
         room["is_joinable"] = False
     
-    return _to_serializable(room)
+    return FastJSONResponse(room)
 
 
     
@@ -363,6 +364,8 @@ async def join_room(room_id: str, db=Depends(get_db), user=Depends(get_current_u
             }
         }
     )
+    # Un miembro nuevo sin personaje invalida el primer capítulo pre-generado
+    await prewarm_first_chapter(db, room_id)
     return {"joined": True, "message": "Te has unido a la sala exitosamente"}
 
 
@@ -386,6 +389,7 @@ async def leave_room(room_id: str, db=Depends(get_db), user=Depends(get_current_
     # Si no quedan miembros, eliminar la sala
     if len(member_ids) == 0:
         await _rooms(db).delete_one({"_id": _oid(room_id)})
+        await prewarm_first_chapter(db, room_id)
         return {"left": True, "message": "Has salido de la sala. La sala ha sido eliminada por estar vacÃ­a."}
     
     # Si el usuario que se va es el admin y hay otros miembros, transferir admin
@@ -401,6 +405,7 @@ async def leave_room(room_id: str, db=Depends(get_db), user=Depends(get_current_
                 }
             }
         )
+        await prewarm_first_chapter(db, room_id)
         return {"left": True, "message": f"Has salido de la sala. El admin ha sido transferido."}
     else:
         # Usuario normal saliendo
@@ -414,9 +419,15 @@ async def leave_room(room_id: str, db=Depends(get_db), user=Depends(get_current_
                 }
             }
         )
+        await prewarm_first_chapter(db, room_id)
         return {"left": True, "message": "Has salido de la sala exitosamente"}
 
 
+def _room_usage_owner(room: dict) -> dict:
+    """Partida, mundo y propietario de una sala para los agregados de llm_usage."""
+    return {"_id": room["_id"], "world_id": room.get("world_id"), "owner_id": room.get("admin_id")}
+
+
 @router.post("/rooms/{room_id}/chapter")
 async def generate_chapter(room_id: str, db=Depends(get_db), user=Depends(get_current_user)):
     room = await _rooms(db).find_one({"_id": _oid(room_id)})
@@ -433,7 +444,9 @@ async def generate_chapter(room_id: str, db=Depends(get_db), user=Depends(get_cu
         ch["_id"] = str(ch["_id"]) 
         chars.append(ch)
 
-    text = generate_story_chapter(room, chars, room.get("suggestions", []))
+    ai = AIService()
+    text = await asyncio.to_thread(generate_story_chapter, room, chars, room.get("suggestions", []), ai)
+    await record_generation(db, _room_usage_owner(room), ai.last_call)
 
     await _rooms(db).update_one({"_id": _oid(room_id)}, {"$push": {"chapters": text}, "$set": {"suggestions": []}})
     return {"chapter": text}
@@ -490,7 +503,9 @@ async def select_character(room_id: str, selection: CharacterSelection, db=Depen
         "user_id": uid,
         "character_id": str(character["_id"]),
         "character_name": character["name"],
-        "character": character
+        "character": character,
+        # Ficha compacta para los prompts: se calcula una vez aquí y se reutiliza en cada capítulo
+        "card": build_character_card(character),
     }
     
     await _rooms(db).update_one(
@@ -529,7 +544,9 @@ async def select_character(room_id: str, selection: CharacterSelection, db=Depen
             "character_name": character["name"]
         }
     })
-    
+
+    # Con mundo y todos los personajes elegidos, empezar ya el primer capítulo
+    await prewarm_first_chapter(db, room_id)
     return {"message": "Personaje seleccionado correctamente"}
 
 
@@ -581,7 +598,7 @@ async def get_my_room(db=Depends(get_db), user=Depends(get_current_user)):
                 print(f"Error getting world: {e}")
                 pass
         
-        return {"room": room}
+        return FastJSONResponse({"room": room})
     except Exception as e:
         print(f"Error in get_my_room: {e}")
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
@@ -702,7 +719,12 @@ async def generate_first_chapter(room_id: str, db):
         return
     
     # Generar primer capÃ­tulo
-    chapter_text = generate_story_chapter(room, [char["character"] for char in characters], [])
+    # generate_story_chapter es síncrono: ejecutarlo en un hilo para no bloquear el loop
+    ai = AIService()
+    chapter_text = await asyncio.to_thread(
+        generate_story_chapter, room, [char["character"] for char in characters], [], ai
+    )
+    await record_generation(db, _room_usage_owner(room), ai.last_call)
     
     await _rooms(db).update_one(
         {"_id": _oid(room_id)},
@@ -752,6 +774,23 @@ async def start_game(room_id: str, db=Depends(get_db), user=Depends(get_current_
     if not game_id_value:
         raise HTTPException(status_code=500, detail="Error creando el juego")
 
+    # GENERATION_MODE=queue: el capitulo 1 lo genera un worker (initialize_game), la API no llama al LLM
+    if queue_enabled():
+        await run_generation(
+            db, "initialize_game", {"game_id": str(game_id_value), "room": room},
+            dedupe_key=f"game:{game_id_value}:1",
+        )
+        await _rooms(db).update_one({"_id": _oid(room_id)}, {"$set": {
+            "status": "closed",
+            "game_id": str(game_id_value),
+            "closed_at": datetime.utcnow().isoformat(),
+            "game_state": "playing",
+        }})
+        from .websockets import notify_room_members
+        await notify_room_members(room_id, {"type": "game_started", "data": {"game_id": str(game_id_value)}})
+        await notify_room_members(room_id, {"type": "room_closed", "data": {"room_id": room_id}})
+        return {"message": "Juego iniciado, generando el primer capitulo", "game_id": str(game_id_value)}
+
     # Generar primer capÃ­tulo con IA y persistir en game_chapters
     try:
         ai = AIService()
@@ -761,14 +800,26 @@ async def start_game(room_id: str, db=Depends(get_db), user=Depends(get_current_
                 world = await db["worlds"].find_one({"_id": ObjectId(room["world_id"])})
             except Exception:
                 world = None
-        first = await ai.generate_first_chapter(world=world or {}, characters=room.get("selected_characters", []))
+        first = await ai.generate_first_chapter(
+            world=world or {},
+            characters=room.get("selected_characters", []),
+            game_id=str(game_id_value),
+        )
+        # Uso y coste de la llamada, igual que en games.py (agregados de /api/admin/llm/usage)
+        await record_generation(db, {
+            "_id": game_id_value,
+            "world_id": room.get("world_id"),
+            "owner_id": room.get("owner_id") or room.get("admin_id"),
+        }, ai.last_call)
         
         await db["game_chapters"].insert_one({
             "game_id": str(game_id_value),
             "chapter_number": 1,
             "content": first,
             "created_at": datetime.utcnow().isoformat(),
+            "generation": ai.last_call,
         })
+        passage_index.add_chapter(str(game_id_value), 1, first)
         
         # actualizar meta en games
         await db["games"].update_one({"_id": ObjectId(game_id_value)}, {"$set": {"current_chapter": 1}})
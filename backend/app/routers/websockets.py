@@ -1,14 +1,21 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from typing import Dict, List, Set, Optional
-import json
 import asyncio
+import time
+import uuid
+from collections import deque
 from urllib.parse import urlparse, parse_qsl
 from datetime import datetime, timedelta
+from app.core.config import settings
 from app.core.database import get_db
 from app.core.security import decode_token
+from app.core.serialization import encode_frame, decode_frame, negotiate_encoding, ENCODING_JSON
 from bson import ObjectId
 from app.services.ai_service import AIService
+from app.services.character_cards import build_character_card
+from app.services.generation_queue import CONTROL_CHANNEL, register as register_generation, run_generation
+from app.services.llm_usage import record_generation
 from app.services.games_factory import create_game_from_room, DEFAULT_CONTINUE_TIME
 
 router = APIRouter()
@@ -33,19 +40,75 @@ class ConnectionManager:
         self.active_connections = {}
         # Diccionario: WebSocket -> user_id
         self.user_connections = {}
+        # Diccionario: WebSocket -> codificación de frames ("json" | "msgpack")
+        self.connection_encodings = {}
+        # Diccionario: WebSocket -> canal, y WebSocket -> último frame recibido (monotónico)
+        self.connection_channels = {}
+        self.last_seen = {}
+        # Tarea de heartbeat/barrido de conexiones
+        self.heartbeat_task = None
+        # Reanudación de sesiones: secuencia por canal y ring buffer de eventos recientes.
+        # `epoch` cambia en cada arranque del proceso, así el cliente detecta que sus seq ya no valen.
+        self.epoch = uuid.uuid4().hex[:12]
+        self.channel_seq = {}
+        self.event_buffers = {}
+        self.channel_last_event = {}
         # Tareas por sala para fase de acciones
         self.action_phase_tasks = {}
         # Tareas por sala para modo auto (sin acciones)
         self.auto_mode_tasks = {}
-
-    async def connect(self, websocket: WebSocket, room_id: str, user_id: str):
+        # GENERATION_MODE=queue: en el worker los broadcasts se publican en Mongo (event_sink)
+        # y en la API una tarea los sigue y reenvía a los sockets locales
+        self.event_sink = None
+        self.event_relay_task = None
+        self.event_relay_db = None
+
+    async def connect(self, websocket: WebSocket, room_id: str, user_id: str, encoding: str = ENCODING_JSON,
+                      resume_from: Optional[int] = None, resume_epoch: Optional[str] = None) -> bool:
+        """Aceptar y registrar la conexión en el canal.
+        Con `resume_from`, reproduce los eventos del canal con seq posterior antes de registrarla.
+        Devuelve True si la sesión se reanudó sin huecos (el cliente no necesita refrescar)."""
+        # permessage-deflate lo negocia el servidor ASGI durante el handshake
         await websocket.accept()
-        
+        self.connection_encodings[websocket] = encoding
+
+        await self.send_personal_message({
+            "type": "session",
+            "data": {"epoch": self.epoch, "seq": self.channel_seq.get(room_id, 0)}
+        }, websocket)
+        resumed = False
+        if resume_from is not None and (resume_epoch is None or resume_epoch == self.epoch):
+            resumed = await self._replay_missed(websocket, room_id, resume_from)
+
+        # Sin await entre el último chequeo del buffer y el registro: no se pierden ni se desordenan eventos
         if room_id not in self.active_connections:
             self.active_connections[room_id] = set()
         
         self.active_connections[room_id].add(websocket)
         self.user_connections[websocket] = user_id
+        self.connection_encodings[websocket] = encoding
+        self.connection_channels[websocket] = room_id
+        self.last_seen[websocket] = time.monotonic()
+        return resumed
+
+    async def _replay_missed(self, websocket: WebSocket, channel: str, resume_from: int) -> bool:
+        """Enviar los eventos con seq > resume_from desde el buffer del canal.
+        Devuelve False si el buffer ya no cubre el hueco (o el seq es de otro arranque)."""
+        encoding = self.connection_encodings.get(websocket, ENCODING_JSON)
+        last = resume_from
+        while True:
+            current = self.channel_seq.get(channel, 0)
+            if last == current:
+                return True
+            buffer = self.event_buffers.get(channel)
+            if last > current or not buffer or buffer[0]["seq"] > last + 1:
+                return False
+            for entry in [e for e in buffer if e["seq"] > last]:
+                frame = entry["frames"].get(encoding)
+                if frame is None:
+                    frame = entry["frames"][encoding] = encode_frame(entry["message"], encoding)
+                await self._send_frame(websocket, frame)
+                last = entry["seq"]
 
     def disconnect(self, websocket: WebSocket, room_id: str):
         if room_id in self.active_connections:
@@ -55,29 +118,172 @@ class ConnectionManager:
         
         if websocket in self.user_connections:
             del self.user_connections[websocket]
+        self.connection_encodings.pop(websocket, None)
+        self.connection_channels.pop(websocket, None)
+        self.last_seen.pop(websocket, None)
+
+    def touch(self, websocket: WebSocket):
+        """Registrar actividad del cliente (cualquier frame recibido)."""
+        if websocket in self.last_seen:
+            self.last_seen[websocket] = time.monotonic()
+
+    async def receive_message(self, websocket: WebSocket) -> dict:
+        """Esperar el siguiente mensaje del cliente (JSON o MessagePack).
+        Responde los `ping` del cliente y lanza WebSocketDisconnect al cerrarse."""
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            self.touch(websocket)
+            message = decode_frame(frame.get("text") if frame.get("text") is not None else frame.get("bytes"))
+            if not isinstance(message, dict):
+                continue
+            if message.get("type") == "ping":
+                await self.send_personal_message({"type": "pong"}, websocket)
+                continue
+            if message.get("type") == "pong":
+                continue
+            return message
+
+    async def sweep_connections(self):
+        """Cerrar conexiones inactivas y enviar ping al resto."""
+        now = time.monotonic()
+        idle_timeout = settings.WS_IDLE_TIMEOUT_SECONDS
+        stale, alive = [], []
+        for websocket, seen in list(self.last_seen.items()):
+            (stale if now - seen > idle_timeout else alive).append(websocket)
+
+        for websocket in stale:
+            channel = self.connection_channels.get(websocket)
+            print(f"[websocket.sweep] Reaping idle connection user={self.user_connections.get(websocket)} channel={channel}")
+            self.disconnect(websocket, channel)
+        # El cierre puede tardar (handshake con un peer muerto): no bloquear el barrido
+        await asyncio.gather(*(self._close_quietly(ws) for ws in stale))
+
+        # Pings en paralelo: un socket lento no retrasa el resto del barrido
+        results = await asyncio.gather(*(self._ping(ws) for ws in alive))
+        for websocket, ok in zip(alive, results):
+            if not ok:
+                self.disconnect(websocket, self.connection_channels.get(websocket))
+
+        self.prune_event_buffers()
+
+    async def _ping(self, websocket: WebSocket) -> bool:
+        try:
+            encoding = self.connection_encodings.get(websocket, ENCODING_JSON)
+            await asyncio.wait_for(self._send_frame(websocket, encode_frame({"type": "ping"}, encoding)), timeout=5)
+            return True
+        except Exception:
+            return False
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
+    async def _close_quietly(self, websocket: WebSocket):
         try:
-            await websocket.send_text(message)
-        except:
+            await asyncio.wait_for(websocket.close(code=1001, reason="Idle timeout"), timeout=5)
+        except Exception:
             pass
 
-    async def broadcast_to_room(self, message: dict, room_id: str):
-        if room_id in self.active_connections:
-            # Asegurar serialización robusta
-            try:
-                message_text = json.dumps(message)
-            except Exception:
+    async def _run_heartbeat(self):
+        try:
+            while True:
+                await asyncio.sleep(settings.WS_HEARTBEAT_INTERVAL_SECONDS)
                 try:
-                    message_text = json.dumps(_to_serializable(message))
+                    await self.sweep_connections()
                 except Exception as e:
-                    print(f"[websocket.broadcast] Failed to serialize message: {e}")
-                    return
+                    print(f"[websocket.heartbeat] error: {e}")
+        except asyncio.CancelledError:
+            return
+
+    def start_heartbeat(self):
+        if self.heartbeat_task is None or self.heartbeat_task.done():
+            self.heartbeat_task = asyncio.create_task(self._run_heartbeat())
+
+    def stop_heartbeat(self):
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+
+    def start_event_relay(self, db):
+        """Reenviar a los sockets de este proceso los eventos publicados por los workers de generación."""
+        from app.services.generation_queue import relay_events
+        self.event_relay_db = db
+        if self.event_relay_task is None or self.event_relay_task.done():
+            self.event_relay_task = asyncio.create_task(relay_events(db, self._handle_relayed_event))
+
+    async def _handle_relayed_event(self, message: dict, channel: str):
+        if channel != CONTROL_CHANNEL:
+            await self.broadcast_to_room(message, channel)
+            return
+        # Órdenes del worker: los timers viven en los procesos de la API, que son los que los cancelan
+        if message.get("type") == "schedule_action_phase_timer":
+            data = message.get("data") or {}
+            await self.schedule_action_phase_timer(data["game_id"], data["ends_at"], self.event_relay_db)
+
+    def stop_event_relay(self):
+        if self.event_relay_task is not None:
+            self.event_relay_task.cancel()
+            self.event_relay_task = None
+
+    async def _send_frame(self, websocket: WebSocket, frame):
+        if isinstance(frame, bytes):
+            await websocket.send_bytes(frame)
+        else:
+            await websocket.send_text(frame)
+
+    async def send_personal_message(self, message: dict, websocket: WebSocket):
+        try:
+            encoding = self.connection_encodings.get(websocket, ENCODING_JSON)
+            await self._send_frame(websocket, encode_frame(message, encoding))
+        except:
+            pass
+
+    def _record_event(self, message: dict, channel: str) -> dict:
+        """Sellar el mensaje con el siguiente seq del canal y guardarlo en su ring buffer."""
+        seq = self.channel_seq.get(channel, 0) + 1
+        self.channel_seq[channel] = seq
+        entry = {"seq": seq, "message": {**message, "seq": seq}, "frames": {}}
+        buffer = self.event_buffers.get(channel)
+        if buffer is None:
+            buffer = self.event_buffers[channel] = deque(maxlen=settings.WS_REPLAY_BUFFER_SIZE)
+        buffer.append(entry)
+        self.channel_last_event[channel] = time.monotonic()
+        return entry
+
+    def prune_event_buffers(self):
+        """Descartar buffers de canales sin conexiones y sin eventos recientes."""
+        cutoff = time.monotonic() - settings.WS_REPLAY_RETENTION_SECONDS
+        for channel, last_event in list(self.channel_last_event.items()):
+            if channel not in self.active_connections and last_event < cutoff:
+                self.channel_last_event.pop(channel, None)
+                self.event_buffers.pop(channel, None)
+                self.channel_seq.pop(channel, None)
 
+    async def broadcast_to_room(self, message: dict, room_id: str):
+        if self.event_sink is not None:
+            # Proceso worker: sin sockets propios, lo entregan los procesos de la API
+            await self.event_sink(message, room_id)
+            return
+        # Se registra aunque no haya nadie conectado: quien reconecte podrá reanudar
+        entry = self._record_event(message, room_id)
+        message = entry["message"]
+        if room_id in self.active_connections:
+            # Serializar una sola vez por formato (compartido con el buffer de reanudación)
+            frames = entry["frames"]
+            failed_encodings = set()
             disconnected = []
             for connection in self.active_connections[room_id].copy():
+                encoding = self.connection_encodings.get(connection, ENCODING_JSON)
+                if encoding in failed_encodings:
+                    continue
+                if encoding not in frames:
+                    try:
+                        frames[encoding] = encode_frame(message, encoding)
+                    except Exception as e:
+                        # Solo se saltan los sockets de ese formato; el resto recibe el evento
+                        print(f"[websocket.broadcast] Failed to serialize message ({encoding}): {e}")
+                        failed_encodings.add(encoding)
+                        continue
                 try:
-                    await connection.send_text(message_text)
+                    await self._send_frame(connection, frames[encoding])
                 except Exception:
                     disconnected.append(connection)
             # Remover conexiones desconectadas
@@ -86,6 +292,14 @@ class ConnectionManager:
 
     async def schedule_action_phase_timer(self, game_id: str, ends_at_iso: str, db):
         """Iniciar timer para la fase de acciones de un juego"""
+        if self.event_sink is not None:
+            # Worker: pedir a los procesos de la API que lo programen (cada uno avisa a sus sockets;
+            # el cierre de la fase es idempotente, solo uno genera el capítulo)
+            await self.event_sink(
+                {"type": "schedule_action_phase_timer", "data": {"game_id": game_id, "ends_at": ends_at_iso}},
+                CONTROL_CHANNEL,
+            )
+            return
         # Cancelar timer existente si lo hay
         if game_id in self.action_phase_tasks:
             try:
@@ -188,23 +402,9 @@ async def get_current_user_ws(token: str, db):
     except Exception:
         return None
 
-# Utilidad para convertir ObjectId y tipos no serializables a string
-def _to_serializable(obj):
-    try:
-        from bson import ObjectId as _OID
-    except Exception:
-        _OID = None
-    if _OID and isinstance(obj, _OID):
-        return str(obj)
-    if isinstance(obj, list):
-        return [_to_serializable(it) for it in obj]
-    if isinstance(obj, dict):
-        return {k: _to_serializable(v) for k, v in obj.items()}
-    return obj
-
 @router.websocket("/ws/{room_id}")
 @router.websocket("/ws/room/{room_id}")
-async def websocket_endpoint(websocket: WebSocket, room_id: str, token: Optional[str] = None, access_token: Optional[str] = None, db=Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket, room_id: str, token: Optional[str] = None, access_token: Optional[str] = None, encoding: Optional[str] = None, resume_from: Optional[int] = None, epoch: Optional[str] = None, db=Depends(get_db)):
     # Aceptar token o access_token desde la query
     token = token or access_token
     if not token:
@@ -230,10 +430,13 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, token: Optional
         await websocket.close(code=1008, reason="Not a member of this room")
         return
     
-    await manager.connect(websocket, room_id, user_id)
+    resumed = await manager.connect(websocket, room_id, user_id, negotiate_encoding(encoding), resume_from, epoch)
     print(f"[websocket] 🔗 Conexión establecida: usuario={user['username']} (id={user_id}) sala={room_id}")
     
     try:
+        if resume_from is not None and not resumed:
+            await manager.send_personal_message({"type": "resync_required", "data": {"channel": room_id}}, websocket)
+
         # Notificar a todos los usuarios (incluido el nuevo) con el estado actualizado de la sala
         updated_room_data = await get_room_data(room_id, db)
         if updated_room_data:
@@ -244,8 +447,7 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, token: Optional
         
         try:
             while True:
-                data = await websocket.receive_text()
-                message = json.loads(data)
+                message = await manager.receive_message(websocket)
                 
                 await handle_websocket_message(message, room_id, user_id, user["username"], db)
                 
@@ -448,7 +650,9 @@ async def handle_select_character(message: dict, room_id: str, user_id: str, db)
         "user_id": user_id,
         "character_id": character_id,
         "character_name": character["name"],
-        "character": character
+        "character": character,
+        # Ficha compacta para los prompts: se calcula una vez aquí y se reutiliza en cada capítulo
+        "card": build_character_card(character),
     }
     
     await _rooms(db).update_one(
@@ -462,6 +666,10 @@ async def handle_select_character(message: dict, room_id: str, user_id: str, db)
         "data": character_selection
     }, room_id)
 
+    # Con mundo y todos los personajes elegidos, empezar ya el primer capítulo
+    from .games import prewarm_first_chapter
+    await prewarm_first_chapter(db, room_id)
+
 
 @router.websocket("/ws/game/{game_id}")
 async def websocket_game_endpoint(websocket: WebSocket, game_id: str, db=Depends(get_db)):
@@ -511,7 +719,13 @@ async def websocket_game_endpoint(websocket: WebSocket, game_id: str, db=Depends
             return
 
     channel_key = f"game:{game_id}"
-    await manager.connect(websocket, channel_key, user_id)
+    resume_from = None
+    if (query.get("resume_from") or "").isdigit():
+        resume_from = int(query["resume_from"])
+    resumed = await manager.connect(
+        websocket, channel_key, user_id, negotiate_encoding(query.get("encoding")),
+        resume_from, query.get("epoch")
+    )
     
     # ✅ Auto-delete de la sala cuando se conecta el primer WebSocket del juego
     try:
@@ -534,19 +748,24 @@ async def websocket_game_endpoint(websocket: WebSocket, game_id: str, db=Depends
     except Exception as e:
         print(f"[ws.game] Error in auto-delete logic: {e}")
     
+    # Si la sesión se reanudó, los eventos perdidos ya se reprodujeron y sobran los snapshots;
+    # si no se pudo (buffer insuficiente o reinicio del servidor), el cliente debe refrescar por HTTP
+    if resume_from is not None and not resumed:
+        await manager.send_personal_message({"type": "resync_required", "data": {"channel": channel_key}}, websocket)
+
     # Enviar estado actual de la fase de acciones si está activa
     try:
-        game = await _games(db).find_one({"_id": ObjectId(game_id)})
+        game = await _games(db).find_one({"_id": ObjectId(game_id)}) if not resumed else None
         if game and game.get("game_state") == "action_phase" and game.get("action_phase"):
             action_phase = game["action_phase"]
-            await manager.send_personal_message(json.dumps({
+            await manager.send_personal_message({
                 "type": "game:action_phase_started",
                 "data": {
                     "ends_at": action_phase.get("ends_at"),
                     "seconds_total": action_phase.get("seconds_total", 60),
                     "auto_continue": bool(game.get("settings", {}).get("auto_continue", True))
                 }
-            }), websocket)
+            }, websocket)
             
         # ✅ Enviar snapshot del capítulo actual para clientes que se conectan tarde
         if game:
@@ -557,7 +776,7 @@ async def websocket_game_endpoint(websocket: WebSocket, game_id: str, db=Depends
                 )
                 if last_chapter:
                     current_chapter = game.get("current_chapter", 0)
-                    await manager.send_personal_message(json.dumps({
+                    await manager.send_personal_message({
                         "type": "game:chapter_snapshot",
                         "data": {
                             "chapter_number": last_chapter.get("chapter_number"),
@@ -565,7 +784,7 @@ async def websocket_game_endpoint(websocket: WebSocket, game_id: str, db=Depends
                             "game_state": game.get("game_state"),
                             "message": "Chapter snapshot for late connection"
                         }
-                    }), websocket)
+                    }, websocket)
                     print(f"[ws.game] Sent chapter snapshot {last_chapter.get('chapter_number')} to late-connecting client")
             except Exception as snapshot_err:
                 print(f"[ws.game] Error sending chapter snapshot: {snapshot_err}")
@@ -574,10 +793,10 @@ async def websocket_game_endpoint(websocket: WebSocket, game_id: str, db=Depends
         print(f"Error sending action phase state: {e}")
     
     try:
-        # Por ahora, solo mantener conexión y permitir broadcasts
+        # Leer del socket para detectar desconexiones y registrar actividad (pong);
+        # los clientes aún no envían otros mensajes por este canal
         while True:
-            # Mantener viva la conexión; clientes no envían mensajes por este canal todavía
-            await asyncio.sleep(30)
+            await manager.receive_message(websocket)
     except WebSocketDisconnect:
         pass
     except Exception as e:
@@ -609,24 +828,16 @@ async def get_room_data(room_id: str, db):
             print(f"[ws.get_room_data] member load error {uid}: {e}")
             continue
 
-    # Limpiar selected_characters para que sean JSON-safe
+    # Normalizar IDs de primer nivel en selected_characters; los ObjectId anidados
+    # (p.ej. 'character' en formato legacy) los resuelve el encoder al enviar.
     cleaned_selected = []
     for sc in (room.get("selected_characters", []) or []):
         try:
             sc_copy = dict(sc)
-            # Si es formato legacy con 'character' anidado, convertir IDs
-            if isinstance(sc_copy.get("character"), dict):
-                ch = dict(sc_copy["character"])
-                if "_id" in ch:
-                    ch["_id"] = str(ch["_id"])
-                if "owner_id" in ch:
-                    ch["owner_id"] = str(ch["owner_id"])
-                sc_copy["character"] = _to_serializable(ch)
-            # Forzar a string campos comunes
             for key in ("user_id", "character_id"):
                 if key in sc_copy and sc_copy[key] is not None:
                     sc_copy[key] = str(sc_copy[key])
-            cleaned_selected.append(_to_serializable(sc_copy))
+            cleaned_selected.append(sc_copy)
         except Exception as e:
             print(f"[ws.get_room_data] selected_characters cleanup error: {e}")
             continue
@@ -639,7 +850,7 @@ async def get_room_data(room_id: str, db):
         "members": members,
         "member_ids": member_ids,
         "selected_characters": cleaned_selected,
-        "messages": _to_serializable(room.get("messages", [])),
+        "messages": room.get("messages", []) or [],
         "ready_players": ready_players,
         "max_players": int(room.get("max_players", 4) or 4),
         "admin_id": str(room.get("admin_id", "")),
@@ -650,7 +861,7 @@ async def get_room_data(room_id: str, db):
     "continue_time": int(room.get("continue_time", 60) or 60),
     "allow_actions": bool(room.get("allow_actions", True)),
     "action_time_minutes": int(room.get("action_time_minutes", 5) or 5),
-    "pending_actions": _to_serializable(room.get("pending_actions", [])),
+    "pending_actions": room.get("pending_actions", []) or [],
     "action_ready_players": [str(uid) for uid in (room.get("action_ready_players", []) or [])],
         "action_phase_deadline": room.get("action_phase_deadline") or None
     }
@@ -893,6 +1104,22 @@ async def _end_action_phase_and_generate(room_id: str, db):
     except Exception:
         pass
 
+    # Inline o en un worker de generación (GENERATION_MODE), un único trabajo por capítulo
+    new_num = int(room.get("current_chapter", 0) or 0) + 1
+    await run_generation(
+        db, "room_chapter", {"room_id": room_id, "chapter_number": new_num}, dedupe_key=f"room:{room_id}:{new_num}"
+    )
+
+
+async def _generate_room_chapter(db, room_id: str, chapter_number: int | None = None):
+    room = await _rooms(db).find_one({"_id": ObjectId(room_id)})
+    if not room:
+        return
+    # Reintento de la cola: si el capítulo ya se guardó no se vuelve a generar
+    if chapter_number is not None and int(room.get("current_chapter", 0) or 0) >= chapter_number:
+        print(f"[room_chapter] Room {room_id} already at chapter {chapter_number}, skipping")
+        return
+
     # Preparar datos IA
     try:
         world_id = room.get("world_id")
@@ -914,7 +1141,8 @@ async def _end_action_phase_and_generate(room_id: str, db):
             player_actions=pending_actions,
             characters=selected_chars,
             total_chapters=max_chapters,
-            chapter_index=new_num
+            chapter_index=new_num,
+            game_id=room_id,
         )
         actions_used = pending_actions
     else:
@@ -923,9 +1151,16 @@ async def _end_action_phase_and_generate(room_id: str, db):
             previous_chapters=chapters,
             characters=selected_chars,
             total_chapters=max_chapters,
-            chapter_index=new_num
+            chapter_index=new_num,
+            game_id=room_id,
         )
         actions_used = []
+    # Uso y coste de la llamada: la sala cuenta como partida, con su mundo y su admin
+    await record_generation(db, {
+        "_id": room_id,
+        "world_id": room.get("world_id"),
+        "owner_id": room.get("admin_id"),
+    }, ai_service.last_call)
 
     # Actualizar sala
     from datetime import datetime as _dt
@@ -979,6 +1214,9 @@ async def _end_action_phase_and_generate(room_id: str, db):
         await handle_start_action_phase({"manual": False}, room_id, str(room2.get("admin_id", "")), db)
 
 
+register_generation("room_chapter", _generate_room_chapter)
+
+
 # ========== Modo sin acciones: avance automático ==========
 async def schedule_auto_mode(room_id: str, db):
     """Arranca modo automático (sin acciones), generando capítulos con una pausa entre ellos."""
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from app.models.schemas import WorldCreate, WorldPublic
-from app.core.database import get_db
+from app.core.database import get_db, routed_reads
 from bson import ObjectId
 from datetime import datetime
 
@@ -81,10 +81,11 @@ async def list_worlds(db=Depends(get_db), user=Depends(get_current_user)):
 async def list_public_worlds(db=Depends(get_db)):
     """Listar solo mundos públicos (sin autenticación)"""
     items = []
-    async for world in _worlds(db).find({"is_public": True}).sort("usage_count", -1):
-        world["_id"] = str(world["_id"])
-        world["id"] = world["_id"]
-        items.append(world)
+    async with routed_reads(db, "worlds.public") as reads:
+        async for world in _worlds(reads.db).find({"is_public": True}, session=reads.session).sort("usage_count", -1):
+            world["_id"] = str(world["_id"])
+            world["id"] = world["_id"]
+            items.append(world)
     return items
 
 
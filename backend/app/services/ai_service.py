@@ -1,9 +1,33 @@
+import asyncio
+import json
+import time
 from app.core.config import settings
-from openai import OpenAI
+from app.services import llm_resilience
+from app.services.chapter_index import passage_index
+from app.services.character_cards import character_cards, render_character_cards
+from app.services.llm_hedging import hedged_completion
+from app.services.llm_usage import call_record
+from app.services.prompt_budget import (
+    budget_stats,
+    count_tokens,
+    fit_actions,
+    fit_character_cards,
+    fit_fields,
+    fit_history,
+    HISTORY_OMITTED,
+)
+from app.services.llm_scheduler import (
+    llm_scheduler,
+    estimate_tokens,
+    PRIORITY_LIVE_CHAPTER,
+    PRIORITY_FIRST_CHAPTER,
+    PRIORITY_EVALUATION,
+    PRIORITY_BACKGROUND,
+    PRIORITY_SPECULATIVE,
+)
+from app.services.llm_provider import get_provider
 from typing import List, Dict, Any, Optional
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
-
 SYSTEM_PROMPT_ES = (
     "Eres un narrador invisible especializado en historias colaborativas. Escribe en tercera persona, sin decir 'Narrador' ni referirte a ti mismo.\n\n"
     "REGLAS FUNDAMENTALES (OBLIGATORIAS):\n"
@@ -56,15 +80,34 @@ def _characters_json(characters: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         })
     return out
 
-def _previous_chapters_compact(previous_chapters: List[str]) -> List[str]:
-    """Compacta capítulos previos para economizar tokens"""
-    compact = []
-    for i, ch in enumerate(previous_chapters or [], 1):
-        text = (ch or "").strip().replace("\n", " ")
-        # Mantener más contexto para los últimos capítulos
-        max_length = 400 if i >= len(previous_chapters) - 1 else 250
-        compact.append(f"Cap.{i}: {text[:max_length]}{'...' if len(text) > max_length else ''}")
-    return compact
+# Cambiar si cambia la estructura del prefijo: las partidas regeneran el suyo
+PROMPT_PREFIX_VERSION = 3
+
+
+def build_prompt_prefix(world: Dict[str, Any], characters: List[Dict[str, Any]]) -> str:
+    """Prefijo estable de la partida: reglas del narrador + mundo + fichas de personajes.
+
+    Es idéntico en todos los turnos de una partida (se calcula una vez y se guarda en
+    `games.prompt_prefix`), de modo que el proveedor puede reutilizar su caché de prompt.
+    Todo lo que cambia por turno va en el mensaje de usuario que sigue.
+    Mundo y fichas se ajustan a PROMPT_BUDGET_WORLD / PROMPT_BUDGET_CHARACTERS.
+    """
+    summary, logic, time_period, space_setting = fit_fields(
+        [str(world.get(f) or "") for f in ("summary", "logic", "time_period", "space_setting")],
+        settings.PROMPT_BUDGET_WORLD,
+    )
+    # Fichas precalculadas al seleccionar el personaje (ver character_cards)
+    cards = fit_character_cards(character_cards(characters), settings.PROMPT_BUDGET_CHARACTERS, render_character_cards)
+    return (
+        f"{SYSTEM_PROMPT_ES}\n\n"
+        "=== CONTEXTO DE LA PARTIDA ===\n"
+        "🛡️ REGLA FUNDAMENTAL: Esta historia DEBE centrarse exclusivamente en los siguientes personajes. "
+        "NO inventes nuevos protagonistas. Mantén coherencia absoluta con eventos previos.\n\n"
+        f"🌍 MUNDO: {summary} | LÓGICA: {logic} | "
+        f"ÉPOCA: {time_period} | ESCENARIO: {space_setting}\n\n"
+        f"👥 PERSONAJES PROTAGONISTAS (usar TODOS):\n{render_character_cards(cards)}"
+    )
+
 
 def _player_actions_json(actions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     out = []
@@ -82,66 +125,160 @@ def _player_actions_json(actions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
 class AIService:
     """Servicio de IA para generar capítulos y evaluar personajes"""
 
-    def _completion_kwargs(self, max_tokens: Optional[int] = None) -> dict:
+    # `usage` de la última completion de esta instancia (tokens de prompt, caché...)
+    last_usage: Any = None
+    # Reparto de tokens del último prompt de capítulo (ver prompt_budget)
+    last_prompt_plan: Optional[Dict[str, Any]] = None
+    # Registro de la última llamada: modelo, tokens, latencia, reintentos, fallback y coste (ver llm_usage)
+    last_call: Optional[Dict[str, Any]] = None
+
+    def _mark_fallback(self) -> None:
+        """La última generación devolvió el texto de respaldo."""
+        self.last_call = {**(self.last_call or call_record(None, None, 0.0)), "fallback": True}
+
+    def _completion_kwargs(self, max_tokens: Optional[int] = None, model: Optional[str] = None) -> dict:
         """Build kwargs for chat.completions.create supporting GPT-5 params when applicable.
         - Removes legacy sampling params like temperature/top_p.
-        - If model name suggests GPT-5, pass reasoning/text controls from settings.
+        - If model name suggests GPT-5, pass reasoning/text controls from settings
+          (natively or via `extra_body`, según lo que acepte el SDK instalado).
         """
         kwargs: dict = {}
         if max_tokens is not None:
             # Use the legacy `max_tokens` name for compatibility with older SDKs/servers.
             kwargs["max_tokens"] = max_tokens
-        model = (settings.OPENAI_MODEL or "").lower()
-        if model.startswith("gpt-5"):
-            # Adopt new parameter shapes if supported by client version
-            kwargs["reasoning"] = {"effort": settings.OPENAI_REASONING_EFFORT}
-            kwargs["text"] = {"verbosity": settings.OPENAI_TEXT_VERBOSITY}
+        model = (model or settings.OPENAI_MODEL or "").lower()
+        if model.startswith("gpt-5") and llm_resilience.capabilities.extended_enabled:
+            extended = {
+                "reasoning": {"effort": settings.OPENAI_REASONING_EFFORT},
+                "text": {"verbosity": settings.OPENAI_TEXT_VERBOSITY},
+            }
+            if llm_resilience.capabilities.native_kwargs(get_provider().create):
+                kwargs.update(extended)
+            else:
+                kwargs["extra_body"] = extended
         return kwargs
 
-    def _safe_chat_completion(self, messages: List[Dict[str, str]], max_tokens: Optional[int]) -> Any:
-        """Invoca chat.completions con compatibilidad hacia atrás.
-        Si el cliente no soporta kwargs como `reasoning`/`text`, reintenta sin ellos.
+    def _safe_chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int],
+        model: Optional[str] = None,
+        call_stats: Optional[Dict[str, Any]] = None,
+        **extra: Any,
+    ) -> Any:
+        """Invoca chat.completions con reintentos clasificados y circuit breaker.
+        Si el servidor rechaza los parámetros extendidos, se desactivan una vez y se repite sin ellos.
+        `extra` se pasa tal cual al SDK (p.ej. `stream=True`); `call_stats` acumula los reintentos.
         """
+        model = model or settings.OPENAI_MODEL
         base = {
-            "model": settings.OPENAI_MODEL,
+            "model": model,
             "messages": messages,
+            **extra,
         }
+        kwargs = self._completion_kwargs(max_tokens=max_tokens, model=model)
+        provider = get_provider()
         try:
-            return client.chat.completions.create(
-                **base,
-                **self._completion_kwargs(max_tokens=max_tokens),
+            return llm_resilience.call_with_retries(
+                lambda: provider.create(**base, **kwargs), call_stats
             )
-        except TypeError:
-            # SDK antiguo que no acepta nuevos kwargs -> reintentar usando `max_tokens`
-            fb = dict(base)
-            if max_tokens is not None:
-                fb["max_tokens"] = max_tokens
-            return client.chat.completions.create(**fb)
-        except Exception:
-            # Cualquier otro error al pasar nuevos kwargs -> reintentar básico con `max_tokens`
-            fb = dict(base)
-            if max_tokens is not None:
-                fb["max_tokens"] = max_tokens
-            return client.chat.completions.create(**fb)
-
-    async def generate_first_chapter(self, world: Dict[str, Any], characters: List[Dict[str, Any]]) -> str:
-        """Genera el primer capítulo usando la plantilla solicitada (sin voz de narrador)."""
-        characters_json = _characters_json(characters)
+        except Exception as e:
+            extended = "reasoning" in kwargs or "extra_body" in kwargs
+            if not extended or llm_resilience.classify_error(e) != llm_resilience.ERROR_BAD_REQUEST:
+                raise
+            llm_resilience.capabilities.disable_extended(str(e))
+            return llm_resilience.call_with_retries(
+                lambda: provider.create(**base, **self._completion_kwargs(max_tokens=max_tokens, model=model)),
+                call_stats,
+            )
+
+    def _chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int],
+        priority: int = PRIORITY_BACKGROUND,
+        key: Optional[str] = None,
+    ) -> Any:
+        """Completion síncrona (para hilos de trabajo) con turno del planificador global."""
+        call_stats = {"retries": 0}
+        started = time.monotonic()
+        try:
+            with llm_scheduler.blocking_slot(priority, key, estimate_tokens(messages, max_tokens)) as ticket:
+                response = self._safe_chat_completion(messages, max_tokens, call_stats=call_stats)
+                ticket.record_usage(response)
+        except Exception as e:
+            self.last_call = call_record(None, None, time.monotonic() - started, call_stats["retries"],
+                                         priority, error=llm_resilience.classify_error(e))
+            raise
+        self.last_usage = getattr(response, "usage", None)
+        self.last_call = call_record(getattr(response, "model", None), self.last_usage,
+                                     time.monotonic() - started, call_stats["retries"], priority)
+        return response
+
+    async def _achat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int],
+        priority: int = PRIORITY_BACKGROUND,
+        key: Optional[str] = None,
+        hedge: bool = False,
+    ) -> Any:
+        """Completion asíncrona: espera turno en el planificador y llama a OpenAI en un hilo.
+        Con `hedge=True` y LLM_HEDGING_ENABLED, se usa una petición de respaldo si la principal tarda.
+        """
+        call_stats = {"retries": 0}
+        started = time.monotonic()
+        try:
+            if hedge and settings.LLM_HEDGING_ENABLED:
+                def open_stream(model: Optional[str]) -> Any:
+                    return self._safe_chat_completion(
+                        messages, max_tokens, model=model, call_stats=call_stats,
+                        stream=True, stream_options={"include_usage": True},
+                    )
+
+                response = await hedged_completion(
+                    open_stream, priority, key,
+                    tokens=estimate_tokens(messages, max_tokens),
+                    prompt_tokens=estimate_tokens(messages, 0),
+                )
+            else:
+                async with llm_scheduler.slot(priority, key, estimate_tokens(messages, max_tokens)) as ticket:
+                    response = await asyncio.to_thread(
+                        self._safe_chat_completion, messages, max_tokens, call_stats=call_stats
+                    )
+                    ticket.record_usage(response)
+        except Exception as e:
+            self.last_call = call_record(None, None, time.monotonic() - started, call_stats["retries"],
+                                         priority, error=llm_resilience.classify_error(e))
+            raise
+        # La latencia incluye la espera en el planificador: es lo que percibe el jugador
+        self.last_usage = getattr(response, "usage", None)
+        self.last_call = call_record(getattr(response, "model", None), self.last_usage,
+                                     time.monotonic() - started, call_stats["retries"], priority)
+        return response
+
+    async def generate_first_chapter(
+        self,
+        world: Dict[str, Any],
+        characters: List[Dict[str, Any]],
+        game_id: Optional[str] = None,
+        prompt_prefix: Optional[str] = None,
+        speculative: bool = False,
+    ) -> str:
+        """Genera el primer capítulo usando la plantilla solicitada (sin voz de narrador).
+        `speculative=True` (pre-generación en la sala): prioridad mínima, sin hedging y sin texto de respaldo.
+        """
+        cards = character_cards(characters)
+        prompt_prefix = prompt_prefix or build_prompt_prefix(world, characters)
 
         # Forzar inclusión: lista de nombres y breve descriptor por personaje para que la IA los trate como protagonistas
-        names = [c.get("name") or c.get("character_name") or "" for c in characters_json]
-        name_list = ", ".join([n for n in names if n])
-        brief_descs = []
-        for c in characters_json:
-            desc = c.get("background") or (c.get("physical") and c.get("physical")[0].get("description") if c.get("physical") else "")
-            brief_descs.append(f"{c.get('name','')}: {desc[:120]}")
+        name_list = ", ".join([c["name"] for c in cards if c.get("name")])
+        brief_descs = "; ".join(f"{c.get('name', '')}: {c.get('background', '')}" for c in cards)
 
+        # Mundo y fichas van en el prefijo estable (mensaje de sistema)
         prompt = (
             "Plantilla: Primer capítulo (con personajes)\n"
             "Uso: generate_first_chapter(world, characters)\n\n"
-            f"Contexto del mundo: {world.get('summary','')} Lógica del mundo: {world.get('logic','')} "
-            f"Período: {world.get('time_period','')} • Escenario: {world.get('space_setting','')}\n\n"
-            f"Personajes seleccionados (JSON): {characters_json}\n\n"
             "Asegúrate de presentar a cada personaje por nombre y rasgos únicos integrados en la acción, no como una ficha.\n\n"
             f"PARA REFORZAR: FORZAR INCLUSIÓN -> Estos personajes deben aparecer COMO PROTAGONISTAS ACTIVOS en este capítulo: {name_list}.\n"
             f"Si alguno no puede participar activamente, menciona su nombre y explica brevemente (1 frase) por qué no lo hace, sin apartar la acción principal.\n"
@@ -155,16 +292,22 @@ class AIService:
         )
 
         try:
-            response = self._safe_chat_completion(
+            response = await self._achat_completion(
                 [
-                    {"role": "system", "content": SYSTEM_PROMPT_ES},
+                    {"role": "system", "content": prompt_prefix},
                     {"role": "user", "content": prompt},
                 ],
                 max_tokens=1400,
+                priority=PRIORITY_SPECULATIVE if speculative else PRIORITY_FIRST_CHAPTER,
+                key=game_id,
+                hedge=not speculative,
             )
             return (response.choices[0].message.content or "").strip()
         except Exception as e:
+            if speculative:
+                raise
             print(f"Error generating first chapter: {e}")
+            self._mark_fallback()
             return (
                 "Una brisa tensa recorre el escenario mientras las miradas se cruzan; algo está a punto de ocurrir…"
             )
@@ -176,13 +319,22 @@ class AIService:
         characters: List[Dict[str, Any]],
         total_chapters: int,
         chapter_index: int,
-        player_actions: Optional[List[Dict[str, Any]]] = None
+        player_actions: Optional[List[Dict[str, Any]]] = None,
+        game_id: Optional[str] = None,
+        prompt_prefix: Optional[str] = None,
+        priority: int = PRIORITY_LIVE_CHAPTER,
+        fallback_on_error: bool = True,
     ) -> str:
-        """Método unificado para generar capítulos, con o sin acciones de jugadores."""
+        """Método unificado para generar capítulos, con o sin acciones de jugadores.
+
+        El mensaje de sistema es el prefijo estable de la partida (`build_prompt_prefix`);
+        el mensaje de usuario lleva solo lo que cambia en cada turno.
+        Con `fallback_on_error=False` los errores se propagan en lugar de devolver el
+        texto de respaldo (lo usa la generación especulativa).
+        """
+
+        prompt_prefix = prompt_prefix or build_prompt_prefix(world, characters)
 
-        characters_json = _characters_json(characters)
-        prev_compact = _previous_chapters_compact(previous_chapters)
-        
         # Calcular puntos narrativos dinámicos basados en total_chapters
         climax_chapter = max(2, round(total_chapters * 0.7)) if total_chapters > 2 else total_chapters - 1
         mid_point = max(2, round(total_chapters * 0.5)) if total_chapters > 3 else 2
@@ -230,25 +382,21 @@ class AIService:
              if is_last else "Termina con un micro-cliffhanger que genere expectación para el siguiente capítulo.")
         )
 
-        # Construcción del prompt reforzado
+        # Parte variable del prompt (el mundo y los personajes están en el prefijo)
         prompt_sections = [
             f"=== GENERACIÓN DE CAPÍTULO {chapter_index}/{total_chapters} ===\n",
             
             f"📖 {narrative_phase}\n",
             
-            "🛡️ REGLA FUNDAMENTAL: Esta historia DEBE centrarse exclusivamente en los siguientes personajes. "
-            "NO inventes nuevos protagonistas. Mantén coherencia absoluta con eventos previos.\n",
-            
-            f"🌍 MUNDO: {world.get('summary', '')} | LÓGICA: {world.get('logic', '')} | "
-            f"ÉPOCA: {world.get('time_period', '')} | ESCENARIO: {world.get('space_setting', '')}\n",
-            
-            f"👥 PERSONAJES PROTAGONISTAS (usar TODOS): {characters_json}\n",
-            
-            f"📚 CONTEXTO PREVIO: {prev_compact}\n" if prev_compact else "📚 CONTEXTO: Este es el primer capítulo.\n",
+            "",  # historial: se rellena al final con el presupuesto que quede
         ]
+        trimmed = []
 
         if player_actions:
-            actions_json = _player_actions_json(player_actions)
+            raw_actions = _player_actions_json(player_actions)
+            actions_json = fit_actions(raw_actions, settings.PROMPT_BUDGET_ACTIONS)
+            if actions_json != raw_actions:
+                trimmed.append("actions")
             prompt_sections.extend([
                 f"⚔️ ACCIONES DE JUGADORES A INTEGRAR: {actions_json}\n",
                 "INSTRUCCIÓN: Para cada acción, evalúa si tiene éxito, falla parcialmente o tiene un costo inesperado. "
@@ -259,6 +407,20 @@ class AIService:
                 "⚔️ SIN ACCIONES: Continúa la historia naturalmente. Mantén a los personajes activos y sus motivaciones presentes.\n"
             )
 
+        # Pasajes de capítulos antiguos relevantes para las acciones (o para el final del último capítulo)
+        retrieval_query = (
+            " ".join(a["action"] for a in actions_json) if player_actions
+            else (previous_chapters[-1] if previous_chapters else "")[-600:]
+        )
+        passages = passage_index.relevant_passages(
+            game_id, previous_chapters, retrieval_query, settings.PROMPT_BUDGET_RETRIEVAL
+        ) if game_id else []
+        retrieval_tokens = 0
+        if passages:
+            retrieval_section = "📌 PASAJES RELEVANTES DE CAPÍTULOS ANTERIORES:\n" + "\n".join(passages) + "\n"
+            retrieval_tokens = count_tokens(retrieval_section)
+            prompt_sections.append(retrieval_section)
+
         prompt_sections.extend([
             "📋 INSTRUCCIONES ESPECÍFICAS:",
             "1. CONTINUIDAD: Mantén coherencia total con capítulos previos y personajes establecidos.",
@@ -271,24 +433,52 @@ class AIService:
             
             "📝 GENERA EL CAPÍTULO:"
         ])
-        
+
+        # El historial recibe lo que dejan libre el prefijo, las acciones y las instrucciones
+        prefix_tokens = count_tokens(prompt_prefix)
+        fixed_tokens = count_tokens("\n".join(prompt_sections))
+        history_budget = max(settings.PROMPT_HISTORY_MIN_TOKENS, settings.PROMPT_TOKEN_BUDGET - prefix_tokens - fixed_tokens)
+        prev_compact = fit_history(previous_chapters, history_budget)
+        if prev_compact and prev_compact[0].endswith(HISTORY_OMITTED):
+            trimmed.append("history")
+        prompt_sections[2] = (
+            f"📚 CONTEXTO PREVIO: {prev_compact}\n" if prev_compact else "📚 CONTEXTO: Este es el primer capítulo.\n"
+        )
         prompt = "\n".join(prompt_sections)
+        history_tokens = count_tokens(prompt_sections[2])
+        actions_tokens = count_tokens(str(actions_json)) if player_actions else 0
+        self.last_prompt_plan = {
+            "budget": settings.PROMPT_TOKEN_BUDGET,
+            "sections": {
+                "prefix": prefix_tokens,
+                "history": history_tokens,
+                "actions": actions_tokens,
+                "retrieval": retrieval_tokens,
+                "instructions": fixed_tokens - actions_tokens - retrieval_tokens,
+            },
+            "trimmed": trimmed,
+            "total": prefix_tokens + fixed_tokens + history_tokens,
+        }
 
         try:
             print(f"🔍 DEBUG _generate_chapter:")
             print(f"   Model: {settings.OPENAI_MODEL}")
             print(f"   Chapter {chapter_index}/{total_chapters}")
-            print(f"   Characters count: {len(characters_json)}")
+            print(f"   Characters count: {len(characters)}")
             print(f"   Player actions: {len(player_actions) if player_actions else 0}")
-            print(f"   Prompt length: {len(prompt)} chars")
+            print(f"   Prompt tokens: {self.last_prompt_plan['sections']} (trimmed: {trimmed or 'none'})")
 
-            response = self._safe_chat_completion(
+            response = await self._achat_completion(
                 [
-                    {"role": "system", "content": SYSTEM_PROMPT_ES},
+                    {"role": "system", "content": prompt_prefix},
                     {"role": "user", "content": prompt},
                 ],
                 max_tokens=1500,
+                priority=priority,
+                key=game_id,
+                hedge=priority == PRIORITY_LIVE_CHAPTER,
             )
+            budget_stats.record(self.last_prompt_plan, self.last_usage)
             content = (response.choices[0].message.content or "").strip()
             
             print(f"   Response length: {len(content)} chars")
@@ -304,6 +494,9 @@ class AIService:
             return content
         except Exception as e:
             print(f"Error generating chapter: {e}")
+            if not fallback_on_error:
+                raise
+            self._mark_fallback()
             return "La historia continúa desarrollándose con tensión creciente mientras los destinos se entrelazan..."
 
     async def generate_chapter_with_actions(
@@ -313,11 +506,14 @@ class AIService:
         player_actions: List[Dict[str, Any]], 
         characters: List[Dict[str, Any]],
         total_chapters: int,
-        chapter_index: int
+        chapter_index: int,
+        game_id: Optional[str] = None,
+        prompt_prefix: Optional[str] = None,
     ) -> str:
         """Genera un capítulo incorporando acciones de jugadores."""
         return await self._generate_chapter(
-            world, previous_chapters, characters, total_chapters, chapter_index, player_actions
+            world, previous_chapters, characters, total_chapters, chapter_index, player_actions,
+            game_id=game_id, prompt_prefix=prompt_prefix,
         )
 
     async def generate_chapter_automatic(
@@ -326,11 +522,19 @@ class AIService:
         previous_chapters: List[str], 
         characters: List[Dict[str, Any]],
         total_chapters: int,
-        chapter_index: int
+        chapter_index: int,
+        game_id: Optional[str] = None,
+        prompt_prefix: Optional[str] = None,
+        speculative: bool = False,
     ) -> str:
-        """Genera un capítulo automáticamente sin acciones de jugadores."""
+        """Genera un capítulo automáticamente sin acciones de jugadores.
+        `speculative=True`: prioridad mínima, sin esperar cola y sin texto de respaldo.
+        """
         return await self._generate_chapter(
-            world, previous_chapters, characters, total_chapters, chapter_index
+            world, previous_chapters, characters, total_chapters, chapter_index,
+            game_id=game_id, prompt_prefix=prompt_prefix,
+            priority=PRIORITY_SPECULATIVE if speculative else PRIORITY_LIVE_CHAPTER,
+            fallback_on_error=not speculative,
         )
 
 
@@ -359,12 +563,18 @@ STORY_GEN_PROMPT = (
     " genera un capítulo coherente y emocionante. Considera sugerencias de acciones de los jugadores."
 )
 
-def evaluate_character(character: dict) -> dict:
-    """Evalúa un personaje y devuelve correcciones específicas"""
-    import json
-    
-    # Preparar los datos del personaje para la IA
-    character_data = {
+CHAR_EVAL_BATCH_PROMPT = (
+    "Evalúa CADA personaje de la lista siguiendo las mismas reglas."
+    " Responde ÚNICAMENTE con un objeto JSON válido con esta estructura:"
+    ' {"results": [ {"index": <posición del personaje en la lista, empezando en 0>,'
+    ' "evaluation_summary": ..., "needs_improvement": ..., "corrected_character": {...}} ]}'
+    " Incluye exactamente un resultado por personaje, en el mismo orden."
+)
+
+
+def _character_eval_data(character: dict) -> dict:
+    """Campos del personaje que se envían a la IA para evaluar."""
+    return {
         "name": character.get('name', ''),
         "physical": character.get('physical', []),
         "mental": character.get('mental', []),
@@ -373,24 +583,33 @@ def evaluate_character(character: dict) -> dict:
         "background": character.get('background', ''),
         "beliefs": character.get('beliefs', '')
     }
+
+
+def _parse_ai_json(ai_response: str):
+    """Parsear JSON de la IA, limpiando posibles bloques markdown."""
+    ai_response = (ai_response or "").strip()
+    if ai_response.startswith('```'):
+        ai_response = ai_response.replace('```json', '').replace('```', '')
+    return json.loads(ai_response)
+
+
+def evaluate_character(character: dict) -> dict:
+    """Evalúa un personaje y devuelve correcciones específicas"""
+    # Preparar los datos del personaje para la IA
+    character_data = _character_eval_data(character)
     
     prompt = f"{CHAR_EVAL_PROMPT}\n\nPersonaje a evaluar:\n{json.dumps(character_data, indent=2, ensure_ascii=False)}"
     
     try:
         ai_service = AIService()
-        resp = ai_service._safe_chat_completion(
+        resp = ai_service._chat_completion(
             messages=[{"role": "user", "content": prompt}],
             max_tokens=None,
+            priority=PRIORITY_EVALUATION,
         )
         
-        # Intentar parsear la respuesta JSON
-        ai_response = resp.choices[0].message.content.strip()
-        
-        # Limpiar la respuesta por si tiene markdown
-        if ai_response.startswith('```json'):
-            ai_response = ai_response.replace('```json', '').replace('```', '')
-        
-        result = json.loads(ai_response)
+        # Intentar parsear la respuesta JSON (limpiando markdown si lo hay)
+        result = _parse_ai_json(resp.choices[0].message.content)
         return result
         
     except json.JSONDecodeError:
@@ -398,18 +617,60 @@ def evaluate_character(character: dict) -> dict:
         return {
             "evaluation_summary": "Error al procesar evaluación de IA",
             "needs_improvement": False,
-            "corrected_character": character_data
+            "corrected_character": character_data,
+            "fallback": True,
         }
     except Exception as e:
         # Fallback para cualquier otro error
         return {
             "evaluation_summary": f"Error: {str(e)}",
             "needs_improvement": False,
-            "corrected_character": character_data
+            "corrected_character": character_data,
+            "fallback": True,
         }
 
 
-def generate_story_chapter(room: dict, characters: list[dict], suggestions: list[str]) -> str:
+def evaluate_characters_batch(characters: List[dict]) -> List[Optional[dict]]:
+    """Evalúa varios personajes en una sola llamada estructurada.
+
+    Devuelve una lista alineada con `characters`; las posiciones que la IA no
+    devolvió (o devolvió mal formadas) quedan en None para que el llamador
+    las evalúe por separado. Si la llamada falla por completo, todas son None.
+    """
+    payload = [_character_eval_data(ch) for ch in characters]
+    prompt = (
+        f"{CHAR_EVAL_PROMPT}\n\n{CHAR_EVAL_BATCH_PROMPT}\n\n"
+        f"Personajes a evaluar:\n{json.dumps(payload, ensure_ascii=False)}"
+    )
+    results: List[Optional[dict]] = [None] * len(characters)
+    try:
+        resp = AIService()._chat_completion(
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=None,
+            priority=PRIORITY_EVALUATION,
+        )
+        parsed = _parse_ai_json(resp.choices[0].message.content)
+    except Exception as e:
+        print(f"[evaluate_characters_batch] batch call failed: {e}")
+        return results
+
+    items = parsed.get("results") if isinstance(parsed, dict) else parsed
+    for pos, item in enumerate(items if isinstance(items, list) else []):
+        if not isinstance(item, dict) or not isinstance(item.get("corrected_character"), dict):
+            continue
+        idx = item.get("index", pos)
+        if isinstance(idx, int) and 0 <= idx < len(results) and results[idx] is None:
+            results[idx] = {
+                "evaluation_summary": item.get("evaluation_summary") or "Evaluación completada",
+                "needs_improvement": bool(item.get("needs_improvement", False)),
+                "corrected_character": item["corrected_character"],
+            }
+    return results
+
+
+def generate_story_chapter(room: dict, characters: list[dict], suggestions: list[str],
+                           ai: Optional[AIService] = None) -> str:
+    """Capítulo de una sala (legacy). Pasar `ai` para leer después `ai.last_call`."""
     # Normalizar información del mundo (puede venir como dict o string/id)
     world_obj = room.get('world') or {}
     if isinstance(world_obj, dict):
@@ -443,12 +704,13 @@ def generate_story_chapter(room: dict, characters: list[dict], suggestions: list
     print(f"   Prompt preview: {prompt[:500]}...")
 
     # Usar wrapper seguro y enviar también el system prompt para guiar el estilo
-    resp = AIService()._safe_chat_completion(
+    resp = (ai or AIService())._chat_completion(
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT_ES},
             {"role": "user", "content": prompt},
         ],
         max_tokens=1500,
+        priority=PRIORITY_BACKGROUND,
     )
 
     result = (resp.choices[0].message.content or "").strip()
@@ -526,12 +788,13 @@ Narra en tercera persona, con estilo inmersivo y descriptivo. ¡Que sea memorabl
 CAPÍTULO {current_chapter}:"""
 
     try:
-        response = AIService()._safe_chat_completion(
+        response = await AIService()._achat_completion(
             messages=[
                 {"role": "system", "content": "Eres un narrador maestro especializado en aventuras colaborativas."},
                 {"role": "user", "content": prompt}
             ],
             max_tokens=800,
+            priority=PRIORITY_BACKGROUND,
         )
         
         return response.choices[0].message.content.strip()
@@ -0,0 +1,184 @@
+"""Índice BM25 en memoria sobre los capítulos de cada partida.
+
+El historial del prompt solo conserva el inicio de cada capítulo anterior, así
+que un detalle de la mitad del capítulo 3 se pierde. Este índice divide cada
+capítulo en pasajes (~60 palabras, por frases) y recupera los más relevantes
+para las acciones del turno (o, sin acciones, para el final del último
+capítulo), dentro de un presupuesto fijo de tokens (PROMPT_BUDGET_RETRIEVAL).
+
+- Se actualiza de forma incremental al insertar cada capítulo en `game_chapters`.
+- Si el proceso se reinicia, el índice de una partida se reconstruye la primera
+  vez que se consulta, a partir de los capítulos que ya se cargan para el prompt.
+- Se guardan como mucho CHAPTER_INDEX_MAX_GAMES partidas (LRU).
+"""
+import math
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.prompt_budget import count_tokens
+
+_K1 = 1.5
+_B = 0.75
+_PASSAGE_WORDS = 60
+
+_STOPWORDS = set("""
+a al algo algun alguna algunas alguno algunos ante antes como con contra cual cuando de del desde donde
+durante e el ella ellas ello ellos en entre era eran es esa esas ese eso esos esta estaba estaban estan
+estar este esto estos fue fueron ha habia han hasta hay la las le les lo los mas me mi mientras muy nada
+ni no nos o otra otras otro otros para pero poco por porque que quien se sea ser si sin sobre su sus
+tambien tan te tenia tiene todo todos tu un una unas uno unos y ya yo
+""".split())
+
+
+def _fold(text: str) -> str:
+    """Minúsculas y sin tildes, para que 'Dragón' y 'dragon' coincidan."""
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in normalized if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    return [w for w in re.findall(r"\w+", _fold(text or "")) if len(w) > 1 and w not in _STOPWORDS]
+
+
+def split_passages(text: str) -> List[str]:
+    """Agrupar frases consecutivas hasta ~_PASSAGE_WORDS palabras por pasaje."""
+    sentences = re.split(r"(?<=[.!?…])\s+", (text or "").strip())
+    passages, current, words = [], [], 0
+    for sentence in sentences:
+        if not sentence:
+            continue
+        current.append(sentence)
+        words += len(sentence.split())
+        if words >= _PASSAGE_WORDS:
+            passages.append(" ".join(current))
+            current, words = [], 0
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+class GameChapterIndex:
+    """Índice invertido de los pasajes de una partida."""
+
+    def __init__(self):
+        self.passages: List[Tuple[int, str]] = []          # (capítulo, texto)
+        self.lengths: List[int] = []
+        self.postings: Dict[str, Dict[int, int]] = {}      # término -> {pasaje: frecuencia}
+        self.chapters: set = set()
+        self.total_length = 0
+
+    def add_chapter(self, chapter_number: int, text: str) -> None:
+        if chapter_number in self.chapters:
+            return
+        self.chapters.add(chapter_number)
+        for passage in split_passages(text):
+            terms = tokenize(passage)
+            if not terms:
+                continue
+            doc_id = len(self.passages)
+            self.passages.append((chapter_number, passage))
+            self.lengths.append(len(terms))
+            self.total_length += len(terms)
+            for term in terms:
+                bucket = self.postings.setdefault(term, {})
+                bucket[doc_id] = bucket.get(doc_id, 0) + 1
+
+    def search(self, query: str, exclude_chapters: Optional[set] = None, limit: int = 10) -> List[Tuple[float, int]]:
+        """(puntuación BM25, pasaje) de mayor a menor."""
+        n = len(self.passages)
+        if not n:
+            return []
+        avg_length = self.total_length / n
+        exclude_chapters = exclude_chapters or set()
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            bucket = self.postings.get(term)
+            if not bucket:
+                continue
+            idf = math.log(1 + (n - len(bucket) + 0.5) / (len(bucket) + 0.5))
+            for doc_id, tf in bucket.items():
+                if self.passages[doc_id][0] in exclude_chapters:
+                    continue
+                norm = tf + _K1 * (1 - _B + _B * self.lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (_K1 + 1) / norm
+        ranked = sorted(((score, doc_id) for doc_id, score in scores.items()), reverse=True)
+        return ranked[:limit]
+
+
+class ChapterIndexRegistry:
+    def __init__(self, max_games: int):
+        self.max_games = max_games
+        self._indexes: "OrderedDict[str, GameChapterIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.rebuilds = 0
+
+    def _get(self, game_id: str, create: bool) -> Optional[GameChapterIndex]:
+        with self._lock:
+            index = self._indexes.get(game_id)
+            if index is not None:
+                self._indexes.move_to_end(game_id)
+            elif create:
+                index = self._indexes[game_id] = GameChapterIndex()
+                while len(self._indexes) > max(1, self.max_games):
+                    self._indexes.popitem(last=False)
+            return index
+
+    def add_chapter(self, game_id: str, chapter_number: int, text: str) -> None:
+        """Indexar un capítulo recién insertado (solo si la partida ya tiene índice en memoria)."""
+        index = self._get(str(game_id), create=False)
+        if index is not None:
+            index.add_chapter(chapter_number, text)
+
+    def relevant_passages(
+        self,
+        game_id: str,
+        previous_chapters: List[str],
+        query: str,
+        budget_tokens: int,
+        exclude_recent: int = 2,
+    ) -> List[str]:
+        """Pasajes de capítulos anteriores (sin los `exclude_recent` últimos) más
+        relevantes para `query`, en orden de la historia y dentro de `budget_tokens`."""
+        total = len(previous_chapters or [])
+        if budget_tokens <= 0 or not query or total <= exclude_recent:
+            return []
+        index = self._get(str(game_id), create=True)
+        if len(index.chapters) < total:
+            # Reconstrucción (reinicio del proceso) o capítulos que no pasaron por add_chapter
+            self.rebuilds += 1
+            for number, text in enumerate(previous_chapters, 1):
+                index.add_chapter(number, text or "")
+        self.searches += 1
+
+        exclude = set(range(total - exclude_recent + 1, total + 1))
+        picked: List[int] = []
+        remaining = budget_tokens
+        for _, doc_id in index.search(query, exclude_chapters=exclude,
+                                       limit=settings.CHAPTER_RETRIEVAL_MAX_PASSAGES):
+            chapter, passage = index.passages[doc_id]
+            cost = count_tokens(f"[Cap.{chapter}] {passage}")
+            if cost > remaining:
+                continue
+            picked.append(doc_id)
+            remaining -= cost
+        return [f"[Cap.{index.passages[d][0]}] {index.passages[d][1]}" for d in sorted(picked)]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            indexes = list(self._indexes.values())
+        return {
+            "games": len(indexes),
+            "max_games": self.max_games,
+            "passages": sum(len(i.passages) for i in indexes),
+            "terms": sum(len(i.postings) for i in indexes),
+            "searches": self.searches,
+            "rebuilds": self.rebuilds,
+        }
+
+
+passage_index = ChapterIndexRegistry(settings.CHAPTER_INDEX_MAX_GAMES)
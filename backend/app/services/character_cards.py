@@ -0,0 +1,80 @@
+"""Fichas compactas de personaje para los prompts.
+
+La ficha (nombre, rasgos principales con una pista breve y trasfondo en una
+línea) se calcula una sola vez al seleccionar el personaje en la sala y se
+guarda en `rooms.selected_characters[].card`. Cada prompt la reutiliza en lugar
+de recorrer el documento completo del personaje. Las selecciones sin ficha o
+con una versión antigua se recalculan al vuelo.
+"""
+import re
+from typing import Any, Dict, List
+
+from app.services.prompt_budget import truncate_to_tokens
+
+# Cambiar si cambia la forma de la ficha: las selecciones guardadas se recalculan
+CHARACTER_CARD_VERSION = 1
+
+TRAIT_GROUPS = (("physical", "Físico"), ("mental", "Mente"), ("skills", "Habilidades"), ("flaws", "Defectos"))
+TOP_TRAITS = 3
+_BACKGROUND_TOKENS = 40
+_BELIEFS_TOKENS = 20
+_HINT_TOKENS = 10
+
+
+def one_line(text: Any, max_tokens: int) -> str:
+    """Texto en una sola línea (espacios colapsados) recortado a `max_tokens`."""
+    return truncate_to_tokens(re.sub(r"\s+", " ", str(text or "")).strip(), max_tokens)
+
+
+def build_character_card(character: Dict[str, Any]) -> Dict[str, Any]:
+    """Ficha compacta a partir del documento completo del personaje."""
+    traits = {}
+    for group, _ in TRAIT_GROUPS:
+        traits[group] = [
+            {"name": one_line(t.get("name"), _HINT_TOKENS), "hint": one_line(t.get("description"), _HINT_TOKENS)}
+            for t in (character.get(group) or [])[:TOP_TRAITS]
+            if t.get("name")
+        ]
+    return {
+        "version": CHARACTER_CARD_VERSION,
+        "id": str(character.get("_id") or character.get("id") or ""),
+        "name": character.get("name") or character.get("character_name") or "",
+        "background": one_line(character.get("background"), _BACKGROUND_TOKENS),
+        "beliefs": one_line(character.get("beliefs"), _BELIEFS_TOKENS),
+        "traits": traits,
+    }
+
+
+def character_card(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Ficha de una selección de sala (o de un documento de personaje suelto)."""
+    card = item.get("card")
+    if isinstance(card, dict) and card.get("version") == CHARACTER_CARD_VERSION:
+        return card
+    character = item.get("character", item)
+    card = build_character_card(character)
+    if not card["name"]:
+        card["name"] = item.get("character_name") or ""
+    return card
+
+
+def character_cards(characters: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [character_card(item) for item in characters or []]
+
+
+def render_character_cards(cards: List[Dict[str, Any]]) -> str:
+    """Una línea por personaje, en texto plano (sin la sobrecarga de JSON)."""
+    lines = []
+    for card in cards:
+        parts = [f"- {card.get('name', '')}"]
+        if card.get("background"):
+            parts.append(f"Trasfondo: {card['background']}")
+        if card.get("beliefs"):
+            parts.append(f"Creencias: {card['beliefs']}")
+        for group, label in TRAIT_GROUPS:
+            traits = (card.get("traits") or {}).get(group) or []
+            if traits:
+                parts.append(f"{label}: " + ", ".join(
+                    f"{t['name']} ({t['hint']})" if t.get("hint") else t["name"] for t in traits
+                ))
+        lines.append(" | ".join(parts))
+    return "\n".join(lines)
@@ -0,0 +1,138 @@
+"""Caché persistente de evaluaciones de personajes.
+
+La clave es un hash canónico del payload `CharacterCreate` más el modelo y la
+versión del prompt, así un borrador idéntico no vuelve a consumir tokens.
+Las evaluaciones se guardan en la colección `character_eval_cache`.
+"""
+import asyncio
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.models.schemas import CharacterCreate
+from app.services.ai_service import CHAR_EVAL_PROMPT, evaluate_character, evaluate_characters_batch
+
+# Cambia si cambia el prompt de evaluación: invalida entradas antiguas
+_PROMPT_VERSION = hashlib.sha256(CHAR_EVAL_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+# Evaluaciones en curso por clave (evita llamadas duplicadas por doble clic)
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def _cache(db):
+    return db["character_eval_cache"]
+
+
+def evaluation_cache_key(character: Dict[str, Any], model: Optional[str] = None) -> str:
+    """Hash SHA-256 del JSON canónico (claves ordenadas) del personaje + modelo + prompt."""
+    canonical = json.dumps(
+        {"character": character, "model": model or settings.OPENAI_MODEL, "prompt": _PROMPT_VERSION},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+async def get_cached_evaluation(db, key: str) -> Optional[Dict[str, Any]]:
+    doc = await _cache(db).find_one({"_id": key}, {"result": 1})
+    return doc.get("result") if doc else None
+
+
+async def store_evaluation(db, key: str, result: Dict[str, Any]) -> None:
+    """Guardar solo evaluaciones válidas (no fallbacks y con corrección parseable)."""
+    if result.get("fallback"):
+        return
+    try:
+        CharacterCreate(**result.get("corrected_character", {}))
+    except Exception:
+        return
+    await _cache(db).update_one(
+        {"_id": key},
+        {"$set": {"result": result, "model": settings.OPENAI_MODEL, "created_at": datetime.utcnow()}},
+        upsert=True,
+    )
+
+
+async def ensure_indexes(db) -> None:
+    """Índice TTL para que la caché no crezca indefinidamente."""
+    await _cache(db).create_index(
+        "created_at", expireAfterSeconds=settings.CHAR_EVAL_CACHE_TTL_DAYS * 86400
+    )
+
+
+async def evaluate_character_cached(db, character: Dict[str, Any]) -> Dict[str, Any]:
+    """Evaluar un personaje usando la caché; la llamada a la IA se ejecuta fuera del event loop."""
+    key = evaluation_cache_key(character)
+    try:
+        cached = await get_cached_evaluation(db, key)
+    except Exception as e:
+        print(f"[eval_cache] lookup error: {e}")
+        cached = None
+    if cached is not None:
+        return cached
+
+    # Una tarea propia por clave, no ligada a ningún llamador: si el primero se cancela
+    # (cliente desconectado) los demás siguen esperando el mismo resultado
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_evaluate_and_store(db, key, character))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _forget_inflight(key, t))
+    return await asyncio.shield(task)
+
+
+async def _evaluate_and_store(db, key: str, character: Dict[str, Any]) -> Dict[str, Any]:
+    # evaluate_character bloquea en la llamada a OpenAI: ejecutarlo en un hilo
+    result = await asyncio.to_thread(evaluate_character, character)
+    try:
+        await store_evaluation(db, key, result)
+    except Exception as e:
+        print(f"[eval_cache] store error: {e}")
+    return result
+
+
+def _forget_inflight(key: str, task: asyncio.Future) -> None:
+    _inflight.pop(key, None)
+    if not task.cancelled():
+        task.exception()  # marcar como recuperada aunque nadie siga esperando
+
+
+async def evaluate_characters_cached(db, characters: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Evaluar varios personajes: caché primero y una sola llamada a la IA para los que falten.
+
+    Los personajes que el lote no pudo evaluar se reintentan individualmente y en
+    paralelo (con sus propios fallbacks), así cada posición siempre tiene resultado.
+    """
+    keys = [evaluation_cache_key(ch) for ch in characters]
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        async for doc in _cache(db).find({"_id": {"$in": list(set(keys))}}, {"result": 1}):
+            results[doc["_id"]] = doc["result"]
+    except Exception as e:
+        print(f"[eval_cache] batch lookup error: {e}")
+
+    # Pendientes sin duplicados (dos copias del mismo personaje cuestan una evaluación)
+    missing: Dict[str, Dict[str, Any]] = {}
+    for key, ch in zip(keys, characters):
+        if key not in results and key not in _inflight:
+            missing.setdefault(key, ch)
+
+    if len(missing) > 1:
+        batch = await asyncio.to_thread(evaluate_characters_batch, list(missing.values()))
+        for key, result in zip(list(missing), batch):
+            if result is None:
+                continue
+            try:
+                await store_evaluation(db, key, result)
+            except Exception as e:
+                print(f"[eval_cache] store error: {e}")
+            results[key] = result
+
+    # Fallback por elemento: lo que falte (o ya esté en curso) va por la ruta individual
+    pending = {key: ch for key, ch in zip(keys, characters) if key not in results}
+    if pending:
+        singles = await asyncio.gather(*(evaluate_character_cached(db, ch) for ch in pending.values()))
+        results.update(zip(pending, singles))
+
+    return [results[key] for key in keys]
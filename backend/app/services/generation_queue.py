@@ -0,0 +1,274 @@
+"""Cola de generación en Mongo y pool de workers fuera de proceso.
+
+Con GENERATION_MODE=queue los procesos de la API no llaman al LLM: encolan un
+trabajo en `generation_jobs` y responden al instante. Los workers
+(`python -m app.worker`, tantos procesos como haga falta) reclaman trabajos,
+ejecutan el mismo código que el modo inline y publican sus eventos de
+WebSocket en la colección limitada `generation_events`; cada proceso de la API
+los sigue con un cursor tailable y los reenvía a sus sockets locales. Los
+timers de la fase de acciones también se programan en la API (evento en
+CONTROL_CHANNEL), y la generación especulativa no se usa en este modo.
+
+- Tipos de trabajo: se registran con `register(kind, handler)` desde el router
+  que implementa la generación (`advance_chapter`, `initialize_game`,
+  `room_chapter`); `handler(db, **payload)`. Dentro de un worker el handler
+  debe propagar sus errores (`in_worker()`) para que el trabajo se reintente,
+  y ser idempotente: un reintento o un lease caducado lo vuelven a ejecutar.
+  `on_failure(db, error, **payload)` se llama al agotar los intentos.
+- `dedupe_key`: índice único parcial sobre los trabajos activos, así dos
+  cierres de la misma fase (timer + último jugador listo) encolan uno solo.
+- Reclamo con lease: un worker renueva `lease_until` mientras trabaja; si muere,
+  otro lo retoma al caducar (hasta GENERATION_JOB_MAX_ATTEMPTS intentos).
+
+Con GENERATION_MODE=inline (por defecto) `run_generation` llama al handler
+directamente, como antes.
+"""
+import asyncio
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from bson import ObjectId
+from pymongo import CursorType, ReturnDocument
+from pymongo.errors import CollectionInvalid, DuplicateKeyError
+
+from app.core.config import settings
+
+Handler = Callable[..., Awaitable[Any]]
+
+_handlers: Dict[str, Handler] = {}
+_failure_handlers: Dict[str, Handler] = {}
+# True dentro de un proceso worker: las generaciones anidadas se ejecutan inline
+_in_worker = False
+_JOB_RETENTION_SECONDS = 7 * 24 * 3600
+# Canal de `generation_events` para órdenes del worker a la API (no se reenvía a sockets)
+CONTROL_CHANNEL = "_control"
+_EVENTS_CAPPED_BYTES = 16 * 1024 * 1024
+
+
+def _jobs(db):
+    return db["generation_jobs"]
+
+
+def _events(db):
+    return db["generation_events"]
+
+
+def register(kind: str, handler: Handler, on_failure: Optional[Handler] = None) -> None:
+    _handlers[kind] = handler
+    if on_failure is not None:
+        _failure_handlers[kind] = on_failure
+
+
+def in_worker() -> bool:
+    return _in_worker
+
+
+def queue_enabled() -> bool:
+    return settings.GENERATION_MODE == "queue" and not _in_worker
+
+
+async def enqueue(db, kind: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None) -> Optional[str]:
+    """Encolar un trabajo. Devuelve su id, o None si ya hay uno activo con la misma `dedupe_key`."""
+    now = datetime.utcnow()
+    doc = {
+        "kind": kind,
+        "payload": payload,
+        "status": "queued",
+        "active": True,
+        "attempts": 0,
+        "created_at": now,
+        "updated_at": now,
+    }
+    if dedupe_key:
+        doc["dedupe_key"] = dedupe_key
+    try:
+        res = await _jobs(db).insert_one(doc)
+    except DuplicateKeyError:
+        print(f"[generation_queue] {kind} already queued ({dedupe_key}), skipping")
+        return None
+    return str(res.inserted_id)
+
+
+async def run_generation(db, kind: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None) -> None:
+    """Ejecutar la generación inline o encolarla para los workers según GENERATION_MODE."""
+    if queue_enabled():
+        job_id = await enqueue(db, kind, payload, dedupe_key)
+        if job_id:
+            print(f"[generation_queue] enqueued {kind} {job_id} ({dedupe_key})")
+        return
+    await _handlers[kind](db, **payload)
+
+
+async def claim(db, worker_id: str) -> Optional[Dict[str, Any]]:
+    """Reclamar el trabajo más antiguo en cola (o uno cuyo lease caducó)."""
+    now = datetime.utcnow()
+    return await _jobs(db).find_one_and_update(
+        {"$or": [
+            {"status": "queued"},
+            {"status": "running", "lease_until": {"$lt": now}},
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "worker_id": worker_id,
+                "lease_until": now + timedelta(seconds=settings.GENERATION_JOB_LEASE_SECONDS),
+                "started_at": now,
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _renew_lease(db, job_id: ObjectId, worker_id: str) -> None:
+    interval = max(1.0, settings.GENERATION_JOB_LEASE_SECONDS / 3)
+    while True:
+        await asyncio.sleep(interval)
+        await _jobs(db).update_one(
+            {"_id": job_id, "worker_id": worker_id, "status": "running"},
+            {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=settings.GENERATION_JOB_LEASE_SECONDS)}},
+        )
+
+
+async def _finish(db, job: Dict[str, Any], worker_id: str, error: Optional[str], elapsed: float) -> str:
+    """Marcar el trabajo como terminado o devolverlo a la cola; devuelve el estado final."""
+    now = datetime.utcnow()
+    if error and job.get("attempts", 1) < settings.GENERATION_JOB_MAX_ATTEMPTS:
+        update = {"status": "queued", "error": error, "updated_at": now}
+    else:
+        update = {
+            "status": "failed" if error else "done",
+            "active": False,
+            "error": error,
+            "duration_ms": int(elapsed * 1000),
+            "finished_at": now,
+            "updated_at": now,
+        }
+    await _jobs(db).update_one(
+        {"_id": job["_id"], "worker_id": worker_id},
+        {"$set": update, "$unset": {"lease_until": ""}},
+    )
+    return update["status"]
+
+
+async def process_job(db, job: Dict[str, Any], worker_id: str) -> None:
+    kind = job.get("kind")
+    started = time.monotonic()
+    lease = asyncio.create_task(_renew_lease(db, job["_id"], worker_id))
+    error = None
+    try:
+        handler = _handlers.get(kind)
+        if handler is None:
+            raise KeyError(f"unknown job kind {kind!r}")
+        await handler(db, **(job.get("payload") or {}))
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        print(f"[generation_worker] job {job['_id']} ({kind}) failed: {error}")
+    finally:
+        lease.cancel()
+    status = await _finish(db, job, worker_id, error, time.monotonic() - started)
+    print(f"[generation_worker] job {job['_id']} ({kind}) {status} in {time.monotonic() - started:.1f}s")
+    on_failure = _failure_handlers.get(kind)
+    if status == "failed" and on_failure is not None:
+        try:
+            await on_failure(db, error, **(job.get("payload") or {}))
+        except Exception as e:
+            print(f"[generation_worker] on_failure for job {job['_id']} ({kind}) failed: {e}")
+
+
+async def _worker_loop(db, worker_id: str) -> None:
+    while True:
+        try:
+            job = await claim(db, worker_id)
+        except Exception as e:
+            print(f"[generation_worker] claim error: {e}")
+            job = None
+        if job is None:
+            await asyncio.sleep(settings.GENERATION_WORKER_POLL_SECONDS)
+            continue
+        await process_job(db, job, worker_id)
+
+
+async def run_worker(db, concurrency: Optional[int] = None) -> None:
+    """Consumir la cola con `concurrency` trabajos simultáneos en este proceso."""
+    global _in_worker
+    _in_worker = True
+    concurrency = concurrency or settings.GENERATION_WORKER_CONCURRENCY
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"[generation_worker] {worker_id} consuming generation_jobs with concurrency {concurrency}")
+    await asyncio.gather(*(_worker_loop(db, worker_id) for _ in range(concurrency)))
+
+
+# ---------- Eventos de WebSocket: worker -> procesos de la API ----------
+
+async def publish_event(db, message: Dict[str, Any], channel: str) -> None:
+    """Publicar un broadcast emitido en el worker para que lo reenvíen los procesos de la API."""
+    try:
+        await _events(db).insert_one({"channel": channel, "message": message, "created_at": datetime.utcnow()})
+    except Exception as e:
+        print(f"[generation_queue] error publishing event for {channel}: {e}")
+
+
+async def relay_events(db, broadcast: Callable[[Dict[str, Any], str], Awaitable[None]]) -> None:
+    """Seguir `generation_events` (cursor tailable) y reenviar cada evento con `broadcast`."""
+    last_id = ObjectId.from_datetime(datetime.utcnow())
+    while True:
+        try:
+            cursor = _events(db).find({"_id": {"$gt": last_id}}, cursor_type=CursorType.TAILABLE_AWAIT)
+            while cursor.alive:
+                async for doc in cursor:
+                    last_id = doc["_id"]
+                    await broadcast(doc["message"], doc["channel"])
+                await asyncio.sleep(0.1)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[generation_queue] event relay error: {e}")
+        # Colección vacía o cursor muerto: reintentar
+        await asyncio.sleep(1)
+
+
+async def ensure_collections(db) -> None:
+    try:
+        await db.create_collection("generation_events", capped=True, size=_EVENTS_CAPPED_BYTES)
+    except CollectionInvalid:
+        pass
+    await _jobs(db).create_index([("status", 1), ("created_at", 1)])
+    await _jobs(db).create_index(
+        "dedupe_key", unique=True, partialFilterExpression={"active": True, "dedupe_key": {"$exists": True}}
+    )
+    await _jobs(db).create_index("finished_at", expireAfterSeconds=_JOB_RETENTION_SECONDS)
+
+
+async def queue_stats(db) -> Dict[str, Any]:
+    counts = {s: 0 for s in ("queued", "running", "done", "failed")}
+    async for row in _jobs(db).aggregate([{"$group": {"_id": "$status", "n": {"$sum": 1}}}]):
+        counts[row["_id"]] = row["n"]
+    oldest = await _jobs(db).find_one({"status": "queued"}, sort=[("created_at", 1)])
+    durations = [
+        d["duration_ms"] async for d in _jobs(db).find(
+            {"status": "done"}, {"duration_ms": 1}
+        ).sort("finished_at", -1).limit(200)
+        if isinstance(d.get("duration_ms"), int)
+    ]
+    durations.sort()
+    workers = await _jobs(db).distinct("worker_id", {"status": "running"})
+    return {
+        "mode": settings.GENERATION_MODE,
+        "jobs": counts,
+        "oldest_queued_seconds": (
+            round((datetime.utcnow() - oldest["created_at"]).total_seconds(), 1) if oldest else 0
+        ),
+        "busy_workers": workers,
+        "duration_ms_p50": durations[len(durations) // 2] if durations else None,
+        "duration_ms_p95": durations[int(len(durations) * 0.95)] if durations else None,
+        "recent_failures": [
+            {"id": str(j["_id"]), "kind": j.get("kind"), "error": j.get("error"), "attempts": j.get("attempts")}
+            async for j in _jobs(db).find({"status": "failed"}).sort("finished_at", -1).limit(10)
+        ],
+    }
@@ -0,0 +1,244 @@
+"""Peticiones "hedged" para acotar la latencia de cola en la generación de capítulos.
+
+Modo opcional (LLM_HEDGING_ENABLED). La petición principal se hace en
+streaming; si no ha producido ningún token cuando vence el plazo (percentil
+LLM_HEDGE_PERCENTILE del tiempo hasta el primer token de las llamadas
+recientes), se lanza una segunda petición, opcionalmente a un modelo más
+barato (LLM_HEDGE_MODEL). Se usa la que termine primero y la otra se cancela
+cerrando su stream (desbloquea el hilo aunque esté esperando el primer
+token). Cada cupo del planificador se libera cuando su hilo termina, y los
+tokens de la petición perdedora se contabilizan como gasto extra.
+
+Los errores al leer el stream pasan por `llm_resilience` como los de la
+apertura: cuentan para el circuito y, si aún no llegó texto, se reintenta.
+
+La segunda petición solo se lanza si el planificador tiene cupo inmediato:
+bajo presión no se añade carga.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+from typing import Any, Callable, Deque, Dict, Optional
+
+from app.core.config import settings
+from app.services import llm_resilience
+from app.services.llm_scheduler import Ticket, llm_scheduler
+
+
+class HedgeStats:
+    def __init__(self):
+        self.first_output_latencies: Deque[float] = deque(maxlen=settings.LLM_HEDGE_LATENCY_SAMPLES)
+        self.calls = 0
+        self.hedges_fired = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.skipped_no_capacity = 0
+        self.extra_tokens = 0
+
+    def deadline(self) -> float:
+        """Plazo antes de lanzar la segunda petición (percentil del tiempo hasta el primer token)."""
+        samples = sorted(self.first_output_latencies)
+        if len(samples) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return settings.LLM_HEDGE_DEFAULT_DEADLINE_SECONDS
+        idx = min(len(samples) - 1, int(settings.LLM_HEDGE_PERCENTILE * len(samples)))
+        return samples[idx]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.LLM_HEDGING_ENABLED,
+            "hedge_model": settings.LLM_HEDGE_MODEL or settings.OPENAI_MODEL,
+            "deadline_seconds": round(self.deadline(), 3),
+            "samples": len(self.first_output_latencies),
+            "calls": self.calls,
+            "hedges_fired": self.hedges_fired,
+            "hedge_wins": self.hedge_wins,
+            "primary_wins": self.primary_wins,
+            "skipped_no_capacity": self.skipped_no_capacity,
+            "extra_tokens": self.extra_tokens,
+        }
+
+
+hedge_stats = HedgeStats()
+
+
+class StreamAttempt:
+    """Una petición en streaming ejecutada en un hilo; se puede cancelar desde el loop."""
+
+    def __init__(self, open_stream: Callable[[], Any], loop: asyncio.AbstractEventLoop, prompt_tokens: int):
+        self._open_stream = open_stream
+        self._loop = loop
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._stream = None
+        self.prompt_tokens = prompt_tokens
+        self.first_output: asyncio.Future = loop.create_future()
+        self.started_at = time.monotonic()
+        self.chunks = 0
+        self.usage = None
+        self.model = None
+
+    def _notify_first_output(self) -> None:
+        def _set():
+            if not self.first_output.done():
+                self.first_output.set_result(time.monotonic() - self.started_at)
+        self._loop.call_soon_threadsafe(_set)
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        with self._lock:
+            stream = self._stream
+        if stream is not None:
+            # Cerrar la conexión corta la generación y hace fallar la lectura bloqueada del hilo
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    @property
+    def tokens_spent(self) -> int:
+        """Tokens reales si el proveedor los informó; si no, estimación (≈1 token por chunk)."""
+        total = getattr(self.usage, "total_tokens", None)
+        return total if isinstance(total, int) else self.prompt_tokens + self.chunks
+
+    def run(self) -> Optional[SimpleNamespace]:
+        """Consumir el stream; devuelve una respuesta con la forma de ChatCompletion o None si se canceló."""
+        attempt = 0
+        while True:
+            if self._cancelled.is_set():
+                return None
+            stream = self._open_stream()
+            with self._lock:
+                self._stream = stream
+            parts = []
+            try:
+                if self._cancelled.is_set():
+                    return None
+                for chunk in stream:
+                    if self._cancelled.is_set():
+                        return None
+                    self.model = getattr(chunk, "model", None) or self.model
+                    if getattr(chunk, "usage", None) is not None:
+                        self.usage = chunk.usage
+                    for choice in getattr(chunk, "choices", None) or []:
+                        text = getattr(choice.delta, "content", None)
+                        if text:
+                            if not parts:
+                                self._notify_first_output()
+                            parts.append(text)
+                            self.chunks += 1
+                break
+            except Exception as e:
+                if self._cancelled.is_set():
+                    return None
+                delay = llm_resilience.record_stream_failure(e, attempt, produced_output=bool(parts))
+                if delay is None:
+                    raise
+            finally:
+                stream.close()
+            # Backoff interrumpible: un intento que ya perdió no abre (ni paga) otro stream
+            if self._cancelled.wait(delay):
+                return None
+            attempt += 1
+        content = "".join(parts)
+        return SimpleNamespace(
+            model=self.model,
+            usage=self.usage,
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=content))],
+        )
+
+
+def _release_when_done(task: asyncio.Future, attempt: StreamAttempt, ticket: Ticket) -> None:
+    """Devolver el cupo cuando el hilo termina de verdad (ganador, perdedor o error)."""
+    def _release(_):
+        ticket.used_tokens = attempt.tokens_spent
+        llm_scheduler.release(ticket)
+    task.add_done_callback(_release)
+
+
+async def _settle(task: asyncio.Task) -> Any:
+    try:
+        return await task
+    except Exception:
+        return None
+
+
+async def hedged_completion(
+    open_stream: Callable[[Optional[str]], Any],
+    priority: int,
+    key: Optional[str],
+    tokens: int,
+    prompt_tokens: int,
+) -> Any:
+    """Ejecutar `open_stream(model)` con hedging. Lanza la excepción de la principal si ambas fallan."""
+    loop = asyncio.get_running_loop()
+    hedge_stats.calls += 1
+    ticket = await llm_scheduler.acquire(priority, key, tokens)
+    primary = StreamAttempt(lambda: open_stream(None), loop, prompt_tokens)
+    primary_task = asyncio.ensure_future(asyncio.to_thread(primary.run))
+    _release_when_done(primary_task, primary, ticket)
+    attempts = {primary_task: primary}
+    try:
+        deadline = hedge_stats.deadline()
+        done, _ = await asyncio.wait(
+            {primary_task, primary.first_output}, timeout=deadline, return_when=asyncio.FIRST_COMPLETED
+        )
+        hedge_ticket = None
+        if not done:
+            hedge_ticket = llm_scheduler.try_acquire(priority, key, tokens)
+            if hedge_ticket is None:
+                hedge_stats.skipped_no_capacity += 1
+
+        if hedge_ticket is None:
+            try:
+                # shield: si cancelan al llamador, la tarea sigue hasta que el hilo termine y libere el cupo
+                return await asyncio.shield(primary_task)
+            finally:
+                _record_first_output(primary)
+
+        hedge_stats.hedges_fired += 1
+        print(f"[hedge] no output after {deadline:.2f}s, firing hedge request (key={key})")
+        hedge = StreamAttempt(lambda: open_stream(settings.LLM_HEDGE_MODEL or None), loop, prompt_tokens)
+        hedge_task = asyncio.ensure_future(asyncio.to_thread(hedge.run))
+        _release_when_done(hedge_task, hedge, hedge_ticket)
+        attempts[hedge_task] = hedge
+        pending = set(attempts)
+        winner = None
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result() is not None:
+                    winner = task
+                    break
+
+        loser_task = hedge_task if winner is primary_task else primary_task
+        loser = attempts[loser_task]
+        loser.cancel()
+        _record_first_output(primary)
+
+        # El hilo perdedor termina en segundo plano: contabilizar sus tokens cuando acabe
+        loop.create_task(_settle(loser_task)).add_done_callback(
+            lambda _: setattr(hedge_stats, "extra_tokens", hedge_stats.extra_tokens + loser.tokens_spent)
+        )
+
+        if winner is None:
+            return primary_task.result()  # ambas fallaron: propagar el error de la principal
+        if winner is hedge_task:
+            hedge_stats.hedge_wins += 1
+        else:
+            hedge_stats.primary_wins += 1
+        return winner.result()
+    except asyncio.CancelledError:
+        for attempt in attempts.values():
+            attempt.cancel()
+        raise
+
+
+def _record_first_output(attempt: StreamAttempt) -> None:
+    """Muestra de tiempo hasta el primer token. Si aún no llegó se registra el tiempo
+    transcurrido (cota inferior), para que el percentil no se sesgue a la baja."""
+    if attempt.first_output.done() and not attempt.first_output.cancelled():
+        hedge_stats.first_output_latencies.append(attempt.first_output.result())
+    else:
+        hedge_stats.first_output_latencies.append(time.monotonic() - attempt.started_at)
@@ -0,0 +1,219 @@
+"""Proveedor de chat completions: OpenAI o un sustituto local determinista.
+
+`get_provider().create(**kwargs)` tiene la firma de `chat.completions.create`
+del SDK de OpenAI y devuelve objetos con la misma forma (ChatCompletion, o un
+iterable de chunks con `stream=True`), así que el resto del pipeline
+(planificador, reintentos, hedging, contabilidad de tokens) no distingue uno de
+otro. Se elige con LLM_PROVIDER:
+
+- "openai" (por defecto): el cliente del SDK, creado en la primera llamada.
+- "fake": `FakeLLMProvider`, para pruebas de carga y benchmarks sin red ni
+  coste. Latencia lognormal (FAKE_LLM_LATENCY_P50_MS / P95), streaming por
+  palabras, errores inyectados con las excepciones reales del SDK
+  (FAKE_LLM_ERROR_RATE / KINDS) y texto determinista: el mismo prompt produce
+  siempre el mismo capítulo. Simula también la caché de prompt del proveedor
+  (prefijos de ≥1024 tokens repetidos).
+"""
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+import openai
+
+from app.core.config import settings
+from app.services.prompt_budget import count_tokens
+
+_FAKE_URL = "http://fake-llm.local/v1/chat/completions"
+_CACHE_MIN_TOKENS = 1024
+_CACHE_BLOCK_TOKENS = 128
+
+_WORDS = (
+    "la sombra avanzó entre las ruinas mientras el viento arrastraba ceniza y promesas rotas "
+    "nadie habló durante un largo instante hasta que una voz quebró el silencio con una pregunta "
+    "el camino hacia la torre estaba marcado por antorchas apagadas y huellas todavía frescas "
+    "un destello lejano reveló la silueta de algo que no debería estar despierto "
+    "las miradas se cruzaron con desconfianza y cada uno calculó el precio de dar un paso más "
+    "bajo sus pies la piedra vibraba como si el mundo contuviera la respiración"
+).split()
+
+
+class OpenAIProvider:
+    name = "openai"
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    # Los reintentos los gestiona llm_resilience (clasificados y con backoff), no el SDK
+                    self._client = openai.OpenAI(
+                        api_key=settings.OPENAI_API_KEY,
+                        max_retries=0,
+                        timeout=settings.LLM_REQUEST_TIMEOUT_SECONDS,
+                    )
+        return self._client
+
+    @property
+    def create(self):
+        return self.client.chat.completions.create
+
+
+class FakeLLMProvider:
+    name = "fake"
+
+    def __init__(self, seed: Optional[int] = None):
+        seed = settings.FAKE_LLM_SEED if seed is None else seed
+        self.seed = seed
+        # Latencias y errores: reproducibles por ejecución, distintos entre llamadas
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._seen_prefixes: set = set()
+        self.calls = 0
+        self.errors = 0
+
+    # ---------- Latencia y errores ----------
+
+    def _sample_latency(self) -> float:
+        p50 = max(1, settings.FAKE_LLM_LATENCY_P50_MS) / 1000
+        p95 = max(p50 * 1000, settings.FAKE_LLM_LATENCY_P95_MS) / 1000
+        sigma = math.log(p95 / p50) / 1.645
+        with self._lock:
+            return self._rng.lognormvariate(math.log(p50), sigma)
+
+    def _maybe_error(self) -> Optional[Exception]:
+        with self._lock:
+            self.calls += 1
+            if self._rng.random() >= settings.FAKE_LLM_ERROR_RATE:
+                return None
+            self.errors += 1
+            kinds = [k.strip() for k in settings.FAKE_LLM_ERROR_KINDS.split(",") if k.strip()] or ["connection"]
+            kind = self._rng.choice(kinds)
+        request = httpx.Request("POST", _FAKE_URL)
+        if kind == "timeout":
+            return openai.APITimeoutError(request=request)
+        if kind == "connection":
+            return openai.APIConnectionError(request=request)
+        status = {"rate_limit": 429, "overloaded": 503, "server": 500, "bad_request": 400}.get(kind, 500)
+        error_cls = {429: openai.RateLimitError, 400: openai.BadRequestError}.get(status, openai.InternalServerError)
+        response = httpx.Response(status, request=request, headers={"retry-after-ms": "200"})
+        return error_cls(f"fake {kind}", response=response, body=None)
+
+    # ---------- Texto y uso ----------
+
+    def _text(self, model: str, messages: List[Dict[str, Any]], max_tokens: Optional[int]) -> str:
+        digest = hashlib.sha256(
+            json.dumps([self.seed, model, messages], ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+        ).digest()
+        rng = random.Random(digest)
+        target = min(max_tokens or settings.FAKE_LLM_COMPLETION_TOKENS, settings.FAKE_LLM_COMPLETION_TOKENS)
+        words, sentence = [], []
+        # ≈0.75 palabras por token
+        for _ in range(max(1, int(target * 0.75))):
+            sentence.append(rng.choice(_WORDS))
+            if len(sentence) >= rng.randint(8, 18):
+                words.append(" ".join(sentence).capitalize() + ".")
+                sentence = []
+        if sentence:
+            words.append(" ".join(sentence).capitalize() + ".")
+        return " ".join(words)
+
+    def _usage(self, messages: List[Dict[str, Any]], completion: str) -> SimpleNamespace:
+        prompt_tokens = sum(count_tokens(str(m.get("content") or "")) + 4 for m in messages)
+        cached = 0
+        prefix = str(messages[0].get("content") or "") if messages else ""
+        prefix_tokens = count_tokens(prefix)
+        if prefix_tokens >= _CACHE_MIN_TOKENS:
+            key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+            with self._lock:
+                if key in self._seen_prefixes:
+                    cached = prefix_tokens - prefix_tokens % _CACHE_BLOCK_TOKENS
+                self._seen_prefixes.add(key)
+        completion_tokens = count_tokens(completion)
+        return SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=cached),
+        )
+
+    # ---------- API con la forma del SDK ----------
+
+    def create(
+        self,
+        model: Optional[str] = None,
+        messages: Optional[List[Dict[str, Any]]] = None,
+        max_tokens: Optional[int] = None,
+        stream: bool = False,
+        stream_options: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> Any:
+        model = model or settings.OPENAI_MODEL
+        messages = messages or []
+        latency = self._sample_latency()
+        error = self._maybe_error()
+        if error is not None:
+            time.sleep(latency * settings.FAKE_LLM_TTFT_RATIO)
+            raise error
+        text = self._text(model, messages, max_tokens)
+        usage = self._usage(messages, text)
+        if stream:
+            include_usage = bool((stream_options or {}).get("include_usage"))
+            return self._stream(model, text, usage if include_usage else None, latency)
+        time.sleep(latency)
+        return SimpleNamespace(
+            id=f"fake-{self.calls}",
+            model=model,
+            usage=usage,
+            choices=[SimpleNamespace(
+                index=0,
+                finish_reason="stop",
+                message=SimpleNamespace(role="assistant", content=text),
+            )],
+        )
+
+    def _stream(self, model: str, text: str, usage: Any, latency: float) -> Iterator[SimpleNamespace]:
+        """Primer token tras FAKE_LLM_TTFT_RATIO de la latencia; el resto repartido entre las palabras."""
+        words = text.split(" ")
+        time.sleep(latency * settings.FAKE_LLM_TTFT_RATIO)
+        per_word = latency * (1 - settings.FAKE_LLM_TTFT_RATIO) / max(1, len(words))
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(per_word)
+            yield SimpleNamespace(
+                model=model,
+                usage=None,
+                choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=word if not i else " " + word, role=None))],
+            )
+        if usage is not None:
+            yield SimpleNamespace(model=model, usage=usage, choices=[])
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "errors": self.errors, "cached_prefixes": len(self._seen_prefixes)}
+
+
+_providers: Dict[str, Any] = {}
+
+
+def get_provider():
+    """Proveedor configurado en LLM_PROVIDER (una instancia por proceso)."""
+    name = (settings.LLM_PROVIDER or "openai").lower()
+    provider = _providers.get(name)
+    if provider is None:
+        if name == "fake":
+            provider = FakeLLMProvider()
+        elif name == "openai":
+            provider = OpenAIProvider()
+        else:
+            raise ValueError(f"LLM_PROVIDER desconocido: {settings.LLM_PROVIDER!r} (openai | fake)")
+        _providers[name] = provider
+    return provider
@@ -0,0 +1,292 @@
+"""Política de reintentos y circuit breaker para las llamadas al LLM.
+
+- Los errores se clasifican: solo se reintentan los que no llegaron a consumir
+  tokens (429, fallos de conexión, 502/503/504). Un timeout o un 500 pueden
+  haber generado la respuesta completa en el proveedor, así que no se repiten.
+- Backoff exponencial con jitter completo, respetando `Retry-After` si llega.
+- Circuit breaker: tras LLM_CIRCUIT_FAILURE_THRESHOLD fallos seguidos del
+  proveedor, las llamadas fallan al instante con `CircuitOpenError` durante
+  LLM_CIRCUIT_COOLDOWN_SECONDS (los llamadores ya devuelven su texto de
+  respaldo). Después se deja pasar una única llamada de prueba.
+- Sondeo de capacidades del SDK una sola vez, en lugar de reintentar cada
+  llamada al recibir un TypeError.
+
+Todo es síncrono y thread-safe: se usa desde `_safe_chat_completion`, que se
+ejecuta en hilos de trabajo.
+"""
+import inspect
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+import httpx
+import openai
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+ERROR_RATE_LIMIT = "rate_limit"
+ERROR_CONNECTION = "connection"
+ERROR_OVERLOADED = "overloaded"   # 502/503/504: el proveedor no procesó la petición
+ERROR_TIMEOUT = "timeout"
+ERROR_SERVER = "server"           # 500 y otros 5xx
+ERROR_BAD_REQUEST = "bad_request"
+ERROR_AUTH = "auth"
+ERROR_OTHER = "other"
+
+# Seguro reintentar: la petición no llegó a generar tokens
+_RETRYABLE = {ERROR_RATE_LIMIT, ERROR_CONNECTION, ERROR_OVERLOADED}
+# Indican proveedor degradado: cuentan para abrir el circuito
+_PROVIDER_FAILURES = {ERROR_RATE_LIMIT, ERROR_CONNECTION, ERROR_OVERLOADED, ERROR_TIMEOUT, ERROR_SERVER}
+
+
+class CircuitOpenError(Exception):
+    """El circuito está abierto: no se llama al proveedor."""
+
+
+def classify_error(exc: BaseException) -> str:
+    if isinstance(exc, CircuitOpenError):
+        return ERROR_OVERLOADED
+    # APITimeoutError hereda de APIConnectionError: comprobarlo antes
+    if isinstance(exc, openai.APITimeoutError):
+        return ERROR_TIMEOUT
+    if isinstance(exc, openai.APIConnectionError):
+        return ERROR_CONNECTION
+    if isinstance(exc, openai.RateLimitError):
+        return ERROR_RATE_LIMIT
+    if isinstance(exc, (openai.AuthenticationError, openai.PermissionDeniedError)):
+        return ERROR_AUTH
+    if isinstance(exc, openai.APIStatusError):
+        code = exc.status_code
+        if code in (502, 503, 504, 529):
+            return ERROR_OVERLOADED
+        if code >= 500:
+            return ERROR_SERVER
+        if code in (400, 404, 422):
+            return ERROR_BAD_REQUEST
+    # Errores de transporte al leer un stream ya abierto: el SDK no los envuelve
+    if isinstance(exc, httpx.TimeoutException):
+        return ERROR_TIMEOUT
+    if isinstance(exc, httpx.TransportError):
+        return ERROR_CONNECTION
+    return ERROR_OTHER
+
+
+def _retry_after_seconds(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Backoff exponencial con jitter completo; `Retry-After` actúa como mínimo."""
+    cap = min(settings.LLM_BACKOFF_MAX_SECONDS, settings.LLM_BACKOFF_BASE_SECONDS * (2 ** attempt))
+    delay = random.uniform(0, cap)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, settings.LLM_BACKOFF_MAX_SECONDS))
+    return delay
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, cooldown_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Lanza CircuitOpenError si no se debe llamar al proveedor ahora."""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown_seconds:
+                    raise CircuitOpenError("Proveedor de IA degradado: circuito abierto")
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    raise CircuitOpenError("Proveedor de IA degradado: llamada de prueba en curso")
+                self._trial_in_flight = True
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == self.OPEN and time.monotonic() - self.opened_at < self.cooldown_seconds
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+            if self.state != self.CLOSED:
+                print("[llm] circuit closed")
+            self.state = self.CLOSED
+
+    def release_trial(self) -> None:
+        """Liberar la llamada de prueba sin decidir el estado (reintento o error del cliente)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.failure_threshold <= 0:
+                return
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                    print(f"[llm] circuit open for {self.cooldown_seconds}s after {self.consecutive_failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            remaining = 0.0
+            if self.state == self.OPEN:
+                remaining = max(0.0, self.cooldown_seconds - (time.monotonic() - self.opened_at))
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+                "cooldown_remaining_seconds": round(remaining, 1),
+            }
+
+
+class CompletionCapabilities:
+    """Qué parámetros extendidos (`reasoning`/`text`) acepta el SDK y el servidor.
+
+    Se sondea la firma de `chat.completions.create` una sola vez: si el SDK no
+    declara los parámetros se envían vía `extra_body`. Si el servidor los
+    rechaza (400), se desactivan para el resto del proceso.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._native: Optional[bool] = None
+        self.extended_enabled = True
+
+    def native_kwargs(self, create: Callable[..., Any]) -> bool:
+        if self._native is None:
+            with self._lock:
+                if self._native is None:
+                    try:
+                        params = inspect.signature(create).parameters
+                        self._native = "reasoning" in params or any(
+                            p.kind == inspect.Parameter.VAR_KEYWORD for p in params.values()
+                        )
+                    except (TypeError, ValueError):
+                        self._native = False
+        return self._native
+
+    def disable_extended(self, reason: str) -> None:
+        if self.extended_enabled:
+            print(f"[llm] extended completion params disabled: {reason}")
+        self.extended_enabled = False
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.fast_failures = 0
+        self.errors: Dict[str, int] = {}
+
+    def incr(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def record_error(self, kind: str) -> None:
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "fast_failures": self.fast_failures,
+                "errors": dict(self.errors),
+            }
+
+
+breaker = CircuitBreaker(settings.LLM_CIRCUIT_FAILURE_THRESHOLD, settings.LLM_CIRCUIT_COOLDOWN_SECONDS)
+capabilities = CompletionCapabilities()
+_stats = _Stats()
+
+
+def call_with_retries(fn: Callable[[], T], call_stats: Optional[Dict[str, Any]] = None) -> T:
+    """Ejecutar `fn` con la política de reintentos y el circuit breaker.
+    Si se pasa `call_stats`, se cuentan en él los reintentos de esta llamada."""
+    attempt = 0
+    while True:
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            _stats.incr("fast_failures")
+            raise
+        _stats.incr("calls")
+        try:
+            result = fn()
+        except Exception as e:
+            kind = classify_error(e)
+            _stats.record_error(kind)
+            if kind in _RETRYABLE and attempt < settings.LLM_MAX_RETRIES and not breaker.is_open():
+                delay = backoff_delay(attempt, _retry_after_seconds(e))
+                print(f"[llm] {kind} error, retry {attempt + 1}/{settings.LLM_MAX_RETRIES} in {delay:.2f}s: {e}")
+                breaker.release_trial()
+                time.sleep(delay)
+                attempt += 1
+                _stats.incr("retries")
+                if call_stats is not None:
+                    call_stats["retries"] = call_stats.get("retries", 0) + 1
+                continue
+            if kind in _PROVIDER_FAILURES:
+                breaker.record_failure()
+            else:
+                # Error de la petición, no del proveedor: no cuenta para el circuito
+                breaker.release_trial()
+            raise
+        breaker.record_success()
+        return result
+
+
+def record_stream_failure(exc: BaseException, attempt: int, produced_output: bool) -> Optional[float]:
+    """Error al leer un stream ya abierto (fuera de `call_with_retries`): cuenta en las estadísticas
+    y en el circuito igual que allí. Devuelve la espera antes de reabrirlo, o None si no se reintenta
+    (ya llegó texto, el error no es reintentable o se agotaron los intentos)."""
+    kind = classify_error(exc)
+    _stats.record_error(kind)
+    if not produced_output and kind in _RETRYABLE and attempt < settings.LLM_MAX_RETRIES and not breaker.is_open():
+        _stats.incr("retries")
+        delay = backoff_delay(attempt, _retry_after_seconds(exc))
+        print(f"[llm] {kind} error reading stream, retry {attempt + 1}/{settings.LLM_MAX_RETRIES} in {delay:.2f}s: {exc}")
+        return delay
+    if kind in _PROVIDER_FAILURES:
+        breaker.record_failure()
+    return None
+
+
+def snapshot() -> Dict[str, Any]:
+    return {
+        "circuit": breaker.snapshot(),
+        "extended_params": capabilities.extended_enabled,
+        **_stats.as_dict(),
+    }
@@ -0,0 +1,354 @@
+"""Planificador global de llamadas al LLM.
+
+Todas las completions pasan por aquí antes de llegar a OpenAI:
+
+- Token buckets de peticiones por minuto (LLM_RPM_LIMIT) y tokens por minuto
+  (LLM_TPM_LIMIT). Un límite <= 0 desactiva ese bucket.
+- Clases de prioridad: capítulo en vivo > primer capítulo > evaluación de
+  personajes > trabajo de fondo (endpoints legacy) > especulativo. Las
+  peticiones especulativas nunca esperan en cola: solo se conceden si hay
+  cupo inmediato (si no, `SchedulerBusyError`).
+- Dentro de cada prioridad, reparto round-robin por clave (normalmente el
+  game_id), para que una partida con muchas peticiones no acapare el cupo.
+- Métricas de tiempo en cola por prioridad (ver `snapshot()`).
+
+El reparto lo hace una única tarea despachadora en el event loop. El código
+síncrono que se ejecuta en hilos (p.ej. `evaluate_character` vía
+`asyncio.to_thread`) usa `blocking_slot`, que espera turno en ese mismo loop
+(como mucho LLM_REQUEST_TIMEOUT_SECONDS; después, `SchedulerBusyError`).
+"""
+import asyncio
+import concurrent.futures
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Deque, Dict, List, Optional
+
+from app.core.config import settings
+
+PRIORITY_LIVE_CHAPTER = 0
+PRIORITY_FIRST_CHAPTER = 1
+PRIORITY_EVALUATION = 2
+PRIORITY_BACKGROUND = 3
+PRIORITY_SPECULATIVE = 4
+
+PRIORITY_NAMES = {
+    PRIORITY_LIVE_CHAPTER: "live_chapter",
+    PRIORITY_FIRST_CHAPTER: "first_chapter",
+    PRIORITY_EVALUATION: "evaluation",
+    PRIORITY_BACKGROUND: "background",
+    PRIORITY_SPECULATIVE: "speculative",
+}
+
+_DEFAULT_KEY = "_"
+_WAIT_SAMPLES = 500
+
+
+class SchedulerBusyError(Exception):
+    """Sin cupo inmediato para una petición que no debe esperar (especulativa)."""
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: Optional[int]) -> int:
+    """Estimación barata (≈4 caracteres por token) de prompt + salida máxima."""
+    prompt_chars = sum(len(m.get("content") or "") for m in messages)
+    completion = max_tokens if max_tokens is not None else settings.LLM_DEFAULT_COMPLETION_TOKENS
+    return prompt_chars // 4 + completion
+
+
+def _usage_tokens(response: Any) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    total = getattr(usage, "total_tokens", None)
+    return total if isinstance(total, int) else None
+
+
+class TokenBucket:
+    """Bucket con recarga continua; `capacity <= 0` significa sin límite."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        """Segundos hasta poder consumir `amount` (0 si ya se puede)."""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        # Una petición mayor que el bucket entero se admite con el bucket lleno
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed / self.rate)
+
+    def consume(self, amount: float) -> None:
+        """Descontar (puede quedar negativo al reconciliar con el uso real)."""
+        if self.unlimited:
+            return
+        self._refill()
+        self.level -= amount
+
+
+class Ticket:
+    """Turno concedido por el planificador."""
+
+    __slots__ = ("priority", "key", "reserved_tokens", "used_tokens", "queued_seconds")
+
+    def __init__(self, priority: int, key: str, reserved_tokens: int, queued_seconds: float):
+        self.priority = priority
+        self.key = key
+        self.reserved_tokens = reserved_tokens
+        self.used_tokens: Optional[int] = None
+        self.queued_seconds = queued_seconds
+
+    def record_usage(self, response: Any) -> None:
+        """Anotar los tokens reales de la respuesta para reconciliar el bucket."""
+        self.used_tokens = _usage_tokens(response)
+
+
+class _Waiter:
+    __slots__ = ("priority", "key", "tokens", "future", "enqueued_at")
+
+    def __init__(self, priority: int, key: str, tokens: int, future: asyncio.Future):
+        self.priority = priority
+        self.key = key
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class _PriorityStats:
+    def __init__(self):
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_waits: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+        self.reserved_tokens = 0
+        self.used_tokens = 0
+
+    def record_grant(self, wait: float, tokens: int) -> None:
+        self.granted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.recent_waits.append(wait)
+        self.reserved_tokens += tokens
+
+    def as_dict(self) -> Dict[str, Any]:
+        waits = sorted(self.recent_waits)
+
+        def pct(p: float) -> float:
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 4) if waits else 0.0
+
+        return {
+            "granted": self.granted,
+            "avg_wait_seconds": round(self.total_wait / self.granted, 4) if self.granted else 0.0,
+            "max_wait_seconds": round(self.max_wait, 4),
+            "p50_wait_seconds": pct(0.50),
+            "p95_wait_seconds": pct(0.95),
+            "reserved_tokens": self.reserved_tokens,
+            "used_tokens": self.used_tokens,
+        }
+
+
+class LLMScheduler:
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        # prioridad -> (clave -> cola FIFO); el orden del OrderedDict es el turno round-robin
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Waiter]]"] = {}
+        self._stats: Dict[int, _PriorityStats] = {p: _PriorityStats() for p in PRIORITY_NAMES}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    # ---- ciclo de vida ----
+    def start(self) -> None:
+        """Enlazar el planificador al event loop actual (llamar en startup)."""
+        self._bind(asyncio.get_running_loop())
+
+    def stop(self) -> None:
+        if self._dispatcher and not self._dispatcher.done():
+            self._dispatcher.cancel()
+        self._dispatcher = None
+        for queues in self._queues.values():
+            for waiters in queues.values():
+                for w in waiters:
+                    if not w.future.done():
+                        w.future.cancel()
+        self._queues.clear()
+
+    def _bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._dispatcher = None
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+
+    # ---- cola ----
+    def _has_waiters(self) -> bool:
+        return any(self._queues.values())
+
+    def _peek(self) -> Optional[_Waiter]:
+        """Siguiente petición: mayor prioridad y, dentro de ella, la clave a la que le toca turno."""
+        for priority in sorted(self._queues):
+            queues = self._queues[priority]
+            while queues:
+                key, waiters = next(iter(queues.items()))
+                while waiters and waiters[0].future.done():
+                    waiters.popleft()  # cancelada mientras esperaba
+                if waiters:
+                    return waiters[0]
+                del queues[key]
+        return None
+
+    def _pop(self, waiter: _Waiter) -> None:
+        queues = self._queues[waiter.priority]
+        waiters = queues.pop(waiter.key)
+        waiters.popleft()
+        if waiters:
+            queues[waiter.key] = waiters  # al final: turno de la siguiente clave
+
+    def _grant(self, priority: int, key: str, tokens: int, enqueued_at: float) -> Ticket:
+        self.requests.consume(1)
+        self.tokens.consume(tokens)
+        wait = time.monotonic() - enqueued_at
+        self._stats[priority].record_grant(wait, tokens)
+        return Ticket(priority, key, tokens, wait)
+
+    def _time_until_admissible(self, tokens: int) -> float:
+        return max(self.requests.time_until(1), self.tokens.time_until(tokens))
+
+    async def _dispatch(self) -> None:
+        while True:
+            self._wakeup.clear()
+            waiter = self._peek()
+            if waiter is None:
+                await self._wakeup.wait()
+                continue
+            delay = self._time_until_admissible(waiter.tokens)
+            if delay <= 0:
+                self._pop(waiter)
+                waiter.future.set_result(
+                    self._grant(waiter.priority, waiter.key, waiter.tokens, waiter.enqueued_at)
+                )
+                continue
+            # Esperar la recarga, o antes si llega algo de mayor prioridad
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def acquire(self, priority: int, key: Optional[str] = None, tokens: int = 0) -> Ticket:
+        """Esperar turno para una llamada que consumirá ~`tokens`."""
+        self._bind(asyncio.get_running_loop())
+        if priority == PRIORITY_SPECULATIVE:
+            ticket = self.try_acquire(priority, key, tokens)
+            if ticket is None:
+                raise SchedulerBusyError("LLM scheduler busy: speculative request skipped")
+            return ticket
+        key = key or _DEFAULT_KEY
+        enqueued_at = time.monotonic()
+        # Camino rápido: sin cola y con cupo disponible
+        if not self._has_waiters() and self._time_until_admissible(tokens) <= 0:
+            return self._grant(priority, key, tokens, enqueued_at)
+
+        future = self._loop.create_future()
+        waiter = _Waiter(priority, key, tokens, future)
+        self._queues.setdefault(priority, OrderedDict()).setdefault(key, deque()).append(waiter)
+        self._wakeup.set()
+        return await future
+
+    def try_acquire(self, priority: int, key: Optional[str] = None, tokens: int = 0) -> Optional[Ticket]:
+        """Turno inmediato solo si no hay cola y hay cupo; None en caso contrario (no espera)."""
+        if self._has_waiters() or self._time_until_admissible(tokens) > 0:
+            return None
+        return self._grant(priority, key or _DEFAULT_KEY, tokens, time.monotonic())
+
+    def release(self, ticket: Ticket) -> None:
+        """Reconciliar la reserva con los tokens realmente usados."""
+        if self._loop is not None and not self._loop.is_closed() and not self._on_loop_thread():
+            self._loop.call_soon_threadsafe(self.release, ticket)
+            return
+        used = ticket.used_tokens
+        if used is None:
+            return
+        self.tokens.consume(used - ticket.reserved_tokens)
+        self._stats[ticket.priority].used_tokens += used
+        if used < ticket.reserved_tokens and self._wakeup is not None:
+            self._wakeup.set()  # se devolvieron tokens: quizá ya cabe el siguiente
+
+    def _on_loop_thread(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    @asynccontextmanager
+    async def slot(self, priority: int, key: Optional[str] = None, tokens: int = 0):
+        ticket = await self.acquire(priority, key, tokens)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @contextmanager
+    def blocking_slot(self, priority: int, key: Optional[str] = None, tokens: int = 0):
+        """Versión para código síncrono que corre en un hilo de trabajo."""
+        loop = self._loop
+        if loop is None or loop.is_closed() or self._on_loop_thread():
+            # Sin loop enlazado (scripts) o llamado desde el propio loop (no se puede
+            # bloquear): se contabiliza sin esperar turno.
+            ticket = self._grant(priority, key or _DEFAULT_KEY, tokens, time.monotonic())
+        else:
+            ticket = self._wait_threadsafe(loop, priority, key, tokens)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def _wait_threadsafe(self, loop: asyncio.AbstractEventLoop, priority: int, key: Optional[str], tokens: int) -> Ticket:
+        """Esperar turno desde un hilo, como mucho LLM_REQUEST_TIMEOUT_SECONDS (el loop puede estar cerrándose)."""
+        future = asyncio.run_coroutine_threadsafe(self.acquire(priority, key, tokens), loop)
+        try:
+            return future.result(timeout=settings.LLM_REQUEST_TIMEOUT_SECONDS)
+        except concurrent.futures.TimeoutError:
+            if not future.cancel():
+                return future.result()  # concedido justo al vencer el plazo
+            raise SchedulerBusyError("LLM scheduler busy: no turn within the request timeout")
+        except concurrent.futures.CancelledError:
+            raise SchedulerBusyError("LLM scheduler stopped while waiting for a turn")
+
+    # ---- métricas ----
+    def snapshot(self) -> Dict[str, Any]:
+        queued: Dict[str, Any] = {}
+        for priority, queues in self._queues.items():
+            depth = {k: sum(1 for w in ws if not w.future.done()) for k, ws in queues.items()}
+            depth = {k: n for k, n in depth.items() if n}
+            if depth:
+                queued[PRIORITY_NAMES.get(priority, str(priority))] = {
+                    "total": sum(depth.values()),
+                    "by_key": depth,
+                }
+        return {
+            "limits": {
+                "requests_per_minute": int(self.requests.capacity),
+                "tokens_per_minute": int(self.tokens.capacity),
+            },
+            "available": {
+                "requests": None if self.requests.unlimited else round(self.requests.level, 2),
+                "tokens": None if self.tokens.unlimited else round(self.tokens.level, 1),
+            },
+            "queued": queued,
+            "priorities": {PRIORITY_NAMES[p]: s.as_dict() for p, s in self._stats.items()},
+        }
+
+
+llm_scheduler = LLMScheduler(settings.LLM_RPM_LIMIT, settings.LLM_TPM_LIMIT)
@@ -0,0 +1,184 @@
+"""Contabilidad de uso del LLM: tokens, latencia y coste por llamada.
+
+- `call_record` resume una completion (modelo, tokens, latencia, reintentos,
+  fallback, coste estimado) en un dict plano que se guarda en
+  `game_chapters.generation` junto al capítulo que produjo.
+- `record_generation` acumula ese registro en la colección `llm_usage`, con un
+  documento por partida, mundo y usuario (`scope`), para consultar los mayores
+  consumidores desde /api/admin/llm/usage/top. También acumula en
+  `games.prompt_cache` los tokens servidos desde la caché de prompt del
+  proveedor (ver `build_prompt_prefix` en ai_service).
+
+El coste usa la tabla `MODEL_PRICING` (USD por millón de tokens), que se puede
+sobrescribir con LLM_PRICING_JSON.
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.core.config import settings
+
+# USD por millón de tokens: (entrada, entrada servida desde caché, salida)
+MODEL_PRICING: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-5-nano": (0.05, 0.005, 0.40),
+    "gpt-5-mini": (0.25, 0.025, 2.00),
+    "gpt-5": (1.25, 0.125, 10.00),
+}
+
+SCOPES = ("game", "world", "user")
+_COUNTERS = ("calls", "prompt_tokens", "completion_tokens", "cached_tokens", "latency_ms", "retries", "fallbacks", "cost_usd")
+
+
+def _usage(db):
+    return db["llm_usage"]
+
+
+def _field(obj: Any, name: str) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def _int(value: Any) -> int:
+    return value if isinstance(value, int) else 0
+
+
+def cached_prompt_tokens(usage: Any) -> int:
+    """Tokens de prompt servidos desde la caché del proveedor (0 si no lo informa)."""
+    cached = _field(_field(usage, "prompt_tokens_details"), "cached_tokens")
+    return cached if isinstance(cached, int) else 0
+
+
+def prompt_cache_ratio(stats: Optional[Dict[str, Any]]) -> float:
+    prompt_tokens = (stats or {}).get("prompt_tokens") or 0
+    return round((stats or {}).get("cached_tokens", 0) / prompt_tokens, 4) if prompt_tokens else 0.0
+
+
+def _pricing_table() -> Dict[str, Tuple[float, float, float]]:
+    table = dict(MODEL_PRICING)
+    if settings.LLM_PRICING_JSON:
+        try:
+            table.update({k: tuple(v) for k, v in json.loads(settings.LLM_PRICING_JSON).items()})
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"[llm_usage] invalid LLM_PRICING_JSON, using defaults: {e}")
+    return table
+
+
+def model_pricing(model: Optional[str]) -> Optional[Tuple[float, float, float]]:
+    """Precio del modelo por el prefijo más largo (`gpt-4o-mini-2024-07-18` -> `gpt-4o-mini`)."""
+    model = (model or "").lower()
+    table = _pricing_table()
+    for name in sorted(table, key=len, reverse=True):
+        if model.startswith(name):
+            return table[name]
+    return None
+
+
+def completion_cost(model: Optional[str], prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    pricing = model_pricing(model)
+    if pricing is None:
+        return 0.0
+    price_in, price_cached, price_out = pricing
+    cost = (prompt_tokens - cached_tokens) * price_in + cached_tokens * price_cached + completion_tokens * price_out
+    return round(cost / 1_000_000, 6)
+
+
+def call_record(
+    model: Optional[str],
+    usage: Any,
+    latency_seconds: float,
+    retries: int = 0,
+    priority: Optional[int] = None,
+    error: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Registro plano (apto para Mongo) de una completion."""
+    model = model or settings.OPENAI_MODEL
+    prompt_tokens = _int(_field(usage, "prompt_tokens"))
+    completion_tokens = _int(_field(usage, "completion_tokens"))
+    cached_tokens = cached_prompt_tokens(usage)
+    return {
+        "model": model,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cached_tokens": cached_tokens,
+        "total_tokens": _int(_field(usage, "total_tokens")) or prompt_tokens + completion_tokens,
+        "latency_ms": int(latency_seconds * 1000),
+        "retries": retries,
+        "priority": priority,
+        "fallback": False,
+        "error": error,
+        "cost_usd": completion_cost(model, prompt_tokens, cached_tokens, completion_tokens),
+    }
+
+
+async def record_generation(db, game: Dict[str, Any], call: Optional[Dict[str, Any]]) -> None:
+    """Acumular una llamada en los agregados de la partida, su mundo y su propietario."""
+    if not call:
+        return
+    game_id = str(game.get("_id") or "")
+    owners = {
+        "game": game_id,
+        "world": str(game.get("world_id") or ""),
+        "user": str(game.get("owner_id") or game.get("admin_id") or ""),
+    }
+    inc = {
+        "calls": 1,
+        "prompt_tokens": _int(call.get("prompt_tokens")),
+        "completion_tokens": _int(call.get("completion_tokens")),
+        "cached_tokens": _int(call.get("cached_tokens")),
+        "latency_ms": _int(call.get("latency_ms")),
+        "retries": _int(call.get("retries")),
+        "fallbacks": 1 if call.get("fallback") else 0,
+        "cost_usd": float(call.get("cost_usd") or 0.0),
+    }
+    now = datetime.utcnow()
+    ops = [
+        UpdateOne(
+            {"_id": f"{scope}:{owner_id}"},
+            {"$inc": inc, "$set": {"scope": scope, "owner_id": owner_id, "updated_at": now}},
+            upsert=True,
+        )
+        for scope, owner_id in owners.items() if owner_id
+    ]
+    try:
+        if ops:
+            await _usage(db).bulk_write(ops, ordered=False)
+        if game_id and inc["prompt_tokens"]:
+            await db["games"].update_one(
+                {"_id": ObjectId(game_id)},
+                {"$inc": {
+                    "prompt_cache.calls": 1,
+                    "prompt_cache.prompt_tokens": inc["prompt_tokens"],
+                    "prompt_cache.cached_tokens": inc["cached_tokens"],
+                }},
+            )
+    except Exception as e:
+        print(f"[llm_usage] error recording usage for game {game_id}: {e}")
+
+
+async def ensure_indexes(db) -> None:
+    await _usage(db).create_index([("scope", 1), ("cost_usd", -1)])
+
+
+async def top_consumers(db, scope: str, metric: str = "cost_usd", limit: int = 20) -> list:
+    items = []
+    cursor = _usage(db).find({"scope": scope}).sort(metric, -1).limit(limit)
+    async for doc in cursor:
+        calls = doc.get("calls") or 0
+        items.append({
+            "owner_id": doc.get("owner_id"),
+            **{k: doc.get(k, 0) for k in _COUNTERS},
+            "cost_usd": round(doc.get("cost_usd", 0.0), 4),
+            "avg_latency_ms": round(doc.get("latency_ms", 0) / calls) if calls else 0,
+            "cached_ratio": prompt_cache_ratio(doc),
+            "updated_at": doc.get("updated_at"),
+        })
+    return items
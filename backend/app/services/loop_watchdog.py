@@ -0,0 +1,191 @@
+"""Vigilancia del event loop: detecta llamadas síncronas que lo bloquean.
+
+Una tarea del loop late cada LOOP_WATCHDOG_INTERVAL_MS y un hilo aparte
+comprueba ese latido. Si el loop lleva más de LOOP_LAG_THRESHOLD_MS sin latir,
+el hilo captura la pila del hilo del loop en ese momento (la llamada que lo
+está bloqueando: OpenAI, bcrypt, smtplib, reportlab...) y la agrupa por punto
+de llamada: el frame más interno del código de `app/`. Cuando el loop vuelve a
+latir, la duración real del bloqueo se suma a ese punto.
+
+Consultar en GET /api/admin/loop/lag: retraso del loop (p50/p95/p99/máx) y
+puntos de llamada ordenados por tiempo total bloqueado, con su última pila.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from app.core.config import settings
+
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_ROOT_DIR = os.path.dirname(_APP_DIR)
+_THIS_FILE = os.path.abspath(__file__)
+_LAG_SAMPLES = 1000
+_STACK_FRAMES = 20
+
+
+class _Site:
+    __slots__ = ("count", "total_ms", "max_ms", "last_seen", "blocking_in", "stack")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_seen = 0.0
+        self.blocking_in = ""
+        self.stack: list = []
+
+
+def _short(filename: str) -> str:
+    return os.path.relpath(filename, _ROOT_DIR) if filename.startswith(_ROOT_DIR) else filename
+
+
+def call_site(stack: traceback.StackSummary) -> tuple:
+    """(punto de llamada en app/, función más interna) de una pila capturada."""
+    innermost = stack[-1] if stack else None
+    site = None
+    for frame in reversed(stack):
+        path = os.path.abspath(frame.filename)
+        if path.startswith(_APP_DIR) and path != _THIS_FILE:
+            site = frame
+            break
+    site = site or innermost
+    if site is None:
+        return "?", ""
+    key = f"{_short(site.filename)}:{site.lineno} in {site.name}"
+    blocking_in = f"{_short(innermost.filename)}:{innermost.lineno} in {innermost.name}" if innermost else ""
+    return key, blocking_in
+
+
+class LoopWatchdog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._beat = time.monotonic()
+        self._captured_beat: Optional[float] = None
+        self._pending_site: Optional[str] = None
+        self.lags: Deque[float] = deque(maxlen=_LAG_SAMPLES)
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.sites: Dict[str, _Site] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """Arrancar en el event loop actual (startup de la API o del worker)."""
+        if not settings.LOOP_WATCHDOG_ENABLED or self.running:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._tick())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _tick(self) -> None:
+        interval = settings.LOOP_WATCHDOG_INTERVAL_MS / 1000
+        while True:
+            expected = time.monotonic() + interval
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            with self._lock:
+                self._beat = now
+                self.lags.append(lag)
+                self.max_lag = max(self.max_lag, lag)
+                if self._pending_site is not None:
+                    # Duración real del bloqueo capturado por el hilo
+                    site = self.sites.get(self._pending_site)
+                    if site is not None:
+                        site.total_ms += lag * 1000
+                        site.max_ms = max(site.max_ms, lag * 1000)
+                    self._pending_site = None
+
+    def _watch(self) -> None:
+        interval = settings.LOOP_WATCHDOG_INTERVAL_MS / 1000
+        threshold = settings.LOOP_LAG_THRESHOLD_MS / 1000
+        while not self._stop.wait(interval):
+            with self._lock:
+                beat = self._beat
+            if time.monotonic() - beat - interval < threshold or self._captured_beat == beat:
+                continue
+            # Una captura por bloqueo: el loop sigue sin latir desde `beat`
+            self._captured_beat = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            del frame
+            key, blocking_in = call_site(stack)
+            with self._lock:
+                self.stalls += 1
+                site = self.sites.get(key)
+                if site is None:
+                    if len(self.sites) >= settings.LOOP_WATCHDOG_MAX_SITES:
+                        key = "(otros)"
+                    site = self.sites.setdefault(key, _Site())
+                site.count += 1
+                site.last_seen = time.time()
+                site.blocking_in = blocking_in
+                site.stack = [f"{_short(f.filename)}:{f.lineno} in {f.name}" for f in stack[-_STACK_FRAMES:]]
+                self._pending_site = key
+            print(f"[loop_watchdog] event loop blocked > {settings.LOOP_LAG_THRESHOLD_MS}ms at {key} ({blocking_in})")
+
+    def reset(self) -> None:
+        with self._lock:
+            self.lags.clear()
+            self.max_lag = 0.0
+            self.stalls = 0
+            self.sites.clear()
+
+    def snapshot(self, limit: int = 20) -> Dict[str, Any]:
+        with self._lock:
+            lags = sorted(self.lags)
+            sites = sorted(self.sites.items(), key=lambda kv: kv[1].total_ms, reverse=True)[:limit]
+
+            def pct(p: float) -> float:
+                return round(lags[min(len(lags) - 1, int(p * len(lags)))] * 1000, 1) if lags else 0.0
+
+            return {
+                "enabled": settings.LOOP_WATCHDOG_ENABLED,
+                "running": self.running,
+                "threshold_ms": settings.LOOP_LAG_THRESHOLD_MS,
+                "lag_ms": {
+                    "p50": pct(0.50),
+                    "p95": pct(0.95),
+                    "p99": pct(0.99),
+                    "max": round(self.max_lag * 1000, 1),
+                    "samples": len(lags),
+                },
+                "stalls": self.stalls,
+                "sites": [
+                    {
+                        "site": key,
+                        "count": s.count,
+                        "total_ms": round(s.total_ms, 1),
+                        "max_ms": round(s.max_ms, 1),
+                        "last_seen": s.last_seen,
+                        "blocking_in": s.blocking_in,
+                        "stack": s.stack,
+                    }
+                    for key, s in sites
+                ],
+            }
+
+
+loop_watchdog = LoopWatchdog()
@@ -0,0 +1,241 @@
+"""Presupuesto de tokens para los prompts de capítulos.
+
+Los tokens se cuentan con el tokenizador real (`tiktoken`, dependencia
+opcional) y, si no está disponible, con la aproximación de ≈4 caracteres por
+token. El presupuesto total (PROMPT_TOKEN_BUDGET) se reparte por secciones:
+
+- reglas del narrador e instrucciones del turno: fijas, nunca se recortan;
+- acciones de jugadores (PROMPT_BUDGET_ACTIONS): se recortan las más largas;
+- mundo (PROMPT_BUDGET_WORLD) y fichas de personajes (PROMPT_BUDGET_CHARACTERS):
+  forman el prefijo estable de la partida, se ajustan una vez al construirlo;
+- pasajes recuperados de capítulos antiguos (PROMPT_BUDGET_RETRIEVAL, ver
+  chapter_index);
+- historial: recibe lo que sobra, priorizando los capítulos más recientes.
+
+Cada llamada deja su reparto en `AIService.last_prompt_plan` y se acumula en
+`budget_stats` junto a los tokens de prompt que informa el proveedor.
+"""
+import math
+import threading
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - dependencia opcional
+    tiktoken = None
+
+_ELLIPSIS = "..."
+HISTORY_OMITTED = "(omitidos por longitud)"
+_encodings: Dict[str, Any] = {}
+_encoding_lock = threading.Lock()
+
+
+def _encoding(model: Optional[str] = None):
+    """Codificación de tiktoken para el modelo, o None si no se puede cargar.
+
+    tiktoken descarga los ficheros BPE la primera vez: si falla (sin red) se
+    recuerda el fallo y se usa la aproximación para el resto del proceso.
+    """
+    if tiktoken is None:
+        return None
+    model = model or settings.OPENAI_MODEL
+    if model in _encodings:
+        return _encodings[model]
+    with _encoding_lock:
+        if model not in _encodings:
+            try:
+                try:
+                    enc = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    enc = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                print(f"[prompt_budget] tokenizer unavailable for {model}, using approximation: {e}")
+                enc = None
+            _encodings[model] = enc
+    return _encodings[model]
+
+
+def warm_up(model: Optional[str] = None) -> str:
+    """Cargar el tokenizador al arrancar (puede descargar ficheros): así no bloquea el event loop después."""
+    return tokenizer_name(model)
+
+
+def tokenizer_name(model: Optional[str] = None) -> str:
+    enc = _encoding(model)
+    return f"tiktoken:{enc.name}" if enc is not None else "approx:4chars"
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    if not text:
+        return 0
+    enc = _encoding(model)
+    if enc is None:
+        return math.ceil(len(text) / 4)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Recortar `text` a `max_tokens` como máximo (añade '...' si recorta)."""
+    text = text or ""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    if max_tokens <= 1:
+        return ""
+    enc = _encoding(model)
+    if enc is None:
+        return text[: max(0, (max_tokens - 1) * 4)].rstrip() + _ELLIPSIS
+    return enc.decode(enc.encode(text, disallowed_special=())[: max_tokens - 1]).rstrip() + _ELLIPSIS
+
+
+def _water_fill(sizes: List[int], budget: int) -> List[int]:
+    """Reparto equitativo: los elementos que caben en su cuota se quedan enteros
+    y lo que sobra se redistribuye entre los más largos."""
+    caps = [0] * len(sizes)
+    remaining = max(0, budget)
+    pending = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    while pending:
+        share = remaining // len(pending)
+        i = pending[0]
+        if sizes[i] <= share:
+            caps[i] = sizes[i]
+            remaining -= sizes[i]
+            pending.pop(0)
+        else:
+            for j in pending:
+                caps[j] = share
+            break
+    return caps
+
+
+def fit_fields(values: List[str], budget: int, model: Optional[str] = None) -> List[str]:
+    """Ajustar varios textos a un presupuesto común recortando primero los más largos."""
+    sizes = [count_tokens(v, model) for v in values]
+    if sum(sizes) <= budget:
+        return list(values)
+    caps = _water_fill(sizes, budget)
+    return [v if size <= cap else truncate_to_tokens(v, cap, model) for v, size, cap in zip(values, sizes, caps)]
+
+
+def _compact_card(card: Dict[str, Any], level: int, model: Optional[str]) -> Dict[str, Any]:
+    """Ficha (ver character_cards) a un nivel de detalle: 0 completa ... 3 solo nombre y trasfondo corto."""
+    if level == 0:
+        return card
+    traits = card.get("traits") or {}
+    return {
+        **card,
+        "background": truncate_to_tokens(card.get("background", ""), {1: 30, 2: 20, 3: 12}[level], model),
+        "beliefs": card.get("beliefs", "") if level == 1 else "",
+        "traits": {} if level == 3 else {
+            group: [{"name": t.get("name", "")} for t in items[: None if level == 1 else 1]]
+            for group, items in traits.items()
+        },
+    }
+
+
+def fit_character_cards(
+    cards: List[Dict[str, Any]], budget: int, serialize, model: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Reducir el detalle de todas las fichas por igual hasta que quepan en `budget`:
+    primero se quitan las pistas de los rasgos, luego creencias y rasgos secundarios.
+
+    `serialize` convierte la lista en el texto que irá en el prompt (para contar
+    exactamente lo que se envía). Los nombres nunca se eliminan.
+    """
+    for level in range(4):
+        compact = [_compact_card(c, level, model) for c in cards]
+        if count_tokens(serialize(compact), model) <= budget:
+            return compact
+    return compact
+
+
+def fit_history(previous_chapters: List[str], budget: int, model: Optional[str] = None) -> List[str]:
+    """Resumen del historial dentro de `budget`, del capítulo más reciente al más antiguo.
+
+    Los dos últimos capítulos reciben hasta PROMPT_HISTORY_RECENT_TOKENS y el resto
+    hasta PROMPT_HISTORY_OLDER_TOKENS; los que ya no caben se indican como omitidos.
+    """
+    chapters = previous_chapters or []
+    total = len(chapters)
+    out: List[str] = []
+    # Reservar sitio para la nota de capítulos omitidos
+    remaining = budget - count_tokens(f"Cap.1-{total}: {HISTORY_OMITTED}", model)
+    first_kept = total + 1
+    for i in range(total, 0, -1):
+        text = (chapters[i - 1] or "").strip().replace("\n", " ")
+        label = f"Cap.{i}: "
+        cap = settings.PROMPT_HISTORY_RECENT_TOKENS if i >= total - 1 else settings.PROMPT_HISTORY_OLDER_TOKENS
+        cap = min(cap, remaining - count_tokens(label, model))
+        if cap < 16:
+            break
+        entry = label + truncate_to_tokens(text, cap, model)
+        out.append(entry)
+        remaining -= count_tokens(entry, model)
+        first_kept = i
+    out.reverse()
+    if first_kept > 1 and total:
+        omitted = "Cap.1" if first_kept == 2 else f"Cap.1-{first_kept - 1}"
+        out.insert(0, f"{omitted}: {HISTORY_OMITTED}")
+    return out
+
+
+def fit_actions(actions: List[Dict[str, Any]], budget: int, model: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Recortar el texto de las acciones (las más largas primero) para no superar `budget`."""
+    if not actions:
+        return []
+    # Tokens de la estructura fija de cada acción (ids, nombres): se descuentan del presupuesto
+    overhead = sum(count_tokens(str({**a, "action": ""}), model) for a in actions)
+    texts = fit_fields([a.get("action", "") for a in actions], budget - overhead, model)
+    return [{**a, "action": t} for a, t in zip(actions, texts)]
+
+
+class PromptBudgetStats:
+    """Tokens por sección de las últimas llamadas y comparación con lo que factura el proveedor."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.over_budget = 0
+        self.section_totals: Dict[str, int] = {}
+        self.section_max: Dict[str, int] = {}
+        self.trimmed: Dict[str, int] = {}
+        self.estimated_prompt_tokens = 0
+        self.reported_prompt_tokens = 0
+
+    def record(self, plan: Dict[str, Any], usage: Any = None) -> None:
+        with self._lock:
+            self.calls += 1
+            sections = plan.get("sections", {})
+            for name, tokens in sections.items():
+                self.section_totals[name] = self.section_totals.get(name, 0) + tokens
+                self.section_max[name] = max(self.section_max.get(name, 0), tokens)
+            for name in plan.get("trimmed", []):
+                self.trimmed[name] = self.trimmed.get(name, 0) + 1
+            if plan.get("total", 0) > plan.get("budget", 0):
+                self.over_budget += 1
+            reported = getattr(usage, "prompt_tokens", None)
+            if isinstance(reported, int):
+                self.estimated_prompt_tokens += plan.get("total", 0)
+                self.reported_prompt_tokens += reported
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = self.calls or 1
+            return {
+                "tokenizer": tokenizer_name(),
+                "budget": settings.PROMPT_TOKEN_BUDGET,
+                "calls": self.calls,
+                "over_budget": self.over_budget,
+                "sections_avg": {k: round(v / calls, 1) for k, v in self.section_totals.items()},
+                "sections_max": dict(self.section_max),
+                "trimmed": dict(self.trimmed),
+                # > 1: el contador local subestima (mensajes, formato del proveedor)
+                "reported_vs_estimated": (
+                    round(self.reported_prompt_tokens / self.estimated_prompt_tokens, 3)
+                    if self.estimated_prompt_tokens else None
+                ),
+            }
+
+
+budget_stats = PromptBudgetStats()
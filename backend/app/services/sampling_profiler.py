@@ -0,0 +1,187 @@
+"""Perfilador por muestreo bajo demanda del proceso en marcha.
+
+Un hilo toma las pilas de todos los hilos (`sys._current_frames`) a `hz`
+muestras por segundo durante un tiempo acotado (PROFILER_MAX_SECONDS), sin
+reiniciar el proceso ni instrumentar el código:
+
+- mode="wall": cuenta todas las muestras (incluida la espera); con
+  `idle=False` se descartan las de hilos parados en select/wait.
+- mode="cpu": solo cuenta un hilo si consumió CPU desde la muestra anterior
+  (tiempos por hilo de /proc/self/task; en sistemas sin /proc equivale a wall
+  sin esperas).
+
+Las pilas del hilo del event loop llevan como raíz la tarea asyncio que se
+estaba ejecutando (`task:<corutina>`) y se agregan también por router
+(`app/routers/*.py`). La salida "folded" (`frame;frame;frame N`) es la que
+aceptan flamegraph.pl, speedscope o inferno.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_ROOT_DIR = os.path.dirname(_APP_DIR)
+_ROUTERS_DIR = os.path.join(_APP_DIR, "routers")
+# Funciones más internas que significan "hilo esperando", no trabajando
+_IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+}
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class ProfilerBusyError(Exception):
+    """Ya hay un perfil en curso en este proceso."""
+
+
+def _short(filename: str) -> str:
+    return os.path.relpath(filename, _ROOT_DIR) if filename.startswith(_ROOT_DIR) else os.path.basename(filename)
+
+
+def _thread_cpu_ticks(native_id: Optional[int]) -> Optional[int]:
+    """utime + stime del hilo (en ticks de reloj), o None si no hay /proc."""
+    if native_id is None:
+        return None
+    try:
+        with open(f"/proc/self/task/{native_id}/stat", "rb") as fh:
+            # El nombre del hilo (campo 2) va entre paréntesis y puede contener espacios
+            fields = fh.read().rsplit(b")", 1)[1].split()
+        return int(fields[11]) + int(fields[12])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _task_label(loop: Optional[asyncio.AbstractEventLoop]) -> Optional[str]:
+    if loop is None:
+        return None
+    try:
+        task = asyncio.current_task(loop)
+    except RuntimeError:
+        return None
+    if task is None:
+        return None
+    coro = task.get_coro()
+    return f"task:{getattr(coro, '__qualname__', None) or task.get_name()}"
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    def run(
+        self,
+        seconds: float,
+        hz: int = 100,
+        mode: str = "wall",
+        idle: bool = True,
+        loop_thread_id: Optional[int] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ) -> Dict[str, Any]:
+        """Muestrear durante `seconds` (bloqueante: ejecutar en un hilo aparte)."""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError()
+        try:
+            return self._run(seconds, hz, mode, idle, loop_thread_id, loop)
+        finally:
+            self._lock.release()
+
+    def _run(self, seconds, hz, mode, idle, loop_thread_id, loop) -> Dict[str, Any]:
+        seconds = max(0.1, min(float(seconds), settings.PROFILER_MAX_SECONDS))
+        hz = max(1, min(int(hz), 1000))
+        interval = 1.0 / hz
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        tasks: Counter = Counter()
+        routers: Counter = Counter()
+        cpu_ticks: Dict[int, Optional[int]] = {}
+        cpu_supported = True
+        samples = ticks = 0
+        started = time.monotonic()
+        cpu_started = time.process_time()
+        deadline = started + seconds
+        next_tick = started
+
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if now < next_tick:
+                time.sleep(next_tick - now)
+            next_tick += interval
+            ticks += 1
+            names = {t.ident: t for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                thread = names.get(ident)
+                if mode == "cpu":
+                    current = _thread_cpu_ticks(getattr(thread, "native_id", None))
+                    if current is None:
+                        cpu_supported = False
+                    else:
+                        previous = cpu_ticks.get(ident)
+                        cpu_ticks[ident] = current
+                        if previous is None or current == previous:
+                            continue
+                stack: List[Tuple[str, str, int]] = []
+                f = frame
+                while f is not None:
+                    code = f.f_code
+                    stack.append((code.co_filename, code.co_name, code.co_firstlineno))
+                    f = f.f_back
+                del frame, f
+                stack.reverse()
+                if not stack:
+                    continue
+                innermost = (os.path.basename(stack[-1][0]), stack[-1][1])
+                if (not idle or (mode == "cpu" and not cpu_supported)) and innermost in _IDLE_FRAMES:
+                    continue
+
+                if ident == loop_thread_id:
+                    root = ["loop"]
+                    label = _task_label(loop)
+                    if label:
+                        root.append(label)
+                        tasks[label] += 1
+                    else:
+                        tasks["(sin tarea: callbacks / espera)"] += 1
+                else:
+                    root = [f"thread:{thread.name if thread else ident}"]
+                for filename, _, _ in reversed(stack):
+                    if filename.startswith(_ROUTERS_DIR):
+                        routers[os.path.basename(filename)] += 1
+                        break
+                frames = root + [f"{name} ({_short(filename)}:{line})" for filename, name, line in stack]
+                stacks[";".join(frames)] += 1
+                samples += 1
+
+        elapsed = time.monotonic() - started
+        functions: Counter = Counter()
+        for folded, count in stacks.items():
+            functions[folded.rsplit(";", 1)[-1]] += count
+        result = {
+            "mode": mode if cpu_supported or mode != "cpu" else "cpu(approx: wall sin esperas)",
+            "seconds": round(elapsed, 2),
+            "hz": hz,
+            "ticks": ticks,
+            "samples": samples,
+            "process_cpu_seconds": round(time.process_time() - cpu_started, 3),
+            "top_functions": [{"frame": k, "samples": v} for k, v in functions.most_common(30)],
+            "tasks": dict(tasks.most_common(30)),
+            "routers": dict(routers.most_common()),
+            "folded": "\n".join(f"{k} {v}" for k, v in stacks.most_common()),
+        }
+        self.last_run = {k: v for k, v in result.items() if k != "folded"}
+        return result
+
+
+sampling_profiler = SamplingProfiler()
@@ -0,0 +1,136 @@
+"""Generación especulativa de capítulos.
+
+- `speculator`: al abrirse la fase de acciones del capítulo N se empieza a
+  generar en segundo plano la continuación "sin acciones" (capítulo N+1). Si
+  al cerrar la fase no hay acciones, `advance_to_next_chapter` usa ese texto y
+  el turno termina al instante; si llega alguna acción, se descarta.
+- `first_chapter_prewarmer`: en la sala, en cuanto hay mundo y todos los
+  miembros han elegido personaje, se genera el primer capítulo. Al iniciar la
+  partida se usa si la huella (hash del prefijo mundo + fichas) coincide.
+
+Las entradas se indexan por (propietario, variante): (game_id, (capítulo,
+total)) o (room_id, huella). La petición se hace con PRIORITY_SPECULATIVE:
+solo se lanza si el planificador tiene cupo inmediato, así que una
+especulación existente siempre está en curso (o terminada) y esperarla es
+más rápido que empezar de nuevo.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from app.core.config import settings
+from app.services.llm_scheduler import SchedulerBusyError
+
+SpeculationKey = Tuple[str, Hashable]
+
+
+class _Entry:
+    __slots__ = ("task", "created_at")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.created_at = time.monotonic()
+
+
+class Speculator:
+    def __init__(self, name: str, enabled_setting: str):
+        self.name = name
+        self._enabled_setting = enabled_setting
+        self._entries: Dict[SpeculationKey, _Entry] = {}
+        self.started = 0
+        self.used = 0
+        self.discarded = 0
+        self.failed = 0
+        self.skipped_busy = 0
+        self.wasted_tokens = 0
+
+    @property
+    def enabled(self) -> bool:
+        # Con GENERATION_MODE=queue el resultado quedaría en la memoria de un proceso y el
+        # siguiente trabajo lo puede reclamar otro worker: desactivado
+        return bool(getattr(settings, self._enabled_setting, False)) and settings.GENERATION_MODE != "queue"
+
+    def start(
+        self,
+        owner_id: str,
+        variant: Hashable,
+        generate: Callable[[], Awaitable[Tuple[str, Dict[str, Any]]]],
+    ) -> None:
+        """Lanzar `generate()` -> (texto, registro de la llamada) en segundo plano si no hay ya una para esta clave."""
+        if not self.enabled:
+            return
+        self._prune()
+        key = (str(owner_id), variant)
+        if key in self._entries:
+            return
+        self.discard(owner_id)  # especulaciones con otra variante ya no sirven
+        task = asyncio.create_task(generate())
+        task.add_done_callback(self._on_done)
+        self._entries[key] = _Entry(task)
+        self.started += 1
+        print(f"[{self.name}] started {variant} for {owner_id}")
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        if task.cancelled() or task.exception() is None:
+            return
+        if isinstance(task.exception(), SchedulerBusyError):
+            self.skipped_busy += 1
+        else:
+            self.failed += 1
+            print(f"[{self.name}] generation failed: {task.exception()}")
+
+    def discard(self, owner_id: str) -> None:
+        """Descartar cualquier especulación del propietario (p.ej. llegó una acción)."""
+        for key in [k for k in self._entries if k[0] == str(owner_id)]:
+            entry = self._entries.pop(key)
+            self.discarded += 1
+            # La llamada al proveedor no se puede interrumpir: se deja terminar y se cuenta el gasto
+            entry.task.add_done_callback(self._count_waste)
+
+    def _count_waste(self, task: asyncio.Task) -> None:
+        if task.cancelled() or task.exception() is not None:
+            return
+        _, call = task.result()
+        total = (call or {}).get("total_tokens")
+        if isinstance(total, int):
+            self.wasted_tokens += total
+
+    async def take(self, owner_id: str, variant: Hashable) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Texto y registro de la llamada (ver llm_usage.call_record) especulados para esta
+        variante, o None si no hay (o falló).
+
+        Una entrada del mismo propietario con otra variante queda obsoleta y se descarta.
+        """
+        entry = self._entries.pop((str(owner_id), variant), None)
+        self.discard(owner_id)
+        if entry is None:
+            return None
+        try:
+            result = await entry.task
+        except Exception:
+            return None
+        self.used += 1
+        print(f"[{self.name}] used {variant} for {owner_id}")
+        return result
+
+    def _prune(self) -> None:
+        """Quitar especulaciones viejas (partidas o salas abandonadas)."""
+        cutoff = time.monotonic() - settings.SPECULATIVE_CHAPTER_TTL_SECONDS
+        for key in [k for k, e in self._entries.items() if e.created_at < cutoff]:
+            self._entries.pop(key).task.add_done_callback(self._count_waste)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "pending": len(self._entries),
+            "started": self.started,
+            "used": self.used,
+            "discarded": self.discarded,
+            "failed": self.failed,
+            "skipped_busy": self.skipped_busy,
+            "wasted_tokens": self.wasted_tokens,
+        }
+
+
+speculator = Speculator("speculation", "SPECULATIVE_CHAPTERS_ENABLED")
+first_chapter_prewarmer = Speculator("prewarm", "FIRST_CHAPTER_PREWARM_ENABLED")
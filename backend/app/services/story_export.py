@@ -0,0 +1,174 @@
+"""Exportación de historias sin cargar la partida entera en memoria.
+
+- TXT / Markdown: se generan capítulo a capítulo desde el cursor de
+  `game_chapters` (lotes pequeños, solo número y contenido) y se envían con
+  StreamingResponse: la descarga empieza con el primer capítulo.
+- PDF: reportlab solo escribe el documento al final (`canvas.save()`), así
+  que no se puede emitir por trozos mientras se dibuja. Se dibuja en un hilo
+  (fuera del event loop) pidiendo los capítulos al cursor uno a uno, se
+  escribe en un fichero temporal que pasa a disco a partir de
+  _PDF_SPOOL_BYTES y se envía en trozos de _CHUNK_BYTES. Como mucho
+  EXPORT_PDF_MAX_CONCURRENT renders a la vez por proceso; si se cancela la
+  petición, el hilo deja de pedir capítulos y se espera a que termine antes
+  de cerrar el fichero y liberar el turno.
+"""
+import asyncio
+import tempfile
+import textwrap
+import threading
+from datetime import datetime
+from typing import AsyncIterator, BinaryIO, Optional
+
+from bson import ObjectId
+
+from app.core.config import settings
+from app.core.database import routed_reads
+
+_CURSOR_BATCH = 4
+_CHUNK_BYTES = 64 * 1024
+_PDF_SPOOL_BYTES = 1024 * 1024
+
+_pdf_slots: Optional[asyncio.Semaphore] = None
+
+
+def export_title(game: dict, game_id: str) -> str:
+    return (game.get("name") or f"Historia {game_id}").strip()
+
+
+def attachment_headers(title: str, extension: str) -> dict:
+    return {"Content-Disposition": f'attachment; filename="{title.replace(" ", "_")}.{extension}"'}
+
+
+async def _anchor_causal_read(reads, game_id: str) -> None:
+    if reads.session is not None and ObjectId.is_valid(game_id):
+        # Lectura puntual en el primario: fija el punto causal para el cursor del secundario
+        await reads.anchor["games"].find_one({"_id": ObjectId(game_id)}, {"_id": 1}, session=reads.session)
+
+
+def _chapters_cursor(reads, game_id: str):
+    return reads.db["game_chapters"].find(
+        {"game_id": game_id}, {"chapter_number": 1, "content": 1}, session=reads.session
+    ).sort("chapter_number", 1).batch_size(_CURSOR_BATCH)
+
+
+async def iter_chapters(db, game_id: str) -> AsyncIterator[dict]:
+    """Capítulos de la partida en orden, leídos por lotes con la política "games.export"."""
+    async with routed_reads(db, "games.export") as reads:
+        await _anchor_causal_read(reads, game_id)
+        async for chapter in _chapters_cursor(reads, game_id):
+            yield chapter
+
+
+async def iter_text(db, game_id: str, title: str, markdown: bool = False) -> AsyncIterator[bytes]:
+    """Cuerpo del .txt / .md, un trozo por capítulo."""
+    yield (f"# {title}\n\n" if markdown else f"{title}\n\n").encode("utf-8")
+    async for ch in iter_chapters(db, game_id):
+        n = ch.get("chapter_number")
+        heading = f"## Capítulo {n}\n\n" if markdown else f"Capítulo {n}\n" + "=" * 20 + "\n\n"
+        yield (heading + (ch.get("content") or "").strip() + "\n\n").encode("utf-8")
+
+
+def _render_pdf(title: str, total: int, next_chapter, out: BinaryIO) -> None:
+    """Dibujar el PDF en `out` (en un hilo; `next_chapter()` devuelve None al terminar)."""
+    from reportlab.lib.pagesizes import LETTER
+    from reportlab.lib.units import inch
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(out, pagesize=LETTER)
+    width, height = LETTER
+
+    # Portada simple
+    c.setFont("Times-Bold", 18)
+    c.drawString(1*inch, height-1.5*inch, title)
+    c.setFont("Times-Roman", 12)
+    c.drawString(1*inch, height-1.8*inch, f"Capítulos: {total}")
+    c.drawString(1*inch, height-2.1*inch, f"Generado: {datetime.utcnow().strftime('%Y-%m-%d')}")
+    c.showPage()
+
+    # Cuerpo
+    while (ch := next_chapter()) is not None:
+        text = c.beginText(1*inch, height-1*inch)
+        text.setFont("Times-Bold", 14)
+        text.textLine(f"Capítulo {ch.get('chapter_number')}")
+        text.textLine("")
+        text.setFont("Times-Roman", 11)
+
+        # Wrap simple por líneas ~95 caracteres
+        for line in (ch.get("content") or "").splitlines():
+            if line.strip():
+                for wrapped in textwrap.wrap(line, width=95):
+                    text.textLine(wrapped)
+            else:
+                text.textLine("")  # línea vacía
+
+        c.drawText(text)
+        c.showPage()
+
+    c.save()
+
+
+async def render_pdf(db, game_id: str, title: str) -> BinaryIO:
+    """PDF completo en un fichero temporal (posicionado al inicio); el llamador lo cierra."""
+    global _pdf_slots
+    if _pdf_slots is None:
+        _pdf_slots = asyncio.Semaphore(max(1, settings.EXPORT_PDF_MAX_CONCURRENT))
+
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+    out = tempfile.SpooledTemporaryFile(max_size=_PDF_SPOOL_BYTES)
+    try:
+        async with _pdf_slots:
+            async with routed_reads(db, "games.export") as reads:
+                await _anchor_causal_read(reads, game_id)
+                total = await reads.db["game_chapters"].count_documents(
+                    {"game_id": game_id}, session=reads.session
+                )
+                cursor = _chapters_cursor(reads, game_id)
+
+                def next_chapter() -> Optional[dict]:
+                    # El cursor vive en el event loop: el hilo le pide cada capítulo y espera
+                    if stop.is_set():
+                        return None
+                    try:
+                        return asyncio.run_coroutine_threadsafe(cursor.__anext__(), loop).result()
+                    except StopAsyncIteration:
+                        return None
+
+                render = asyncio.ensure_future(asyncio.to_thread(_render_pdf, title, total, next_chapter, out))
+                try:
+                    await asyncio.shield(render)
+                except asyncio.CancelledError:
+                    # El hilo sigue usando `out`, el cursor y el permiso: pararlo y esperar a que acabe
+                    stop.set()
+                    await _wait_for_thread(render)
+                    raise
+                finally:
+                    await cursor.close()
+    except BaseException:
+        out.close()
+        raise
+    out.seek(0)
+    return out
+
+
+async def _wait_for_thread(task: asyncio.Future) -> None:
+    """Esperar a `task` aunque vuelvan a cancelar al llamador (el hilo no se puede interrumpir)."""
+    while not task.done():
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            pass
+    if not task.cancelled():
+        task.exception()  # ya se propaga la cancelación; no dejar la excepción sin recoger
+
+
+async def iter_file(fh: BinaryIO) -> AsyncIterator[bytes]:
+    """Enviar un fichero temporal por trozos y cerrarlo al terminar (o si el cliente corta)."""
+    try:
+        while True:
+            chunk = await asyncio.to_thread(fh.read, _CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fh.close()
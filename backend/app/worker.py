@@ -0,0 +1,43 @@
+"""Worker de generación: `python -m app.worker [--concurrency N]`.
+
+Consume `generation_jobs` (ver services/generation_queue.py) con su propio
+planificador de LLM, y publica los eventos de WebSocket para que los reenvíen
+los procesos de la API. Se pueden lanzar tantos procesos como haga falta.
+"""
+import argparse
+import asyncio
+from functools import partial
+
+from app.core.config import settings
+from app.core.database import close_db, get_db
+from app.routers import games  # noqa: F401  (registra advance_chapter e initialize_game)
+from app.routers import websockets  # registra room_chapter; su manager publica los eventos
+from app.services import generation_queue, prompt_budget
+from app.services.llm_scheduler import llm_scheduler
+from app.services.loop_watchdog import loop_watchdog
+
+
+async def main(concurrency: int) -> None:
+    print(f"🛠️  Worker de generación de {settings.APP_NAME}")
+    db = await get_db()
+    await generation_queue.ensure_collections(db)
+    websockets.manager.event_sink = partial(generation_queue.publish_event, db)
+    llm_scheduler.start()
+    loop_watchdog.start()
+    print(f"🔢 Tokenizador de prompts: {await asyncio.to_thread(prompt_budget.warm_up)}")
+    try:
+        await generation_queue.run_worker(db, concurrency)
+    finally:
+        llm_scheduler.stop()
+        loop_watchdog.stop()
+        await close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker de generación de capítulos")
+    parser.add_argument("--concurrency", type=int, default=settings.GENERATION_WORKER_CONCURRENCY)
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.concurrency))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,201 @@
+"""Micro-benchmarks de las funciones puras que se ejecutan en cada turno, con baseline.
+
+Ejecutar desde `backend/`:
+
+    python -m benchmarks.bench_hot_paths                   # medir y comparar con baseline.json
+    python -m benchmarks.bench_hot_paths --strict          # código 1 si hay regresiones (CI de referencia)
+    python -m benchmarks.bench_hot_paths --save-baseline   # fijar la baseline (en la máquina de referencia)
+    python -m benchmarks.bench_hot_paths -k prompt --threshold 0.15
+
+Cada caso se mide como la mediana de _ROUNDS rondas de ~_ROUND_SECONDS (µs
+por llamada) sobre los datos de `fixtures` (6 jugadores, 20 capítulos, 300
+mensajes de chat), junto con su ruido: la desviación absoluta mediana entre
+rondas, relativa a la mediana. Un caso es regresión si supera la baseline en
+más de `--threshold` (25% por defecto) más 3 veces el ruido de ambas
+mediciones.
+
+La baseline guarda µs absolutos: solo es comparable en la misma máquina y
+versión de Python. El tokenizador (tiktoken o la aproximación por caracteres)
+solo cambia los casos `prompt.*`, que cuentan tokens; el resto se compara
+aunque difiera. Por defecto las regresiones se avisan; con `--strict` el
+comando termina con código 1 si alguna está en un caso comparable.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from app.core.serialization import dumps, dumps_text
+from app.models.schemas import GameActionDoc, GameChapterDoc, GameMemberDoc, GameMeta
+from app.routers.rooms import _public_room_view
+from app.services import ai_service
+from app.services.chapter_index import ChapterIndexRegistry
+from app.services.character_cards import build_character_card, character_cards, render_character_cards
+from app.services.prompt_budget import fit_actions, fit_history, tokenizer_name
+from benchmarks.fixtures import make_game_payload, make_room
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+_ROUND_SECONDS = 0.1
+_ROUNDS = 9
+_NOISE_FACTOR = 3
+# Casos cuyo tiempo depende del tokenizador (tiktoken frente a la aproximación)
+_TOKENIZER_PREFIX = "prompt."
+
+
+def _cases() -> List[Tuple[str, Callable[[], Any]]]:
+    room = make_room()
+    payload = make_game_payload()
+    world = room["world"]
+    selected = room["selected_characters"]
+    with_cards = [{**s, "card": build_character_card(s["character"])} for s in selected]
+    chapters = [c["content"] for c in payload["chapters"]]
+    actions = room["pending_actions"]
+    # Como se guarda en Mongo: fechas ISO, ids de usuario como texto
+    game = {**payload["game"], "owner_id": room["owner_id"], "admin_id": room["admin_id"],
+            "created_at": payload["game"]["created_at"].isoformat()}
+    rooms_list = [dict(room, _id=room["_id"]) for _ in range(50)]
+
+    index = ChapterIndexRegistry(max_games=10)
+    query = " ".join(a["action"] for a in actions)
+    index.relevant_passages("bench", chapters, query, 600)
+
+    return [
+        # Prompt de cada capítulo
+        ("prompt.characters_json", lambda: ai_service._characters_json(selected)),
+        ("prompt.player_actions_json", lambda: ai_service._player_actions_json(actions)),
+        ("prompt.fit_actions", lambda: fit_actions(ai_service._player_actions_json(actions), 1000)),
+        ("prompt.fit_history_20", lambda: fit_history(chapters, 3000)),
+        ("prompt.character_cards_cached", lambda: render_character_cards(character_cards(with_cards))),
+        ("prompt.character_cards_rebuild", lambda: render_character_cards(character_cards(selected))),
+        ("prompt.build_prefix", lambda: ai_service.build_prompt_prefix(world, with_cards)),
+        ("prompt.retrieval_search", lambda: index.relevant_passages("bench", chapters, query, 600)),
+        # Serialización de broadcasts y respuestas
+        ("serialize.room_update_ws", lambda: dumps_text({"type": "room_update", "data": room})),
+        ("serialize.game_payload_http", lambda: dumps(payload)),
+        ("rooms.public_room_view_x50", lambda: [_public_room_view(r) for r in rooms_list]),
+        # Validadores _normalize_ids de los modelos de partida
+        ("schemas.game_meta", lambda: GameMeta.model_validate(dict(game))),
+        ("schemas.chapters_x20", lambda: [GameChapterDoc.model_validate(dict(c)) for c in payload["chapters"]]),
+        ("schemas.members_x6", lambda: [GameMemberDoc.model_validate(dict(m)) for m in payload["members"]]),
+        ("schemas.actions_x6", lambda: [GameActionDoc.model_validate(dict(a)) for a in payload["actions"]]),
+    ]
+
+
+def measure(fn: Callable[[], Any]) -> Tuple[float, float]:
+    """(mediana del tiempo por llamada en s, ruido relativo) de `_ROUNDS` rondas de ~_ROUND_SECONDS."""
+    fn()  # calentamiento
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= _ROUND_SECONDS / 5:
+            break
+        loops *= 2
+    loops = max(1, int(loops * _ROUND_SECONDS / max(elapsed, 1e-9)))
+    rounds = []
+    for _ in range(_ROUNDS):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        rounds.append((time.perf_counter() - start) / loops)
+    median = statistics.median(rounds)
+    mad = statistics.median(abs(r - median) for r in rounds)
+    return median, (mad / median if median else 0.0)
+
+
+def _environment() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "tokenizer": tokenizer_name(),
+    }
+
+
+def load_baseline(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+
+
+def _base_case(entry: Any) -> Tuple[float, float]:
+    """(µs, ruido) de un caso de la baseline (las antiguas solo guardaban µs)."""
+    if isinstance(entry, dict):
+        return float(entry.get("us") or 0), float(entry.get("noise") or 0)
+    return float(entry or 0), 0.0
+
+
+def comparable_case(name: str, env: Dict[str, str], base_env: Dict[str, Any]) -> bool:
+    """¿Se puede comparar el caso con la baseline? Misma máquina y Python; el tokenizador solo en prompt.*."""
+    for key, value in env.items():
+        if base_env.get(key) != value and (key != "tokenizer" or name.startswith(_TOKENIZER_PREFIX)):
+            return False
+    return True
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de funciones del turno")
+    parser.add_argument("-k", dest="filter", default="", help="solo casos cuyo nombre contenga este texto")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.25, help="ralentización tolerada (0.25 = +25%%)")
+    parser.add_argument("--strict", action="store_true", help="código 1 si hay regresiones (mismo entorno que la baseline)")
+    args = parser.parse_args(argv)
+
+    env = _environment()
+    baseline = load_baseline(args.baseline)
+    base_results = baseline.get("results", {})
+    base_env = baseline.get("environment", {})
+    mismatched = [k for k in env if base_env.get(k) != env[k]]
+    if base_results and mismatched:
+        diffs = ", ".join(f"{k}: {base_env.get(k)} -> {env[k]}" for k in mismatched)
+        scope = f"los casos {_TOKENIZER_PREFIX}*" if mismatched == ["tokenizer"] else "todos los casos"
+        print(f"⚠️  entorno distinto al de la baseline ({diffs}): en {scope} las regresiones solo se avisan")
+
+    results: Dict[str, Dict[str, float]] = {}
+    regressions = []
+    print(f"{'case':<34}{'µs/op':>12}{'±':>6}{'baseline':>12}{'delta':>9}")
+    for name, fn in _cases():
+        if args.filter and args.filter not in name:
+            continue
+        seconds, noise = measure(fn)
+        us = seconds * 1e6
+        results[name] = {"us": round(us, 2), "noise": round(noise, 4)}
+        base, base_noise = _base_case(base_results.get(name))
+        if base:
+            delta = us / base - 1
+            tolerance = args.threshold + _NOISE_FACTOR * (noise + base_noise)
+            flag = ""
+            if delta > tolerance:
+                flag = f"  ⚠️ regresión (tolerancia {tolerance:.0%})"
+                if not comparable_case(name, env, base_env):
+                    flag += " (solo aviso: entorno distinto)"
+                regressions.append(name)
+            print(f"{name:<34}{us:>12.1f}{noise:>6.0%}{base:>12.1f}{delta:>+8.0%}{flag}")
+        else:
+            print(f"{name:<34}{us:>12.1f}{noise:>6.0%}{'-':>12}{'':>9}")
+
+    if args.save_baseline:
+        merged = {**base_results, **results} if args.filter else results
+        with open(args.baseline, "w", encoding="utf-8") as fh:
+            json.dump({"environment": env, "results": merged}, fh, indent=2, sort_keys=True)
+            fh.write("\n")
+        print(f"baseline guardada en {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"\n{len(regressions)} caso(s) más lentos que la baseline por encima de su tolerancia: {', '.join(regressions)}")
+        blocking = [name for name in regressions if comparable_case(name, env, base_env)]
+        return 1 if args.strict and blocking else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""Micro-benchmark: serialización legacy (`_to_serializable` + json) vs encoder compartido.
+
+Ejecutar desde `backend/`:
+
+    python -m benchmarks.bench_serialization
+"""
+import json
+import time
+import tracemalloc
+
+from bson import ObjectId
+
+from app.core.serialization import dumps, dumps_text
+from benchmarks.fixtures import make_game_payload, make_room
+
+
+def _to_serializable(obj):
+    """Copia del recorrido recursivo que usaban rooms.py y websockets.py."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, list):
+        return [_to_serializable(it) for it in obj]
+    if isinstance(obj, dict):
+        return {k: _to_serializable(v) for k, v in obj.items()}
+    return obj
+
+
+def legacy_broadcast(message: dict) -> str:
+    """Lo que hacía broadcast_to_room: intentar json.dumps y, si falla, recorrer."""
+    try:
+        return json.dumps(message)
+    except Exception:
+        return json.dumps(_to_serializable(message), default=str)
+
+
+def legacy_response(doc) -> bytes:
+    """Respuesta HTTP: recorrido + json (aprox. a jsonable_encoder + JSONResponse)."""
+    return json.dumps(_to_serializable(doc), default=str, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _time_it(fn, payload, rounds: int) -> float:
+    fn(payload)  # calentamiento
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            fn(payload)
+        best = min(best, (time.perf_counter() - start) / rounds)
+    return best
+
+
+def _peak_allocation(fn, payload) -> int:
+    tracemalloc.start()
+    fn(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main(rounds: int = 200):
+    room = make_room()
+    cases = [
+        ("room_update (ws)", {"type": "room_update", "data": room}, legacy_broadcast, dumps_text),
+        ("room (http)", room, legacy_response, dumps),
+        ("game payload (http)", make_game_payload(), legacy_response, dumps),
+    ]
+    print(f"{'payload':<22}{'impl':<8}{'µs/op':>12}{'peak KiB':>12}")
+    for name, payload, legacy, fast in cases:
+        for label, fn in (("legacy", legacy), ("fast", fast)):
+            per_op = _time_it(fn, payload, rounds) * 1e6
+            peak = _peak_allocation(fn, payload)
+            print(f"{name:<22}{label:<8}{per_op:>12.1f}{peak / 1024:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Datos representativos para los benchmarks (sala y partida "grandes").
+
+Los tamaños imitan una mesa llena: 6 jugadores con personajes completos,
+historial de chat largo y una partida de 20 capítulos.
+"""
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+PLAYERS = 6
+CHAPTERS = 20
+CHAT_MESSAGES = 300
+
+_LOREM = (
+    "La niebla se arrastraba entre las columnas del templo mientras los viajeros "
+    "avanzaban con cautela, atentos a cada crujido de la piedra antigua. "
+)
+
+
+def _trait(name: str, i: int) -> dict:
+    return {"name": f"{name} {i}", "description": f"Descripción detallada del rasgo {name.lower()} número {i}. " * 2}
+
+
+def make_character(i: int, owner_id: str) -> dict:
+    return {
+        "_id": ObjectId(),
+        "owner_id": owner_id,
+        "name": f"Personaje {i}",
+        "physical": [_trait("Físico", k) for k in range(4)],
+        "mental": [_trait("Mental", k) for k in range(4)],
+        "skills": [_trait("Habilidad", k) for k in range(5)],
+        "flaws": [_trait("Defecto", k) for k in range(3)],
+        "background": _LOREM * 6,
+        "beliefs": "Cree en la lealtad por encima de todo y desconfía de los magos. " * 3,
+    }
+
+
+def make_room() -> dict:
+    """Documento de sala tal como sale de Mongo (con ObjectId anidados)."""
+    member_ids = [str(ObjectId()) for _ in range(PLAYERS)]
+    base = datetime(2025, 1, 1, 12, 0, 0)
+    selected = []
+    for i, uid in enumerate(member_ids):
+        ch = make_character(i, uid)
+        selected.append({
+            "user_id": uid,
+            "character_id": str(ch["_id"]),
+            "character_name": ch["name"],
+            "character": ch,
+        })
+    messages = [
+        {
+            "user_id": member_ids[i % PLAYERS],
+            "username": f"jugador{i % PLAYERS}",
+            "message": f"Mensaje de chat número {i}: ¿vamos por la puerta norte o por el pasadizo?",
+            "message_type": "chat",
+            "timestamp": (base + timedelta(seconds=i)).isoformat(),
+        }
+        for i in range(CHAT_MESSAGES)
+    ]
+    return {
+        "_id": ObjectId(),
+        "name": "Sala de benchmark",
+        "world_id": ObjectId(),
+        "admin_id": member_ids[0],
+        "owner_id": member_ids[0],
+        "member_ids": member_ids,
+        "members": [{"user_id": uid, "username": f"jugador{i}", "is_ready": True} for i, uid in enumerate(member_ids)],
+        "ready_players": member_ids[:3],
+        "selected_characters": selected,
+        "messages": messages,
+        "pending_actions": [
+            {
+                "user_id": uid,
+                "username": f"jugador{i}",
+                "character_id": selected[i]["character_id"],
+                "character_name": selected[i]["character_name"],
+                "action": "Examino las runas del altar buscando un mecanismo oculto.",
+                "timestamp": base.isoformat(),
+                "status": "pending",
+            }
+            for i, uid in enumerate(member_ids)
+        ],
+        "world": {
+            "_id": ObjectId(),
+            "title": "Reinos de Bruma",
+            "summary": _LOREM * 2,
+            "logic": "La magia consume recuerdos.",
+            "time_period": "Medieval",
+            "space_setting": "Archipiélago",
+            "creator_id": member_ids[0],
+        },
+        "game_state": "waiting",
+        "max_players": PLAYERS,
+        "current_chapter": 0,
+        "chapters": [],
+        "created_at": base,
+    }
+
+
+def make_chapters(game_id: str) -> list:
+    base = datetime(2025, 1, 1, 12, 0, 0)
+    return [
+        {
+            "_id": ObjectId(),
+            "game_id": game_id,
+            "chapter_number": n,
+            "content": (_LOREM * 40).strip() + f" Fin del capítulo {n}.",
+            "created_at": (base + timedelta(minutes=5 * n)).isoformat(),
+            "created_by": ObjectId(),
+        }
+        for n in range(1, CHAPTERS + 1)
+    ]
+
+
+def make_game_payload() -> dict:
+    """Carga útil de partida: meta, miembros, capítulos y acciones."""
+    game_id = ObjectId()
+    room = make_room()
+    return {
+        "game": {
+            "_id": game_id,
+            "room_id": room["_id"],
+            "name": "Partida de benchmark",
+            "world_id": room["world_id"],
+            "max_chapters": CHAPTERS,
+            "settings": {"discussion_time": 300, "auto_continue": False},
+            "current_chapter": CHAPTERS,
+            "game_state": "action_phase",
+            "created_at": datetime(2025, 1, 1, 12, 0, 0),
+        },
+        "members": [
+            {"_id": ObjectId(), "game_id": str(game_id), "user_id": uid, "role": "player"}
+            for uid in room["member_ids"]
+        ],
+        "chapters": make_chapters(str(game_id)),
+        "actions": [
+            dict(a, _id=ObjectId(), game_id=str(game_id), chapter_number=CHAPTERS)
+            for a in room["pending_actions"]
+        ],
+    }
@@ -0,0 +1,101 @@
+"""Registro de latencias del harness de carga y resumen por percentiles."""
+import asyncio
+import math
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+class Metrics:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.started_at = time.monotonic()
+
+    def record(self, name: str, seconds: float) -> None:
+        self.samples[name].append(seconds)
+
+    def error(self, name: str) -> None:
+        self.errors[name] += 1
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] += n
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        out = {}
+        for name in sorted(set(self.samples) | set(self.errors)):
+            values = self.samples.get(name, [])
+            out[name] = {
+                "n": len(values),
+                "errors": self.errors.get(name, 0),
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+                "max_ms": round(max(values) * 1000, 1) if values else 0.0,
+            }
+        return out
+
+    def report(self) -> str:
+        lines = [f"{'step':<34}{'n':>7}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        for name, row in self.summary().items():
+            lines.append(
+                f"{name:<34}{row['n']:>7}{row['errors']:>6}{row['p50_ms']:>10.1f}"
+                f"{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}"
+            )
+        if self.counters:
+            lines.append("")
+            lines.extend(f"{name}: {value}" for name, value in sorted(self.counters.items()))
+        lines.append(f"\nduración: {time.monotonic() - self.started_at:.1f}s")
+        return "\n".join(lines)
+
+
+async def monitor_loop_lag(metrics: Metrics, name: str = "harness:loop_lag", interval: float = 0.1) -> None:
+    """Retraso del event loop del propio harness: si crece, el cuello de botella es el cliente, no el servidor."""
+    while True:
+        expected = time.monotonic() + interval
+        await asyncio.sleep(interval)
+        metrics.record(name, max(0.0, time.monotonic() - expected))
+
+
+async def probe_server(client, metrics: Metrics, path: str = "/", interval: float = 0.5,
+                       name: str = "server:probe") -> None:
+    """Latencia de un endpoint trivial durante la prueba: aproxima el retraso del event loop del servidor."""
+    while True:
+        started = time.monotonic()
+        try:
+            response = await client.get(path)
+            response.raise_for_status()
+            metrics.record(name, time.monotonic() - started)
+        except Exception:
+            metrics.error(name)
+        await asyncio.sleep(interval)
+
+
+class FanoutTracker:
+    """Diferencia entre el primer y el último cliente que reciben el mismo evento.
+
+    El evento se identifica por (canal, epoch, seq): el canal es la ruta real
+    del WebSocket (sala o partida concreta) y el epoch distingue reinicios del
+    servidor, así que seqs iguales de partidas distintas no se mezclan.
+    """
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self.first_seen: Dict[tuple, float] = {}
+
+    def seen(self, channel: str, epoch: Optional[str], seq: Optional[int], at: float) -> None:
+        if seq is None:
+            return
+        key = (channel, epoch, seq)
+        first = self.first_seen.setdefault(key, at)
+        if first != at:
+            self.metrics.record("ws:broadcast_fanout", at - first)
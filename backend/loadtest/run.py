@@ -0,0 +1,341 @@
+"""Prueba de carga de extremo a extremo: salas y partidas simuladas.
+
+Cada partida simulada recorre el flujo real de los jugadores contra un backend
+en marcha: registro + verificación + login, personaje, crear/unirse a sala,
+seleccionar personaje, listo (WebSocket de sala), canal de la partida,
+acciones y "continuar" en cada capítulo hasta el final.
+
+Preparar el servidor con el LLM simulado (sin coste) y una Mongo local:
+
+    LLM_PROVIDER=fake DB_URI=mongodb://localhost:27017 uvicorn app.main:app --port 8000
+
+y lanzar desde `backend/` (usa la misma DB_URI/DB_NAME para leer los tokens de verificación):
+
+    python -m loadtest.run --games 20 --players 4 --chapters 3
+
+Informa p50/p95/p99 por paso, el retraso de entrega de broadcasts (del
+disparo a la recepción, y entre el primer y el último cliente), la duración
+de cada turno (último "continuar" -> capítulo nuevo) y el retraso del event
+loop del harness y del servidor (latencia de `/` durante la prueba).
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlparse
+
+import httpx
+import websockets
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.core.config import settings
+from loadtest.metrics import FanoutTracker, Metrics, monitor_loop_lag, probe_server
+
+_PASSWORD = "loadtest-password"
+_ACTIONS = (
+    "Examino las marcas de la pared buscando un mecanismo oculto.",
+    "Me adelanto con la antorcha para iluminar el pasillo.",
+    "Intento convencer al guardia de que somos mercaderes.",
+    "Preparo una emboscada detrás de las columnas.",
+)
+
+
+class StepError(Exception):
+    pass
+
+
+class SimPlayer:
+    def __init__(self, run_id: str, index: int, base_url: str, metrics: Metrics, fanout: FanoutTracker):
+        self.run_id = run_id
+        self.index = index
+        self.email = f"loadtest+{run_id}-{index}@example.com"
+        self.username = f"lt_{run_id}_{index}"
+        self.base_url = base_url
+        self.metrics = metrics
+        self.fanout = fanout
+        self.client = httpx.AsyncClient(base_url=base_url, timeout=120)
+        self.user_id: Optional[str] = None
+        self.character_id: Optional[str] = None
+        self.sockets: Dict[str, Any] = {}
+        self.readers: Dict[str, asyncio.Task] = {}
+        self.events: Dict[str, asyncio.Queue] = {}
+        # Por socket: ruta del canal (sala/partida concreta) y epoch anunciado en "session"
+        self.channels: Dict[str, str] = {}
+        self.epochs: Dict[str, Any] = {}
+        # Disparos pendientes: tipo de evento esperado -> instante en que se envió la petición
+        self.triggers: Dict[str, float] = {}
+
+    # ---------- HTTP ----------
+
+    async def call(self, step: str, method: str, path: str, ok_statuses=(200,), **kwargs) -> Any:
+        started = time.monotonic()
+        try:
+            response = await self.client.request(method, path, **kwargs)
+        except Exception as e:
+            self.metrics.error(step)
+            raise StepError(f"{step}: {e}") from e
+        elapsed = time.monotonic() - started
+        if response.status_code not in ok_statuses:
+            self.metrics.error(step)
+            raise StepError(f"{step}: HTTP {response.status_code} {response.text[:200]}")
+        self.metrics.record(step, elapsed)
+        return response.json() if response.content else None
+
+    async def signup(self, db) -> None:
+        await self.call("auth:register", "POST", "/api/auth/register",
+                        json={"email": self.email, "username": self.username, "password": _PASSWORD})
+        user = await db["users"].find_one({"email": self.email})
+        token = await db["verification_tokens"].find_one({"user_id": str(user["_id"])})
+        await self.call("auth:verify_email", "POST", "/api/auth/verify-email", json={"token": token["token"]})
+        data = await self.call("auth:login", "POST", "/api/auth/login",
+                               json={"email": self.email, "password": _PASSWORD})
+        self.user_id = data["user"]["id"]
+        self.token = data["access_token"]
+        self.client.headers["Authorization"] = f"Bearer {self.token}"
+
+    async def create_character(self) -> None:
+        def traits(kind: str) -> list:
+            return [{"name": f"{kind} {i}", "description": f"Rasgo {kind.lower()} {i} del personaje."} for i in range(3)]
+        data = await self.call("characters:create", "POST", "/api/characters", json={
+            "name": f"Heroína {self.index}",
+            "physical": traits("Físico"),
+            "mental": traits("Mental"),
+            "skills": traits("Habilidad"),
+            "flaws": traits("Defecto"),
+            "background": "Creció en los muelles y aprendió a sobrevivir entre contrabandistas. " * 3,
+            "beliefs": "La lealtad se gana, no se exige.",
+        })
+        self.character_id = data.get("_id") or data.get("id")
+
+    # ---------- WebSocket ----------
+
+    async def open_socket(self, name: str, path: str) -> None:
+        scheme = "wss" if urlparse(self.base_url).scheme == "https" else "ws"
+        url = f"{scheme}://{urlparse(self.base_url).netloc}{path}?token={self.token}"
+        started = time.monotonic()
+        try:
+            self.sockets[name] = await websockets.connect(url, max_size=None)
+        except Exception as e:
+            self.metrics.error(f"ws:connect_{name}")
+            raise StepError(f"ws connect {name}: {e}") from e
+        self.metrics.record(f"ws:connect_{name}", time.monotonic() - started)
+        self.events[name] = asyncio.Queue()
+        self.channels[name] = path
+        self.epochs[name] = None
+        self.readers[name] = asyncio.create_task(self._read(name))
+
+    async def _read(self, name: str) -> None:
+        ws = self.sockets[name]
+        try:
+            async for frame in ws:
+                at = time.monotonic()
+                message = json.loads(frame)
+                kind = message.get("type")
+                if kind == "ping":
+                    await ws.send(json.dumps({"type": "pong"}))
+                    continue
+                if kind == "session":
+                    self.epochs[name] = (message.get("data") or {}).get("epoch")
+                self.fanout.seen(self.channels[name], self.epochs[name], message.get("seq"), at)
+                triggered = self.triggers.pop(kind, None)
+                if triggered is not None:
+                    self.metrics.record(f"ws:delivery_{kind}", at - triggered)
+                self.metrics.count(f"events:{name}")
+                await self.events[name].put((at, message))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def send(self, name: str, message: dict) -> None:
+        await self.sockets[name].send(json.dumps(message))
+
+    async def wait_for(self, name: str, kind: str, timeout: float,
+                       predicate: Optional[Callable[[dict], bool]] = None) -> tuple:
+        """Descartar eventos hasta recibir uno de tipo `kind` (y que cumpla `predicate`)."""
+        deadline = time.monotonic() + timeout
+        queue = self.events[name]
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.metrics.error(f"wait:{kind}")
+                raise StepError(f"timeout waiting for {kind} on {name}")
+            try:
+                at, message = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                continue
+            if message.get("type") == kind and (predicate is None or predicate(message)):
+                return at, message
+
+    async def close(self) -> None:
+        for task in self.readers.values():
+            task.cancel()
+        for ws in self.sockets.values():
+            try:
+                await ws.close()
+            except Exception:
+                pass
+        await self.client.aclose()
+
+
+async def _world_id(player: SimPlayer) -> str:
+    data = await player.call("worlds:list", "GET", "/api/worlds")
+    worlds = (data.get("my_worlds") or []) + (data.get("public_worlds") or [])
+    if not worlds:
+        raise StepError("no hay mundos disponibles (¿arrancó el backend con los mundos por defecto?)")
+    return worlds[0]["id"]
+
+
+async def run_game(game_no: int, args, db, metrics: Metrics, fanout: FanoutTracker, run_id: str) -> None:
+    rng = random.Random(f"{run_id}-{game_no}")
+    players = [
+        SimPlayer(run_id, game_no * args.players + i, args.base_url, metrics, fanout)
+        for i in range(args.players)
+    ]
+    host, guests = players[0], players[1:]
+    game_started = time.monotonic()
+    try:
+        # Lobby
+        await asyncio.gather(*(p.signup(db) for p in players))
+        await asyncio.gather(*(p.create_character() for p in players))
+        room = await host.call("rooms:create", "POST", "/api/rooms", json={
+            "name": f"loadtest {run_id} #{game_no}",
+            "world_id": await _world_id(host),
+            "max_chapters": args.chapters,
+            "max_players": args.players,
+            "discussion_time": args.discussion_time,
+        })
+        room_id = room.get("_id") or room.get("id")
+        await asyncio.gather(*(p.call("rooms:join", "POST", f"/api/rooms/{room_id}/join") for p in guests))
+        await asyncio.gather(*(p.open_socket("room", f"/api/ws/room/{room_id}") for p in players))
+        await asyncio.gather(*(
+            p.call("rooms:select_character", "POST", f"/api/rooms/{room_id}/select-character",
+                   json={"character_id": p.character_id})
+            for p in players
+        ))
+
+        # Listos: invitados primero, el anfitrión al final inicia la partida
+        for p in guests:
+            await p.send("room", {"type": "toggle_ready"})
+        if guests:
+            await host.wait_for("room", "ready_update", 30,
+                                lambda m: m["data"].get("ready_count", 0) >= len(guests))
+        ready_sent = time.monotonic()
+        await host.send("room", {"type": "toggle_ready"})
+        at, started = await host.wait_for("room", "room:started", 60)
+        metrics.record("game:start", at - ready_sent)
+        game_id = started["data"]["game_id"]
+
+        # Partida
+        await asyncio.gather(*(p.open_socket("game", f"/api/ws/game/{game_id}") for p in players))
+        phase_open = time.monotonic()
+        at, _ = await host.wait_for("game", "game:action_phase_started", args.chapter_timeout)
+        metrics.record("game:first_chapter", at - phase_open)
+
+        for chapter in range(1, args.chapters):
+            async def play_turn(p: SimPlayer) -> None:
+                await asyncio.sleep(rng.uniform(0, args.think_time))
+                if rng.random() < args.action_rate:
+                    p.triggers["game:actions_updated"] = time.monotonic()
+                    await p.call("games:action", "POST", f"/api/games/{game_id}/actions",
+                                 json={"action": rng.choice(_ACTIONS), "character_id": p.character_id})
+                await asyncio.sleep(rng.uniform(0, args.think_time))
+                p.triggers["game:continue_update"] = time.monotonic()
+                # 409: la fase ya se cerró (otro jugador completó el quórum)
+                await p.call("games:continue", "POST", f"/api/games/{game_id}/continue",
+                             json={"ready": True}, ok_statuses=(200, 409))
+
+            await asyncio.gather(*(play_turn(p) for p in players))
+            last_continue = time.monotonic()
+            expected = "game:finished" if chapter + 1 >= args.chapters else "game:chapter_created"
+            at, _ = await host.wait_for(
+                "game", expected, args.chapter_timeout,
+                None if expected == "game:finished" else lambda m, n=chapter + 1: m["data"].get("chapter_number") == n,
+            )
+            metrics.record("game:turn", at - last_continue)
+
+        metrics.record("game:total", time.monotonic() - game_started)
+        metrics.count("games:completed")
+    except StepError as e:
+        metrics.count("games:failed")
+        print(f"[loadtest] game {game_no} failed: {e}")
+    finally:
+        await asyncio.gather(*(p.close() for p in players), return_exceptions=True)
+
+
+async def cleanup(db, run_id: str) -> None:
+    users = [u async for u in db["users"].find({"username": {"$regex": f"^lt_{run_id}_"}}, {"_id": 1})]
+    user_ids = [str(u["_id"]) for u in users]
+    games = [str(g["_id"]) async for g in db["games"].find({"admin_id": {"$in": user_ids}}, {"_id": 1})]
+    for name in ("game_members", "game_messages", "game_actions", "game_chapters"):
+        await db[name].delete_many({"game_id": {"$in": games}})
+    await db["games"].delete_many({"admin_id": {"$in": user_ids}})
+    await db["rooms"].delete_many({"admin_id": {"$in": user_ids}})
+    await db["characters"].delete_many({"owner_id": {"$in": user_ids}})
+    await db["verification_tokens"].delete_many({"user_id": {"$in": user_ids}})
+    await db["users"].delete_many({"_id": {"$in": [u["_id"] for u in users]}})
+    print(f"[loadtest] cleanup: {len(user_ids)} users, {len(games)} games removed")
+
+
+async def main(args) -> None:
+    db_uri = args.db_uri or settings.DB_URI
+    host = urlparse(db_uri).hostname or ""
+    if host not in ("localhost", "127.0.0.1", "mongo") and not args.allow_remote_db:
+        raise SystemExit(f"DB_URI apunta a {host!r}: el harness crea usuarios y partidas; usa una Mongo local o --allow-remote-db")
+    mongo = AsyncIOMotorClient(db_uri)
+    db = mongo[args.db_name or settings.DB_NAME]
+    run_id = uuid.uuid4().hex[:8]
+    metrics = Metrics()
+    fanout = FanoutTracker(metrics)
+    monitors = [asyncio.create_task(monitor_loop_lag(metrics))]
+    probe_client = httpx.AsyncClient(base_url=args.base_url, timeout=30)
+    monitors.append(asyncio.create_task(probe_server(probe_client, metrics)))
+
+    print(f"[loadtest] run {run_id}: {args.games} games x {args.players} players, {args.chapters} chapters")
+    semaphore = asyncio.Semaphore(args.concurrency or args.games)
+
+    async def bounded(n: int) -> None:
+        async with semaphore:
+            # Escalonar arranques para no medir solo una ráfaga de registros
+            await asyncio.sleep(n * args.ramp_up / max(1, args.games))
+            await run_game(n, args, db, metrics, fanout, run_id)
+
+    try:
+        await asyncio.gather(*(bounded(n) for n in range(args.games)))
+    finally:
+        for task in monitors:
+            task.cancel()
+        await probe_client.aclose()
+        print(metrics.report())
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as fh:
+                json.dump({"run_id": run_id, "args": vars(args), "steps": metrics.summary(),
+                           "counters": dict(metrics.counters)}, fh, indent=2)
+        if not args.keep_data:
+            await cleanup(db, run_id)
+        mongo.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga de salas y partidas de KandaStory")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--games", type=int, default=5, help="partidas simuladas")
+    parser.add_argument("--players", type=int, default=4, help="jugadores por partida")
+    parser.add_argument("--chapters", type=int, default=3, help="capítulos por partida")
+    parser.add_argument("--concurrency", type=int, default=0, help="partidas simultáneas (0 = todas)")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="segundos para escalonar el arranque")
+    parser.add_argument("--think-time", type=float, default=2.0, help="pausa máxima antes de cada acción/continuar")
+    parser.add_argument("--action-rate", type=float, default=0.7, help="probabilidad de proponer acción por turno")
+    parser.add_argument("--discussion-time", type=int, default=120, help="duración de la fase de acciones")
+    parser.add_argument("--chapter-timeout", type=float, default=180.0)
+    parser.add_argument("--db-uri", default=None, help="por defecto DB_URI de la configuración")
+    parser.add_argument("--db-name", default=None)
+    parser.add_argument("--allow-remote-db", action="store_true")
+    parser.add_argument("--keep-data", action="store_true", help="no borrar usuarios/partidas creados")
+    parser.add_argument("--json", default=None, help="guardar el resumen en este fichero")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
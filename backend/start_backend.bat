@@ -63,4 +63,4 @@ echo 📖 Documentación disponible en http://127.0.0.1:8000/docs
 echo 🛑 Presiona Ctrl+C para detener el servidor
 echo.
 
-uvicorn app.main:app --reload --host 0.0.0.0 --port 8000
+uvicorn app.main:app --reload --host 0.0.0.0 --port 8000 --ws websockets --ws-per-message-deflate true
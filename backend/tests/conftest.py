@@ -0,0 +1,39 @@
+"""Configuración común de los tests.
+
+`Settings` exige estas variables al importar `app.core.config`; en los tests
+no se conecta a Mongo, SMTP ni OpenAI, así que basta con valores de relleno.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+for _name, _value in {
+    "DB_URI": "mongodb://localhost:27017",
+    "JWT_SECRET": "test-secret",
+    "EMAIL_HOST_USER": "test",
+    "EMAIL_HOST_PASSWORD": "test",
+    "DEFAULT_FROM_EMAIL": "test@example.com",
+    "OPENAI_API_KEY": "sk-test",
+}.items():
+    os.environ.setdefault(_name, _value)
+
+
+class FakeClock:
+    """Sustituto de `time.monotonic` que solo avanza cuando el test lo pide."""
+
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
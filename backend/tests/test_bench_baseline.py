@@ -0,0 +1,19 @@
+from benchmarks.bench_hot_paths import comparable_case
+
+ENV = {"python": "3.11.7", "machine": "x86_64", "tokenizer": "tiktoken:o200k_base"}
+
+
+def test_same_environment_is_comparable():
+    assert comparable_case("prompt.fit_history_20", ENV, dict(ENV))
+
+
+def test_tokenizer_only_matters_for_prompt_cases():
+    base = dict(ENV, tokenizer="approx:4chars")
+    assert not comparable_case("prompt.fit_history_20", ENV, base)
+    assert comparable_case("serialize.room_update_ws", ENV, base)
+    assert comparable_case("schemas.game_meta", ENV, base)
+
+
+def test_other_machines_are_never_comparable():
+    assert not comparable_case("serialize.room_update_ws", ENV, dict(ENV, machine="arm64"))
+    assert not comparable_case("schemas.game_meta", ENV, dict(ENV, python="3.12.1"))
@@ -0,0 +1,32 @@
+from app.services.chapter_index import GameChapterIndex, split_passages, tokenize
+
+
+def test_tokenize_folds_accents_and_drops_stopwords():
+    assert tokenize("El Dragón y la dragona") == ["dragon", "dragona"]
+
+
+def test_split_passages_groups_sentences():
+    text = " ".join(f"Frase número {i} con unas cuantas palabras más." for i in range(30))
+    passages = split_passages(text)
+    assert len(passages) > 1
+    assert " ".join(passages) == text
+
+
+def test_search_ranks_matching_passages_first():
+    index = GameChapterIndex()
+    index.add_chapter(1, "El herrero forjó una espada para la reina.")
+    index.add_chapter(2, "La reina cruzó el bosque. El dragón dormía en la cueva del dragón.")
+    index.add_chapter(3, "Los mercaderes discutían el precio del trigo.")
+    ranked = index.search("dragón")
+    assert len(ranked) == 1
+    assert index.passages[ranked[0][1]][0] == 2
+
+
+def test_search_excludes_chapters_and_ignores_duplicates():
+    index = GameChapterIndex()
+    index.add_chapter(1, "La reina guardaba la llave.")
+    index.add_chapter(1, "Texto repetido que no se indexa.")
+    index.add_chapter(2, "La reina perdió la llave en el río.")
+    assert len(index.passages) == 2
+    ranked = index.search("llave reina", exclude_chapters={2})
+    assert [index.passages[doc_id][0] for _, doc_id in ranked] == [1]
@@ -0,0 +1,180 @@
+import asyncio
+import copy
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from app.core.config import settings
+from app.services import generation_queue
+
+
+def _matches(doc, query):
+    for field, cond in query.items():
+        if field == "$or":
+            if not any(_matches(doc, sub) for sub in cond):
+                return False
+        elif isinstance(cond, dict):
+            for op, value in cond.items():
+                if op == "$lt" and not (field in doc and doc[field] < value):
+                    return False
+                if op == "$exists" and (field in doc) != value:
+                    return False
+        elif doc.get(field) != cond:
+            return False
+    return True
+
+
+def _apply(doc, update):
+    doc.update(update.get("$set", {}))
+    for field, n in update.get("$inc", {}).items():
+        doc[field] = doc.get(field, 0) + n
+    for field in update.get("$unset", {}):
+        doc.pop(field, None)
+
+
+class FakeJobs:
+    """Lo justo de una colección de Mongo para `generation_jobs`."""
+
+    def __init__(self):
+        self.docs = []
+
+    async def insert_one(self, doc):
+        key = doc.get("dedupe_key")
+        if key and any(d.get("active") and d.get("dedupe_key") == key for d in self.docs):
+            raise DuplicateKeyError("dedupe_key")
+        doc = dict(doc, _id=ObjectId())
+        self.docs.append(doc)
+        return type("InsertResult", (), {"inserted_id": doc["_id"]})()
+
+    async def find_one_and_update(self, query, update, sort=None, return_document=None):
+        candidates = [d for d in self.docs if _matches(d, query)]
+        for field, direction in reversed(sort or []):
+            candidates.sort(key=lambda d: d[field], reverse=direction < 0)
+        if not candidates:
+            return None
+        _apply(candidates[0], update)
+        return copy.deepcopy(candidates[0])
+
+    async def update_one(self, query, update):
+        for doc in self.docs:
+            if _matches(doc, query):
+                _apply(doc, update)
+                return
+
+    def get(self, job_id):
+        return next(d for d in self.docs if d["_id"] == ObjectId(job_id))
+
+
+class FakeDB(dict):
+    def __init__(self):
+        super().__init__(generation_jobs=FakeJobs())
+
+    @property
+    def jobs(self) -> FakeJobs:
+        return self["generation_jobs"]
+
+
+@pytest.fixture
+def db():
+    return FakeDB()
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    monkeypatch.setattr(generation_queue, "_handlers", {})
+    monkeypatch.setattr(generation_queue, "_failure_handlers", {})
+    monkeypatch.setattr(settings, "GENERATION_JOB_LEASE_SECONDS", 60)
+    monkeypatch.setattr(settings, "GENERATION_JOB_MAX_ATTEMPTS", 2)
+
+
+def _expire_lease(db, job_id):
+    db.jobs.get(job_id)["lease_until"] = datetime.utcnow() - timedelta(seconds=1)
+
+
+def test_claim_takes_oldest_queued_job(db):
+    async def scenario():
+        first = await generation_queue.enqueue(db, "advance_chapter", {"game_id": "g1"})
+        await generation_queue.enqueue(db, "advance_chapter", {"game_id": "g2"})
+        db.jobs.get(first)["created_at"] -= timedelta(seconds=5)
+        return first, await generation_queue.claim(db, "worker-a")
+
+    first, job = asyncio.run(scenario())
+    assert str(job["_id"]) == first
+    assert job["status"] == "running"
+    assert job["worker_id"] == "worker-a"
+    assert job["attempts"] == 1
+    assert job["lease_until"] > datetime.utcnow()
+
+
+def test_running_job_is_not_claimed_until_its_lease_expires(db):
+    async def scenario():
+        job_id = await generation_queue.enqueue(db, "advance_chapter", {"game_id": "g1"})
+        await generation_queue.claim(db, "worker-a")
+        assert await generation_queue.claim(db, "worker-b") is None
+        _expire_lease(db, job_id)
+        return await generation_queue.claim(db, "worker-b")
+
+    job = asyncio.run(scenario())
+    assert job["worker_id"] == "worker-b"
+    assert job["attempts"] == 2
+
+
+def test_enqueue_dedupes_active_jobs(db):
+    async def scenario():
+        first = await generation_queue.enqueue(db, "advance_chapter", {}, dedupe_key="game:g1:2")
+        duplicate = await generation_queue.enqueue(db, "advance_chapter", {}, dedupe_key="game:g1:2")
+        db.jobs.get(first)["active"] = False
+        again = await generation_queue.enqueue(db, "advance_chapter", {}, dedupe_key="game:g1:2")
+        return first, duplicate, again
+
+    first, duplicate, again = asyncio.run(scenario())
+    assert first and duplicate is None and again and again != first
+
+
+def test_failed_job_is_retried_then_reported(db, handlers):
+    calls, failures = [], []
+
+    async def handler(db, game_id):
+        calls.append(game_id)
+        raise RuntimeError("llm down")
+
+    async def on_failure(db, error, game_id):
+        failures.append((game_id, error))
+
+    generation_queue.register("initialize_game", handler, on_failure=on_failure)
+
+    async def scenario():
+        job_id = await generation_queue.enqueue(db, "initialize_game", {"game_id": "g1"})
+        job = await generation_queue.claim(db, "worker-a")
+        await generation_queue.process_job(db, job, "worker-a")
+        assert db.jobs.get(job_id)["status"] == "queued"
+        assert failures == []
+        job = await generation_queue.claim(db, "worker-a")
+        await generation_queue.process_job(db, job, "worker-a")
+        return db.jobs.get(job_id)
+
+    job = asyncio.run(scenario())
+    assert calls == ["g1", "g1"]
+    assert job["status"] == "failed" and job["active"] is False
+    assert "lease_until" not in job
+    assert failures == [("g1", "RuntimeError: llm down")]
+
+
+def test_stale_worker_cannot_finish_a_reclaimed_job(db, handlers):
+    async def handler(db):
+        pass
+
+    generation_queue.register("room_chapter", handler)
+
+    async def scenario():
+        job_id = await generation_queue.enqueue(db, "room_chapter", {})
+        stale = await generation_queue.claim(db, "worker-a")
+        _expire_lease(db, job_id)
+        await generation_queue.claim(db, "worker-b")
+        await generation_queue.process_job(db, stale, "worker-a")
+        return db.jobs.get(job_id)
+
+    job = asyncio.run(scenario())
+    assert job["status"] == "running" and job["worker_id"] == "worker-b"
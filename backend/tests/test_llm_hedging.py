@@ -0,0 +1,90 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import httpx
+
+from app.services import llm_resilience
+from app.services.llm_hedging import StreamAttempt
+
+
+class FakeStream:
+    def __init__(self, words=(), error=None):
+        self.words = list(words)
+        self.error = error
+        self.closed = False
+
+    def __iter__(self):
+        for word in self.words:
+            yield SimpleNamespace(model="fake", usage=None,
+                                  choices=[SimpleNamespace(delta=SimpleNamespace(content=word))])
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+def _run_in_thread(streams, on_open=None):
+    async def scenario():
+        opened = []
+
+        def open_stream():
+            opened.append(streams[len(opened)])
+            if on_open is not None:
+                on_open(attempt, len(opened))
+            return opened[-1]
+
+        attempt = StreamAttempt(open_stream, asyncio.get_running_loop(), prompt_tokens=10)
+        result = await asyncio.to_thread(attempt.run)
+        return attempt, opened, result
+
+    return asyncio.run(scenario())
+
+
+def test_stream_error_is_retried_with_a_new_stream(monkeypatch):
+    monkeypatch.setattr(llm_resilience, "record_stream_failure", lambda e, attempt, produced_output: 0.01)
+    streams = [FakeStream(error=httpx.RemoteProtocolError("reset")), FakeStream(["Había", " una", " vez"])]
+    _, opened, result = _run_in_thread(streams)
+    assert len(opened) == 2 and all(s.closed for s in opened)
+    assert result.choices[0].message.content == "Había una vez"
+
+
+def test_cancelled_attempt_does_not_reopen_after_backoff(monkeypatch):
+    backing_off = threading.Event()
+
+    def record_stream_failure(e, attempt, produced_output):
+        backing_off.set()
+        return 5.0
+
+    monkeypatch.setattr(llm_resilience, "record_stream_failure", record_stream_failure)
+
+    def cancel_during_backoff(attempt, n):
+        threading.Thread(target=lambda: backing_off.wait(5) and attempt.cancel()).start()
+
+    streams = [FakeStream(error=httpx.RemoteProtocolError("reset")), FakeStream(["no"])]
+    _, opened, result = _run_in_thread(streams, on_open=cancel_during_backoff)
+    assert result is None
+    assert len(opened) == 1
+
+
+def test_cancel_before_start_opens_nothing():
+    async def scenario():
+        opened = []
+        attempt = StreamAttempt(lambda: opened.append(1) or FakeStream(["x"]), asyncio.get_running_loop(), 0)
+        attempt.cancel()
+        return opened, await asyncio.to_thread(attempt.run)
+
+    assert asyncio.run(scenario()) == ([], None)
+
+
+def test_tokens_spent_falls_back_to_chunk_estimate():
+    loop = asyncio.new_event_loop()
+    try:
+        attempt = StreamAttempt(lambda: None, loop, prompt_tokens=100)
+    finally:
+        loop.close()
+    attempt.chunks = 7
+    assert attempt.tokens_spent == 107
+    attempt.usage = SimpleNamespace(total_tokens=150)
+    assert attempt.tokens_spent == 150
@@ -0,0 +1,99 @@
+import openai
+import pytest
+
+from app.core.config import settings
+from app.services import llm_resilience
+from app.services.llm_provider import FakeLLMProvider, get_provider
+
+MESSAGES = [
+    {"role": "system", "content": "Eres el narrador."},
+    {"role": "user", "content": "Los héroes entran en la cripta."},
+]
+
+
+@pytest.fixture(autouse=True)
+def fast_fake(monkeypatch):
+    monkeypatch.setattr(settings, "FAKE_LLM_LATENCY_P50_MS", 1)
+    monkeypatch.setattr(settings, "FAKE_LLM_LATENCY_P95_MS", 2)
+    monkeypatch.setattr(settings, "FAKE_LLM_COMPLETION_TOKENS", 60)
+    monkeypatch.setattr(settings, "FAKE_LLM_ERROR_RATE", 0.0)
+
+
+def _text(response):
+    return response.choices[0].message.content
+
+
+def test_same_prompt_gives_same_chapter():
+    first = _text(FakeLLMProvider(seed=1).create(model="gpt-4o-mini", messages=MESSAGES))
+    again = _text(FakeLLMProvider(seed=1).create(model="gpt-4o-mini", messages=MESSAGES))
+    assert first and first == again
+
+
+def test_prompt_and_seed_change_the_chapter():
+    provider = FakeLLMProvider(seed=1)
+    base = _text(provider.create(model="gpt-4o-mini", messages=MESSAGES))
+    other_prompt = MESSAGES[:1] + [{"role": "user", "content": "Huyen de la cripta."}]
+    assert _text(provider.create(model="gpt-4o-mini", messages=other_prompt)) != base
+    assert _text(FakeLLMProvider(seed=2).create(model="gpt-4o-mini", messages=MESSAGES)) != base
+
+
+def test_stream_matches_the_non_streaming_text_and_reports_usage():
+    provider = FakeLLMProvider(seed=1)
+    full = provider.create(model="gpt-4o-mini", messages=MESSAGES)
+    chunks = list(provider.create(model="gpt-4o-mini", messages=MESSAGES, stream=True,
+                                  stream_options={"include_usage": True}))
+    text = "".join(c.choices[0].delta.content for c in chunks if c.choices)
+    assert text == _text(full)
+    assert chunks[-1].choices == [] and chunks[-1].usage.total_tokens == full.usage.total_tokens
+
+
+@pytest.mark.parametrize("kind, error_cls, classified", [
+    ("rate_limit", openai.RateLimitError, llm_resilience.ERROR_RATE_LIMIT),
+    ("connection", openai.APIConnectionError, llm_resilience.ERROR_CONNECTION),
+    ("timeout", openai.APITimeoutError, llm_resilience.ERROR_TIMEOUT),
+    ("overloaded", openai.InternalServerError, llm_resilience.ERROR_OVERLOADED),
+    ("bad_request", openai.BadRequestError, llm_resilience.ERROR_BAD_REQUEST),
+])
+def test_injected_errors_use_the_sdk_exceptions(monkeypatch, kind, error_cls, classified):
+    monkeypatch.setattr(settings, "FAKE_LLM_ERROR_RATE", 1.0)
+    monkeypatch.setattr(settings, "FAKE_LLM_ERROR_KINDS", kind)
+    provider = FakeLLMProvider(seed=1)
+    with pytest.raises(error_cls) as raised:
+        provider.create(model="gpt-4o-mini", messages=MESSAGES)
+    assert llm_resilience.classify_error(raised.value) == classified
+    assert provider.snapshot()["errors"] == 1
+
+
+def test_error_rate_is_reproducible_per_seed(monkeypatch):
+    monkeypatch.setattr(settings, "FAKE_LLM_ERROR_RATE", 0.5)
+
+    def outcomes(seed):
+        provider = FakeLLMProvider(seed=seed)
+        result = []
+        for _ in range(20):
+            try:
+                provider.create(model="gpt-4o-mini", messages=MESSAGES)
+                result.append("ok")
+            except openai.OpenAIError:
+                result.append("error")
+        return result
+
+    assert outcomes(3) == outcomes(3)
+    assert "ok" in outcomes(3) and "error" in outcomes(3)
+
+
+def test_repeated_long_prefix_is_reported_as_cached():
+    provider = FakeLLMProvider(seed=1)
+    messages = [{"role": "system", "content": "palabra " * 3000}, MESSAGES[1]]
+    first = provider.create(model="gpt-4o-mini", messages=messages)
+    second = provider.create(model="gpt-4o-mini", messages=messages)
+    assert first.usage.prompt_tokens_details.cached_tokens == 0
+    assert second.usage.prompt_tokens_details.cached_tokens >= 1024
+
+
+def test_get_provider_selects_fake(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_PROVIDER", "fake")
+    assert isinstance(get_provider(), FakeLLMProvider)
+    monkeypatch.setattr(settings, "LLM_PROVIDER", "otro")
+    with pytest.raises(ValueError):
+        get_provider()
@@ -0,0 +1,71 @@
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from app.services import llm_resilience
+from app.services.llm_resilience import CircuitBreaker, CircuitOpenError
+
+
+@pytest.fixture
+def clock(clock, monkeypatch):
+    # Solo el reloj del módulo, no `time.monotonic` de todo el proceso
+    monkeypatch.setattr(llm_resilience, "time", SimpleNamespace(monotonic=clock, sleep=time.sleep))
+    return clock
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, cooldown_seconds=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()  # un éxito reinicia la cuenta
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and breaker.times_opened == 1
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_breaker_lets_a_single_trial_through_after_cooldown(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=30)
+    breaker.record_failure()
+    clock.advance(31)
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_failed_trial_reopens_the_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=5, cooldown_seconds=30)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.advance(31)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and breaker.times_opened == 2
+    assert breaker.is_open()
+
+
+def test_disabled_breaker_never_opens(clock):
+    breaker = CircuitBreaker(failure_threshold=0, cooldown_seconds=30)
+    for _ in range(10):
+        breaker.record_failure()
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.parametrize("exc, kind", [
+    (CircuitOpenError(), llm_resilience.ERROR_OVERLOADED),
+    (httpx.ReadTimeout("read"), llm_resilience.ERROR_TIMEOUT),
+    (httpx.RemoteProtocolError("peer closed"), llm_resilience.ERROR_CONNECTION),
+    (ValueError("boom"), llm_resilience.ERROR_OTHER),
+])
+def test_classify_error(exc, kind):
+    assert llm_resilience.classify_error(exc) == kind
@@ -0,0 +1,192 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.config import settings
+from app.services import llm_scheduler
+from app.services.llm_scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_EVALUATION,
+    PRIORITY_LIVE_CHAPTER,
+    PRIORITY_SPECULATIVE,
+    LLMScheduler,
+    SchedulerBusyError,
+    TokenBucket,
+)
+
+
+@pytest.fixture
+def clock(clock, monkeypatch):
+    # Solo el reloj del planificador: el del event loop sigue siendo el real
+    monkeypatch.setattr(llm_scheduler, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+# ---------- TokenBucket ----------
+
+def test_bucket_refills_continuously(clock):
+    bucket = TokenBucket(60)  # 1 por segundo
+    bucket.consume(60)
+    assert bucket.time_until(1) == pytest.approx(1.0)
+    clock.advance(0.5)
+    assert bucket.time_until(1) == pytest.approx(0.5)
+    clock.advance(0.5)
+    assert bucket.time_until(1) == 0.0
+
+
+def test_bucket_refill_is_capped_at_capacity(clock):
+    bucket = TokenBucket(60)
+    bucket.consume(30)
+    clock.advance(3600)
+    bucket.consume(0)
+    assert bucket.level == pytest.approx(60)
+
+
+def test_bucket_admits_request_larger_than_capacity_when_full(clock):
+    bucket = TokenBucket(100)
+    assert bucket.time_until(500) == 0.0
+    bucket.consume(500)
+    # Queda en negativo: hay que esperar a que se vuelva a llenar entero
+    assert bucket.time_until(500) == pytest.approx(500 * 60 / 100)
+
+
+def test_bucket_without_limit_never_waits(clock):
+    bucket = TokenBucket(0)
+    assert bucket.unlimited
+    bucket.consume(10**9)
+    assert bucket.time_until(10**9) == 0.0
+
+
+# ---------- LLMScheduler ----------
+
+async def _settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def test_grants_by_priority_then_round_robin_by_key(clock):
+    async def scenario():
+        scheduler = LLMScheduler(rpm=1, tpm=0)  # una petición por minuto
+        scheduler.start()
+        await scheduler.acquire(PRIORITY_BACKGROUND, "warmup")  # agota el bucket
+
+        granted = []
+
+        async def request(priority, key, label):
+            await scheduler.acquire(priority, key)
+            granted.append(label)
+
+        tasks = [
+            asyncio.create_task(request(PRIORITY_BACKGROUND, "g3", "background")),
+            asyncio.create_task(request(PRIORITY_LIVE_CHAPTER, "g1", "live-g1-a")),
+            asyncio.create_task(request(PRIORITY_LIVE_CHAPTER, "g1", "live-g1-b")),
+            asyncio.create_task(request(PRIORITY_EVALUATION, "g4", "evaluation")),
+            asyncio.create_task(request(PRIORITY_LIVE_CHAPTER, "g2", "live-g2")),
+        ]
+        await _settle()
+        assert granted == []
+
+        for _ in tasks:
+            clock.advance(60)
+            scheduler._wakeup.set()
+            await _settle()
+        await asyncio.gather(*tasks)
+        scheduler.stop()
+        return granted
+
+    assert asyncio.run(scenario()) == [
+        "live-g1-a", "live-g2", "live-g1-b", "evaluation", "background",
+    ]
+
+
+def test_one_grant_per_refill(clock):
+    async def scenario():
+        scheduler = LLMScheduler(rpm=1, tpm=0)
+        scheduler.start()
+        await scheduler.acquire(PRIORITY_LIVE_CHAPTER)
+        first = asyncio.create_task(scheduler.acquire(PRIORITY_LIVE_CHAPTER))
+        second = asyncio.create_task(scheduler.acquire(PRIORITY_LIVE_CHAPTER))
+        await _settle()
+        clock.advance(60)
+        scheduler._wakeup.set()
+        await _settle()
+        done = (first.done(), second.done())
+        scheduler.stop()
+        return done
+
+    assert asyncio.run(scenario()) == (True, False)
+
+
+def test_speculative_requests_never_queue(clock):
+    async def scenario():
+        scheduler = LLMScheduler(rpm=1, tpm=0)
+        scheduler.start()
+        await scheduler.acquire(PRIORITY_SPECULATIVE)
+        try:
+            with pytest.raises(SchedulerBusyError):
+                await scheduler.acquire(PRIORITY_SPECULATIVE)
+            assert scheduler.snapshot()["queued"] == {}
+        finally:
+            scheduler.stop()
+
+    asyncio.run(scenario())
+
+
+def test_release_reconciles_reserved_tokens(clock):
+    async def scenario():
+        scheduler = LLMScheduler(rpm=0, tpm=1000)
+        scheduler.start()
+        ticket = await scheduler.acquire(PRIORITY_LIVE_CHAPTER, tokens=400)
+        assert scheduler.tokens.level == pytest.approx(600)
+        ticket.used_tokens = 150
+        scheduler.release(ticket)
+        scheduler.stop()
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert scheduler.tokens.level == pytest.approx(850)
+    assert scheduler.snapshot()["priorities"]["live_chapter"]["used_tokens"] == 150
+
+
+def test_blocking_slot_gives_up_after_the_request_timeout(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_REQUEST_TIMEOUT_SECONDS", 0.2)
+
+    async def scenario():
+        scheduler = LLMScheduler(rpm=1, tpm=0)
+        scheduler.start()
+        await scheduler.acquire(PRIORITY_LIVE_CHAPTER)
+
+        def worker_thread():
+            with scheduler.blocking_slot(PRIORITY_EVALUATION, "g1"):
+                pass
+
+        try:
+            with pytest.raises(SchedulerBusyError):
+                await asyncio.to_thread(worker_thread)
+            await _settle()
+            return scheduler.snapshot()["queued"]
+        finally:
+            scheduler.stop()
+
+    assert asyncio.run(scenario()) == {}
+
+
+def test_blocking_slot_does_not_hang_when_the_scheduler_stops():
+    async def scenario():
+        scheduler = LLMScheduler(rpm=1, tpm=0)
+        scheduler.start()
+        await scheduler.acquire(PRIORITY_LIVE_CHAPTER)
+
+        def worker_thread():
+            with scheduler.blocking_slot(PRIORITY_EVALUATION, "g1"):
+                pass
+
+        waiting = asyncio.ensure_future(asyncio.to_thread(worker_thread))
+        while not scheduler._has_waiters():
+            await asyncio.sleep(0.01)
+        scheduler.stop()
+        with pytest.raises(SchedulerBusyError):
+            await asyncio.wait_for(waiting, 5)
+
+    asyncio.run(scenario())
@@ -0,0 +1,26 @@
+import pytest
+
+from app.core.config import settings
+from app.services.llm_usage import MODEL_PRICING, completion_cost, model_pricing
+
+
+def test_pricing_uses_longest_model_prefix():
+    assert model_pricing("gpt-4o-mini-2024-07-18") == MODEL_PRICING["gpt-4o-mini"]
+    assert model_pricing("modelo-desconocido") is None
+
+
+def test_completion_cost_charges_cached_tokens_at_their_price():
+    price_in, price_cached, price_out = MODEL_PRICING["gpt-4o-mini"]
+    expected = (600 * price_in + 400 * price_cached + 500 * price_out) / 1_000_000
+    assert completion_cost("gpt-4o-mini", 1000, 400, 500) == pytest.approx(expected)
+    assert completion_cost(None, 1000, 0, 500) == 0.0
+
+
+def test_pricing_override_from_settings(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_PRICING_JSON", '{"mi-modelo": [1.0, 0.5, 2.0]}')
+    assert completion_cost("mi-modelo-v2", 1_000_000, 0, 1_000_000) == pytest.approx(3.0)
+
+
+def test_invalid_pricing_override_falls_back_to_defaults(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_PRICING_JSON", "{no es json")
+    assert model_pricing("gpt-4o-mini") == MODEL_PRICING["gpt-4o-mini"]
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import time
+import traceback
+
+from app.core.config import settings
+from app.services import loop_watchdog as watchdog_module
+from app.services.loop_watchdog import LoopWatchdog, call_site
+
+APP = watchdog_module._APP_DIR
+LIB = "/usr/lib/python3.11/site-packages/bcrypt/__init__.py"
+
+
+def _stack(*frames):
+    return traceback.StackSummary.from_list([
+        traceback.FrameSummary(filename, lineno, name, line="") for filename, lineno, name in frames
+    ])
+
+
+def test_call_site_is_the_innermost_app_frame():
+    stack = _stack(
+        (os.path.join(APP, "main.py"), 10, "handler"),
+        (os.path.join(APP, "routers", "auth.py"), 42, "login"),
+        (os.path.join(APP, "core", "security.py"), 7, "verify_password"),
+        (LIB, 120, "hashpw"),
+    )
+    key, blocking_in = call_site(stack)
+    assert key == "app/core/security.py:7 in verify_password"
+    assert blocking_in == f"{LIB}:120 in hashpw"
+
+
+def test_same_call_site_groups_different_library_frames():
+    security = (os.path.join(APP, "core", "security.py"), 7, "verify_password")
+    first, _ = call_site(_stack(security, (LIB, 120, "hashpw")))
+    second, _ = call_site(_stack(security, (LIB, 98, "checkpw")))
+    assert first == second
+
+
+def test_watchdog_frames_are_not_reported_as_the_call_site():
+    stack = _stack(
+        (os.path.join(APP, "routers", "games.py"), 300, "export"),
+        (watchdog_module._THIS_FILE, 1, "_tick"),
+    )
+    assert call_site(stack)[0] == "app/routers/games.py:300 in export"
+
+
+def test_call_site_without_app_frames_falls_back_to_innermost():
+    assert call_site(_stack(("/lib/a.py", 1, "outer"), (LIB, 5, "inner")))[0] == f"{LIB}:5 in inner"
+    assert call_site(_stack()) == ("?", "")
+
+
+def _block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+def test_watchdog_records_a_blocking_call(monkeypatch):
+    monkeypatch.setattr(settings, "LOOP_WATCHDOG_ENABLED", True)
+    monkeypatch.setattr(settings, "LOOP_WATCHDOG_INTERVAL_MS", 20)
+    monkeypatch.setattr(settings, "LOOP_LAG_THRESHOLD_MS", 100)
+
+    async def scenario():
+        watchdog = LoopWatchdog()
+        watchdog.start()
+        try:
+            await asyncio.sleep(0.1)
+            _block_the_loop(0.5)
+            await asyncio.sleep(0.1)
+            return watchdog.snapshot()
+        finally:
+            watchdog.stop()
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot["stalls"] >= 1
+    site = next(s for s in snapshot["sites"] if s["site"].endswith("in _block_the_loop"))
+    assert site["total_ms"] >= 300
+    assert snapshot["lag_ms"]["max"] >= 300
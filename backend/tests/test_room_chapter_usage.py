@@ -0,0 +1,53 @@
+import asyncio
+
+from bson import ObjectId
+
+from app.routers import websockets
+
+
+class FakeCollection:
+    def __init__(self, docs=()):
+        self.docs = {d["_id"]: d for d in docs}
+        self.updates = []
+
+    async def find_one(self, query, *args, **kwargs):
+        return self.docs.get(query.get("_id"))
+
+    async def update_one(self, query, update, **kwargs):
+        self.updates.append((query, update))
+
+
+def test_room_chapter_records_llm_usage(monkeypatch):
+    room_id, world_id = ObjectId(), ObjectId()
+    db = {
+        "rooms": FakeCollection([{
+            "_id": room_id, "world_id": str(world_id), "admin_id": "admin-1",
+            "current_chapter": 1, "max_chapters": 5, "allow_actions": False,
+            "pending_actions": [{"action": "Abro la puerta"}],
+        }]),
+        "worlds": FakeCollection([{"_id": world_id, "name": "Mundo"}]),
+    }
+    call = {"prompt_tokens": 900, "completion_tokens": 300, "cost_usd": 0.01}
+    recorded = []
+
+    async def generate_chapter_with_actions(self, **kwargs):
+        self.last_call = call
+        return "Capítulo dos."
+
+    async def record_generation(db, game, last_call):
+        recorded.append((game, last_call))
+
+    async def noop(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(websockets.AIService, "generate_chapter_with_actions", generate_chapter_with_actions)
+    monkeypatch.setattr(websockets, "record_generation", record_generation)
+    monkeypatch.setattr(websockets, "get_room_data", noop)
+    monkeypatch.setattr(websockets.manager, "broadcast_to_room", noop)
+
+    asyncio.run(websockets._generate_room_chapter(db, str(room_id), chapter_number=2))
+
+    assert recorded == [(
+        {"_id": str(room_id), "world_id": str(world_id), "owner_id": "admin-1"},
+        call,
+    )]
@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from app.services.sampling_profiler import ProfilerBusyError, SamplingProfiler
+
+
+def _spin_until(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def _busy_thread():
+    stop = threading.Event()
+    thread = threading.Thread(target=_spin_until, args=(stop,), name="busy-worker", daemon=True)
+    thread.start()
+    return stop, thread
+
+
+def test_wall_profile_reports_folded_stacks_of_other_threads():
+    stop, thread = _busy_thread()
+    try:
+        result = SamplingProfiler().run(0.3, hz=200)
+    finally:
+        stop.set()
+        thread.join()
+    assert result["samples"] > 0 and result["ticks"] > 0
+    lines = result["folded"].splitlines()
+    busy = [line for line in lines if line.startswith("thread:busy-worker;")]
+    assert busy and any("_spin_until (tests/test_sampling_profiler.py:" in line for line in busy)
+    # Formato de flamegraph.pl: "frame;frame;frame N"
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_idle_threads_can_be_excluded():
+    waiting = threading.Event()
+    thread = threading.Thread(target=waiting.wait, name="idle-waiter", daemon=True)
+    thread.start()
+    try:
+        with_idle = SamplingProfiler().run(0.2, hz=100, idle=True)["folded"]
+        without_idle = SamplingProfiler().run(0.2, hz=100, idle=False)["folded"]
+    finally:
+        waiting.set()
+        thread.join()
+    assert "thread:idle-waiter" in with_idle
+    assert "thread:idle-waiter" not in without_idle
+
+
+def test_only_one_profile_at_a_time():
+    profiler = SamplingProfiler()
+    started = threading.Event()
+    runner = threading.Thread(target=lambda: (started.set(), profiler.run(0.5, hz=10)))
+    runner.start()
+    started.wait()
+    time.sleep(0.05)
+    try:
+        with pytest.raises(ProfilerBusyError):
+            profiler.run(0.1)
+    finally:
+        runner.join()
+    assert profiler.last_run is not None and "folded" not in profiler.last_run
@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.core.config import settings
+from app.services import story_export
+
+
+class FakeCursor:
+    def __init__(self, docs, log):
+        self.docs = docs
+        self.log = log
+        self.closed = False
+
+    def sort(self, field, direction):
+        self.docs = sorted(self.docs, key=lambda d: d[field], reverse=direction < 0)
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed or not self.docs:
+            raise StopAsyncIteration
+        self.log.append("next")
+        return self.docs.pop(0)
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeChapters:
+    def __init__(self, docs):
+        self.docs = docs
+        self.log = []
+        self.cursors = []
+
+    def find(self, query, projection=None, session=None):
+        self.log.append("find")
+        cursor = FakeCursor([d for d in self.docs if d["game_id"] == query["game_id"]], self.log)
+        self.cursors.append(cursor)
+        return cursor
+
+    async def count_documents(self, query, session=None):
+        self.log.append("count")
+        return sum(1 for d in self.docs if d["game_id"] == query["game_id"])
+
+
+class FakeDB(dict):
+    def __init__(self, docs, secondary=None):
+        super().__init__(game_chapters=FakeChapters(docs))
+        self.secondary = secondary
+
+    def with_options(self, **kwargs):
+        return self.secondary
+
+
+def _chapters(n, game_id="g1"):
+    return [{"game_id": game_id, "chapter_number": i, "content": f"Texto del capítulo {i}.\n"}
+            for i in range(n, 0, -1)]
+
+
+async def _collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+@pytest.fixture(autouse=True)
+def primary_reads(monkeypatch):
+    monkeypatch.setattr(settings, "DB_SECONDARY_READS_ENABLED", False)
+    monkeypatch.setattr(story_export, "_pdf_slots", None)
+
+
+def test_text_export_streams_one_chunk_per_chapter():
+    db = FakeDB(_chapters(3) + _chapters(2, game_id="otra"))
+    chunks = asyncio.run(_collect(story_export.iter_text(db, "g1", "La cripta")))
+    assert len(chunks) == 4
+    assert b"".join(chunks).decode("utf-8") == (
+        "La cripta\n\n"
+        + "".join(f"Capítulo {i}\n" + "=" * 20 + f"\n\nTexto del capítulo {i}.\n\n" for i in (1, 2, 3))
+    )
+
+
+def test_markdown_export_uses_headings():
+    db = FakeDB(_chapters(2))
+    text = b"".join(asyncio.run(_collect(story_export.iter_text(db, "g1", "La cripta", markdown=True))))
+    assert text.decode("utf-8") == (
+        "# La cripta\n\n## Capítulo 1\n\nTexto del capítulo 1.\n\n## Capítulo 2\n\nTexto del capítulo 2.\n\n"
+    )
+
+
+def test_export_headers_and_title():
+    assert story_export.export_title({}, "abc") == "Historia abc"
+    assert story_export.attachment_headers("La cripta", "md") == {
+        "Content-Disposition": 'attachment; filename="La_cripta.md"'
+    }
+
+
+def test_pdf_counts_and_reads_chapters_with_the_export_routing(monkeypatch):
+    monkeypatch.setattr(settings, "DB_SECONDARY_READS_ENABLED", True)
+    monkeypatch.setattr(settings, "DB_READ_ROUTING", "games.export=secondary")
+    secondary = FakeDB(_chapters(3))
+    primary = FakeDB(_chapters(3), secondary=secondary)
+    rendered = []
+
+    def render(title, total, next_chapter, out):
+        while (ch := next_chapter()) is not None:
+            rendered.append(ch["chapter_number"])
+        out.write(f"{title}:{total}".encode())
+
+    monkeypatch.setattr(story_export, "_render_pdf", render)
+    pdf = asyncio.run(story_export.render_pdf(primary, "g1", "La cripta"))
+    try:
+        assert pdf.read() == b"La cripta:3"
+    finally:
+        pdf.close()
+    assert rendered == [1, 2, 3]
+    assert primary["game_chapters"].log == []
+    assert secondary["game_chapters"].log[:2] == ["count", "find"]
+    assert all(c.closed for c in secondary["game_chapters"].cursors)
+
+
+def test_cancelled_pdf_export_waits_for_the_render_thread(monkeypatch):
+    monkeypatch.setattr(settings, "EXPORT_PDF_MAX_CONCURRENT", 1)
+    db = FakeDB(_chapters(50))
+    first_chapter = threading.Event()
+    events = []
+
+    def render(title, total, next_chapter, out):
+        try:
+            while (ch := next_chapter()) is not None:
+                first_chapter.set()
+                time.sleep(0.02)
+                out.write(ch["content"].encode())
+            time.sleep(0.05)
+            out.write(b"%%EOF")  # canvas.save()
+            events.append("render finished")
+        except Exception as e:
+            events.append(f"render error: {e!r}")
+
+    monkeypatch.setattr(story_export, "_render_pdf", render)
+
+    async def scenario():
+        export = asyncio.create_task(story_export.render_pdf(db, "g1", "La cripta"))
+        while not first_chapter.is_set():
+            await asyncio.sleep(0.01)
+        export.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await export
+        events.append("request cancelled")
+        return story_export._pdf_slots.locked()
+
+    slots_locked = asyncio.run(scenario())
+    assert events == ["render finished", "request cancelled"]
+    assert not slots_locked
+    chapters = db["game_chapters"]
+    assert chapters.log.count("next") < 50
+    assert all(c.closed for c in chapters.cursors)
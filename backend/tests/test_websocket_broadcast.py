@@ -0,0 +1,49 @@
+import asyncio
+
+from app.core.serialization import ENCODING_JSON, ENCODING_MSGPACK
+from app.routers import websockets
+from app.routers.websockets import ConnectionManager
+
+
+class FakeSocket:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.frames = []
+
+
+def _manager(sockets):
+    manager = ConnectionManager()
+
+    async def send_frame(websocket, frame):
+        if websocket.fail:
+            raise RuntimeError("peer gone")
+        websocket.frames.append(frame)
+
+    manager._send_frame = send_frame
+    for ws, encoding in sockets:
+        manager.active_connections.setdefault("room-1", set()).add(ws)
+        manager.connection_encodings[ws] = encoding
+        manager.connection_channels[ws] = "room-1"
+    return manager
+
+
+def test_broadcast_skips_only_the_encoding_that_fails(monkeypatch):
+    encode = websockets.encode_frame
+
+    def encode_frame(message, encoding):
+        if encoding == ENCODING_MSGPACK:
+            raise TypeError("not serializable")
+        return encode(message, encoding)
+
+    monkeypatch.setattr(websockets, "encode_frame", encode_frame)
+    json_ok, msgpack_client, json_dead = FakeSocket(), FakeSocket(), FakeSocket(fail=True)
+    manager = _manager([
+        (msgpack_client, ENCODING_MSGPACK), (json_ok, ENCODING_JSON), (json_dead, ENCODING_JSON),
+    ])
+
+    asyncio.run(manager.broadcast_to_room({"type": "chapter", "data": {}}, "room-1"))
+
+    assert len(json_ok.frames) == 1
+    assert msgpack_client.frames == []
+    assert json_dead not in manager.active_connections.get("room-1", set())
+    assert msgpack_client in manager.active_connections["room-1"]